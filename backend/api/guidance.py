@@ -4,17 +4,20 @@ from typing import List, Optional
 import os
 import hashlib
 import json
-import time
 import logging
 
-router = APIRouter(prefix="/api/guidance", tags=["guidance"])
+from llm import acomplete, complete, get_client, run_blocking
+from response_cache import ResponseCache
+from single_flight import SingleFlight
 
-# In-memory cache for checklist responses
-# Structure: {hash: {"data": ChecklistResponse, "ts": timestamp}}
-_checklist_cache = {}
+router = APIRouter(prefix="/api/guidance", tags=["guidance"])
 
 # Cache TTL in seconds (15 minutes)
-CACHE_TTL = 15 * 60
+CACHE_TTL = float(os.getenv("CHECKLIST_CACHE_TTL", str(15 * 60)))
+
+# Bounds of the checklist cache: entries, and bytes of serialized responses
+CHECKLIST_CACHE_ENTRIES = int(os.getenv("CHECKLIST_CACHE_ENTRIES", "1024"))
+CHECKLIST_CACHE_BYTES = int(os.getenv("CHECKLIST_CACHE_BYTES", str(16 * 1024 * 1024)))
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -96,22 +99,20 @@ def _generate_context_hash(context: dict) -> str:
     return hashlib.sha256(context_str.encode()).hexdigest()
 
 
-def _is_cache_valid(timestamp: float) -> bool:
-    """Check if cache entry is still valid based on TTL"""
-    return (time.time() - timestamp) < CACHE_TTL
+# Cache for checklist responses: context hash -> ChecklistResponse, in process memory
+# (LRU within CHECKLIST_CACHE_ENTRIES / CHECKLIST_CACHE_BYTES) and in the store shared by all workers;
+# entries expire after CACHE_TTL. Fallback checklists are not cached
+_checklist_cache = ResponseCache(
+    "checklist", ChecklistResponse, ttl=CACHE_TTL,
+    max_entries=CHECKLIST_CACHE_ENTRIES, max_bytes=CHECKLIST_CACHE_BYTES
+)
 
+# LLM explanations: hash of item and context -> ExplainResponse (fallback explanations are not cached)
+_explain_cache = ResponseCache("explain", ExplainResponse)
 
-def _clean_expired_cache():
-    """Remove expired entries from cache"""
-    current_time = time.time()
-    expired_keys = [
-        key for key, value in _checklist_cache.items()
-        if (current_time - value["ts"]) >= CACHE_TTL
-    ]
-    for key in expired_keys:
-        del _checklist_cache[key]
-    if expired_keys:
-        logger.info(f"Cleaned {len(expired_keys)} expired cache entries")
+# Concurrent misses for the same key share one LLM call (calls saved: single_flight_calls_total{result="shared"})
+_checklist_flights = SingleFlight("checklist")
+_explain_flights = SingleFlight("explain")
 
 
 def _rule_based_checklist(payload: SanitationRequest) -> List[ChecklistItem]:
@@ -156,15 +157,13 @@ def _rule_based_checklist(payload: SanitationRequest) -> List[ChecklistItem]:
     return items
 
 
-def _generate_llm_checklist(payload: SanitationRequest) -> ChecklistResponse:
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
+def _generate_llm_checklist(payload: SanitationRequest, cache_key: Optional[str] = None) -> ChecklistResponse:
+    """Ask the LLM for a checklist; parsed answers are cached under cache_key, fallbacks are not"""
+    client = get_client()
+    if client is None:
         return _fallback_checklist_response(payload)
     
     try:
-        from openai import OpenAI
-        client = OpenAI(api_key=api_key)
-
         # Build context object
         context = {
             "mode": payload.mode,
@@ -197,26 +196,28 @@ def _generate_llm_checklist(payload: SanitationRequest) -> ChecklistResponse:
             "Use real URLs like https://www.who.int/health-topics/water-sanitation-and-hygiene-wash or https://www.cdc.gov/hygiene/index.html"
         )
 
-        resp = client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-4o-mini-2024-07-18"),
-            messages=[
+        content = complete(
+            "checklist",
+            [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt},
             ],
+            client=client,
             temperature=0.3,
         )
-        
-        content = resp.choices[0].message.content.strip()
         import json
         data = json.loads(content)
         
         # Convert to our response model
-        return ChecklistResponse(
+        response = ChecklistResponse(
             summary_top3=[ChecklistItem(**item) for item in data.get("summary_top3", [])],
             sections=[ChecklistSection(**section) for section in data.get("sections", [])],
             notes=[ChecklistNote(**note) for note in data.get("notes", [])],
             sources=[ChecklistSource(**source) for source in data.get("sources", [])]
         )
+        if cache_key is not None:
+            _checklist_cache.put(cache_key, response)
+        return response
         
     except Exception as e:
         print(f"LLM error: {e}")
@@ -306,77 +307,79 @@ async def generate_checklist(
         # Generate context hash
         context_hash = _generate_context_hash(context)
         
-        # Clean expired cache entries
-        _clean_expired_cache()
-        
-        # Check cache first (unless force=true)
+        # Check cache first (unless force=true); expired entries are dropped as they come due
         cache_hit = False
         llm_call = False
         
-        if not force and context_hash in _checklist_cache:
-            cached_entry = _checklist_cache[context_hash]
-            if _is_cache_valid(cached_entry["ts"]):
+        if not force:
+            cached = await _checklist_cache.aget(context_hash)
+            if cached is not None:
                 cache_hit = True
                 logger.info(f"Cache hit for hash: {context_hash[:8]}...")
-                return cached_entry["data"]
-            else:
-                # Remove expired entry
-                del _checklist_cache[context_hash]
-                logger.info(f"Removed expired cache entry for hash: {context_hash[:8]}...")
-        
-        # Generate fresh response
-        llm_call = True
-        logger.info(f"LLM call for hash: {context_hash[:8]}... (force={force}, cache_hit={cache_hit})")
+                return cached
         
-        response = _generate_llm_checklist(payload)
+        async def generate() -> ChecklistResponse:
+            # Generate fresh response on the LLM threads, off the event loop
+            llm_call = True
+            logger.info(f"LLM call for hash: {context_hash[:8]}... (force={force}, cache_hit={cache_hit})")
+            
+            # LLM answers are stored in the cache; fallbacks (LLM error or no key) are not
+            response = await run_blocking("checklist", _generate_llm_checklist, payload, context_hash)
+            
+            logger.info(f"Generated response for hash: {context_hash[:8]}... (llm_call={llm_call}, cache_hit={cache_hit})")
+            return response
         
-        # Store in cache
-        _checklist_cache[context_hash] = {
-            "data": response,
-            "ts": time.time()
-        }
-        
-        logger.info(f"Stored response in cache for hash: {context_hash[:8]}... (llm_call={llm_call}, cache_hit={cache_hit})")
-        
-        return response
+        # Requests with the same context arriving meanwhile wait for this generation
+        return await _checklist_flights.run(context_hash, generate)
         
     except Exception as e:
         logger.error(f"Error generating checklist: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _generate_explanation(payload: ExplainRequest, client) -> ExplainResponse:
+    system_prompt = (
+        "You are a calm hygiene helper. Explain why this step is important in 1-2 sentences. "
+        "Use grade-6 reading level. Be supportive, not alarming. If unsure, suggest checking local guidance."
+    )
+    
+    user_prompt = f"Explain why this checklist item is important: {payload.item_id}. Context: {payload.context}"
+    
+    explanation = complete(
+        "explain",
+        [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ],
+        client=client,
+        temperature=0.3,
+    )
+    return ExplainResponse(explanation=explanation)
+
+
 @router.post("/explain", response_model=ExplainResponse)
 async def explain_item(payload: ExplainRequest):
     """Get explanation for a specific checklist item"""
     try:
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
+        client = get_client()
+        if client is None:
             return ExplainResponse(
                 explanation="This step helps maintain hygiene and safety during sanitation disruptions.",
                 source="General health guidance"
             )
         
-        from openai import OpenAI
-        client = OpenAI(api_key=api_key)
+        cache_key = _generate_context_hash({"item_id": payload.item_id, "context": payload.context})
+        cached = await _explain_cache.aget(cache_key)
+        if cached is not None:
+            return cached
         
-        system_prompt = (
-            "You are a calm hygiene helper. Explain why this step is important in 1-2 sentences. "
-            "Use grade-6 reading level. Be supportive, not alarming. If unsure, suggest checking local guidance."
-        )
+        async def generate() -> ExplainResponse:
+            response = await run_blocking("explain", _generate_explanation, payload, client)
+            await _explain_cache.aput(cache_key, response)
+            return response
         
-        user_prompt = f"Explain why this checklist item is important: {payload.item_id}. Context: {payload.context}"
-        
-        resp = client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-4o-mini-2024-07-18"),
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.3,
-        )
-        
-        explanation = resp.choices[0].message.content.strip()
-        return ExplainResponse(explanation=explanation)
+        # Identical requests arriving meanwhile wait for this call (and share its failure)
+        return await _explain_flights.run(cache_key, generate)
         
     except Exception as e:
         return ExplainResponse(
@@ -389,16 +392,13 @@ async def explain_item(payload: ExplainRequest):
 async def chat_with_assistant(payload: ChatRequest):
     """Context-aware chat with hygiene assistant"""
     try:
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
+        client = get_client()
+        if client is None:
             return ChatResponse(
                 message="I'm here to help with hygiene and sanitation questions. Please check local health guidance for specific requirements.",
                 sources=[ChecklistSource(label="Local Health Guidance", url="https://www.who.int/health-topics/water-sanitation-and-hygiene-wash")]
             )
         
-        from openai import OpenAI
-        client = OpenAI(api_key=api_key)
-        
         # Build context-aware system prompt
         context_summary = f"User situation: {payload.context.get('mode', 'general')} sanitation at {payload.context.get('place', 'home')}. "
         if payload.context.get('profile', {}).get('pregnant'):
@@ -429,13 +429,7 @@ async def chat_with_assistant(payload: ChatRequest):
         # Add context to messages
         messages = [{"role": "system", "content": system_prompt}] + payload.messages
         
-        resp = client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-4o-mini-2024-07-18"),
-            messages=messages,
-            temperature=0.4,
-        )
-        
-        message = resp.choices[0].message.content.strip()
+        message = await acomplete("chat", messages, client=client, temperature=0.4)
         
         # Use sources from request (collected from checklist items)
         sources = available_sources if available_sources else []
@@ -454,7 +448,7 @@ async def chat_with_assistant(payload: ChatRequest):
 async def generate_sanitation_guidance(payload: SanitationRequest):
     """Legacy endpoint - redirects to new checklist format"""
     try:
-        response = _generate_llm_checklist(payload)
+        response = await run_blocking("checklist", _generate_llm_checklist, payload)
         # Convert to legacy format for backward compatibility
         all_items = response.summary_top3 + [item for section in response.sections for item in section.items]
         return {"checklist": [item.model_dump() for item in all_items]}
@@ -1,36 +1,18 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Dict
+import hashlib
 import json
-import os
+import logging
 from datetime import datetime
-from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+from llm import acomplete, api_key, complete, get_client, run_blocking
+from response_cache import ResponseCache
+from single_flight import SingleFlight
 
-router = APIRouter(prefix="/api/symptoms", tags=["symptoms"])
+logger = logging.getLogger(__name__)
 
-# Initialize OpenAI client conditionally
-client = None
-try:
-    from openai import OpenAI
-    api_key = os.getenv("OPENAI_API_KEY")
-    model = os.getenv("OPENAI_MODEL", "gpt-4o-mini-2024-07-18")
-    print(f"OpenAI API Key found: {'Yes' if api_key and api_key != 'sk-test-key-for-development' else 'No'}")
-    print(f"OpenAI Model: {model}")
-    if api_key and api_key != "sk-test-key-for-development" and api_key != "your_openai_api_key_here" and api_key.strip():
-        # Set the API key as environment variable for OpenAI to pick up
-        os.environ["OPENAI_API_KEY"] = api_key.strip()
-        # Initialize client without any extra parameters
-        client = OpenAI()
-        print("OpenAI client initialized successfully")
-    else:
-        print("OpenAI client not initialized - using development mode")
-except Exception as e:
-    print(f"OpenAI client initialization failed: {e}")
-    print("Falling back to development mode")
-    client = None
+router = APIRouter(prefix="/api/symptoms", tags=["symptoms"])
 
 class SymptomAssessmentRequest(BaseModel):
     subject: str  # "pregnant" or "infant"
@@ -47,6 +29,15 @@ class SymptomAssessmentResponse(BaseModel):
     references: List[Dict[str, str]]
     disclaimer: str
 
+# Assessments parsed from the LLM, keyed by a hash of the request (fallback responses are not cached)
+_assessment_cache = ResponseCache("symptoms", SymptomAssessmentResponse)
+
+# Concurrent misses for the same request share one LLM call
+_assessment_flights = SingleFlight("symptoms")
+
+def _request_hash(request: SymptomAssessmentRequest) -> str:
+    return hashlib.sha256(json.dumps(request.model_dump(), sort_keys=True).encode()).hexdigest()
+
 # System prompt for the LLM
 SYSTEM_PROMPT = """You are a helpful medical assistant providing guidance for pregnant women and infant caregivers during water safety disruptions. 
 
@@ -74,47 +65,19 @@ For infants, be especially cautious about:
 
 Respond in valid JSON format only."""
 
-@router.post("/assess", response_model=SymptomAssessmentResponse)
-async def assess_symptoms(request: SymptomAssessmentRequest):
-    """
-    Assess symptoms and provide safe next steps using LLM
-    """
-    try:
-        # Check if OpenAI client is available
-        if client is None:
-            # Return mock response for development
-            return SymptomAssessmentResponse(
-                classification="seek_care",
-                reason="Development mode - please configure OpenAI API key for full functionality",
-                steps=[
-                    "Contact your healthcare provider",
-                    "Monitor symptoms closely",
-                    "Seek emergency care if symptoms worsen",
-                    "Keep a record of symptoms and their timing"
-                ],
-                watch_for=[
-                    "Severe pain or discomfort",
-                    "High fever",
-                    "Difficulty breathing",
-                    "Signs of severe dehydration"
-                ],
-                references=[
-                    {"label": "Local Health", "url": "https://www.health.gov.au/"},
-                    {"label": "WHO", "url": "https://www.who.int/"}
-                ],
-                disclaimer="This is not a substitute for professional medical advice. Always consult healthcare providers for medical concerns."
-            )
-        # Prepare the user prompt
-        symptoms_text = ""
-        if request.chips:
-            symptoms_text += f"Selected symptoms: {', '.join(request.chips)}\n"
-        if request.freeText.strip():
-            symptoms_text += f"Additional symptoms: {request.freeText}\n"
-        
-        severity_text = f"Severity: {request.severityHints}\n" if request.severityHints != "unknown" else ""
-        context_text = f"Context: {request.context.get('mode', 'general')} situation, at {request.context.get('place', 'home')}\n"
-        
-        user_prompt = f"""Subject: {request.subject}
+def _assess_with_llm(client, request: SymptomAssessmentRequest, cache_key: str) -> SymptomAssessmentResponse:
+    """Ask the LLM for an assessment; parsed answers are cached, fallbacks are not"""
+    # Prepare the user prompt
+    symptoms_text = ""
+    if request.chips:
+        symptoms_text += f"Selected symptoms: {', '.join(request.chips)}\n"
+    if request.freeText.strip():
+        symptoms_text += f"Additional symptoms: {request.freeText}\n"
+    
+    severity_text = f"Severity: {request.severityHints}\n" if request.severityHints != "unknown" else ""
+    context_text = f"Context: {request.context.get('mode', 'general')} situation, at {request.context.get('place', 'home')}\n"
+    
+    user_prompt = f"""Subject: {request.subject}
 {symptoms_text}{severity_text}{context_text}
 
 Please assess these symptoms and provide guidance in the following JSON format:
@@ -127,78 +90,109 @@ Please assess these symptoms and provide guidance in the following JSON format:
     "disclaimer": "This is not a substitute for professional medical advice. Always consult healthcare providers for medical concerns."
 }}"""
 
-        # Call OpenAI API
-        try:
-            model = os.getenv("OPENAI_MODEL", "gpt-4o-mini-2024-07-18")
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.2,
-                max_tokens=1000
-            )
-        except Exception as api_error:
-            print(f"OpenAI API call failed: {api_error}")
-            # Return fallback response
-            return SymptomAssessmentResponse(
-                classification="seek_care",
-                reason="Unable to process symptoms. Please seek medical advice.",
-                steps=[
-                    "Contact your healthcare provider immediately",
-                    "Monitor symptoms closely",
-                    "Seek emergency care if symptoms worsen",
-                    "Keep a record of symptoms and their timing"
-                ],
-                watch_for=[
-                    "Severe pain or discomfort",
-                    "High fever",
-                    "Difficulty breathing",
-                    "Signs of severe dehydration"
-                ],
-                references=[
-                    {"label": "Local Health", "url": "https://www.health.gov.au/"},
-                    {"label": "WHO", "url": "https://www.who.int/"}
-                ],
-                disclaimer="This is not a substitute for professional medical advice. Always consult healthcare providers for medical concerns."
-            )
+    # Call OpenAI API
+    try:
+        content = complete(
+            "symptoms",
+            [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt}
+            ],
+            client=client,
+            temperature=0.2,
+            max_tokens=1000
+        )
+    except Exception as api_error:
+        print(f"OpenAI API call failed: {api_error}")
+        # Return fallback response
+        return SymptomAssessmentResponse(
+            classification="seek_care",
+            reason="Unable to process symptoms. Please seek medical advice.",
+            steps=[
+                "Contact your healthcare provider immediately",
+                "Monitor symptoms closely",
+                "Seek emergency care if symptoms worsen",
+                "Keep a record of symptoms and their timing"
+            ],
+            watch_for=[
+                "Severe pain or discomfort",
+                "High fever",
+                "Difficulty breathing",
+                "Signs of severe dehydration"
+            ],
+            references=[
+                {"label": "Local Health", "url": "https://www.health.gov.au/"},
+                {"label": "WHO", "url": "https://www.who.int/"}
+            ],
+            disclaimer="This is not a substitute for professional medical advice. Always consult healthcare providers for medical concerns."
+        )
+    
+    # Try to parse JSON response
+    try:
+        # Remove any markdown formatting if present
+        if content.startswith("```json"):
+            content = content[7:]
+        if content.endswith("```"):
+            content = content[:-3]
         
-        # Extract and parse the response
-        content = response.choices[0].message.content.strip()
+        result = json.loads(content)
         
-        # Try to parse JSON response
-        try:
-            # Remove any markdown formatting if present
-            if content.startswith("```json"):
-                content = content[7:]
-            if content.endswith("```"):
-                content = content[:-3]
-            
-            result = json.loads(content)
-            
-            # Validate required fields
-            required_fields = ["classification", "reason", "steps", "watch_for", "references", "disclaimer"]
-            for field in required_fields:
-                if field not in result:
-                    raise ValueError(f"Missing required field: {field}")
-            
-            # Ensure classification is valid
-            if result["classification"] not in ["self_care", "seek_care", "urgent"]:
-                result["classification"] = "seek_care"
-            
-            return SymptomAssessmentResponse(**result)
-            
-        except (json.JSONDecodeError, ValueError) as e:
-            # Fallback to safe response if JSON parsing fails
-            print(f"JSON parsing error: {e}")
-            print(f"Raw response: {content}")
-            
+        # Validate required fields
+        required_fields = ["classification", "reason", "steps", "watch_for", "references", "disclaimer"]
+        for field in required_fields:
+            if field not in result:
+                raise ValueError(f"Missing required field: {field}")
+        
+        # Ensure classification is valid
+        if result["classification"] not in ["self_care", "seek_care", "urgent"]:
+            result["classification"] = "seek_care"
+        
+        assessment = SymptomAssessmentResponse(**result)
+        _assessment_cache.put(cache_key, assessment)
+        return assessment
+        
+    except (json.JSONDecodeError, ValueError) as e:
+        # Fallback to safe response if JSON parsing fails
+        print(f"JSON parsing error: {e}")
+        print(f"Raw response: {content}")
+        
+        return SymptomAssessmentResponse(
+            classification="seek_care",
+            reason="Unable to process symptoms properly. Please seek medical advice.",
+            steps=[
+                "Contact your healthcare provider immediately",
+                "Monitor symptoms closely",
+                "Seek emergency care if symptoms worsen",
+                "Keep a record of symptoms and their timing"
+            ],
+            watch_for=[
+                "Severe pain or discomfort",
+                "High fever",
+                "Difficulty breathing",
+                "Signs of severe dehydration"
+            ],
+            references=[
+                {"label": "Local Health", "url": "https://www.health.gov.au/"},
+                {"label": "WHO", "url": "https://www.who.int/"}
+            ],
+            disclaimer="This is not a substitute for professional medical advice. Always consult healthcare providers for medical concerns."
+        )
+
+@router.post("/assess", response_model=SymptomAssessmentResponse)
+async def assess_symptoms(request: SymptomAssessmentRequest):
+    """
+    Assess symptoms and provide safe next steps using LLM
+    """
+    try:
+        # Check if OpenAI client is available
+        client = get_client()
+        if client is None:
+            # Return mock response for development
             return SymptomAssessmentResponse(
                 classification="seek_care",
-                reason="Unable to process symptoms properly. Please seek medical advice.",
+                reason="Development mode - please configure OpenAI API key for full functionality",
                 steps=[
-                    "Contact your healthcare provider immediately",
+                    "Contact your healthcare provider",
                     "Monitor symptoms closely",
                     "Seek emergency care if symptoms worsen",
                     "Keep a record of symptoms and their timing"
@@ -215,6 +209,16 @@ Please assess these symptoms and provide guidance in the following JSON format:
                 ],
                 disclaimer="This is not a substitute for professional medical advice. Always consult healthcare providers for medical concerns."
             )
+        cache_key = _request_hash(request)
+        cached = await _assessment_cache.aget(cache_key)
+        if cached is not None:
+            return cached
+
+        async def generate() -> SymptomAssessmentResponse:
+            return await run_blocking("symptoms", _assess_with_llm, client, request, cache_key)
+
+        # Identical requests arriving meanwhile wait for this assessment
+        return await _assessment_flights.run(cache_key, generate)
     
     except Exception as e:
         print(f"Error in symptom assessment: {e}")
@@ -250,8 +254,9 @@ async def health_check():
         "status": "healthy",
         "timestamp": datetime.utcnow().isoformat(),
         "service": "symptoms-assessment",
-        "openai_client": "available" if client is not None else "development_mode",
-        "api_key_configured": bool(os.getenv("OPENAI_API_KEY") and os.getenv("OPENAI_API_KEY") != "your_openai_api_key_here")
+        # Key check only: probes must not import the SDK or build the client
+        "openai_client": "available" if api_key() is not None else "development_mode",
+        "api_key_configured": api_key() is not None
     }
 
 @router.get("/test-openai")
@@ -259,6 +264,7 @@ async def test_openai():
     """
     Test OpenAI client functionality
     """
+    client = get_client()
     if client is None:
         return {
             "status": "development_mode",
@@ -268,19 +274,20 @@ async def test_openai():
     
     try:
         # Test with a simple completion
-        model = os.getenv("OPENAI_MODEL", "gpt-4o-mini-2024-07-18")
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
+        content = await acomplete(
+            "test-openai",
+            [
                 {"role": "user", "content": "Say 'Hello, OpenAI is working!'"}
             ],
+            client=client,
+            max_retries=0,
             max_tokens=10
         )
         
         return {
             "status": "success",
             "message": "OpenAI client is working properly",
-            "response": response.choices[0].message.content.strip()
+            "response": content
         }
     except Exception as e:
         return {
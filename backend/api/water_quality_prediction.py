@@ -1,12 +1,18 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
 import json
 import os
-import numpy as np
-import pandas as pd
 from datetime import datetime, timedelta
-from database import engine
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from columnar import ColumnTable, clean_site_ids, fetch_columns, format_site_ids
+from database import engine, get_async_db
+from lazy import lazy_module
+
+# Imported on first use, not when the app starts
+np = lazy_module("numpy")
+pd = lazy_module("pandas")
 
 router = APIRouter()
 
@@ -38,8 +44,12 @@ def load_model_parameters():
     except json.JSONDecodeError:
         raise HTTPException(status_code=500, detail="Invalid model parameters file")
 
+def _bind(db: Optional[Session]):
+    # The session's connection when called through AsyncSession.run_sync, else the sync engine (scripts)
+    return db.connection() if db is not None else engine
+
 # Load training data from database
-def load_site_data():
+def load_site_data(db: Optional[Session] = None):
     """Load site data from database"""
     try:
         # Query all data from site_suburb_data table
@@ -58,24 +68,21 @@ def load_site_data():
         ORDER BY site_id, value_date
         """
         
-        # Execute query and return as DataFrame
-        df = pd.read_sql(query, engine)
-        
-        # Convert Date column to datetime
-        df['Date'] = pd.to_datetime(df['Date'])
+        # Execute query into typed columns (dates parsed while fetching)
+        data = fetch_columns(_bind(db), query, dtypes=SITE_DATA_DTYPES)
         
         # Format site_id to match model parameters format
-        df['Site ID'] = df['site_id'].apply(lambda x: f' "{x}' if not pd.isna(x) else x)
+        data['Site ID'] = format_site_ids(data['site_id'])
         
-        print(f"Database data loaded: {len(df)} records from {df['site_id'].nunique()} sites")
-        return df
+        print(f"Database data loaded: {len(data)} records from {len(set(data['site_id'].tolist()))} sites")
+        return data
         
     except Exception as e:
         print(f"Database query failed: {e}")
         raise HTTPException(status_code=500, detail=f"Database query failed: {str(e)}")
 
 # Get site-specific data from database (optimized query)
-def get_site_data(site_id: str):
+def get_site_data(site_id: str, db: Optional[Session] = None):
     """Get data for a specific site from database"""
     try:
         # Query data for specific site
@@ -91,66 +98,62 @@ def get_site_data(site_id: str):
             value_date as 'Date',
             ph_value as 'pH'
         FROM site_suburb_data 
-        WHERE site_id = %s
+        WHERE site_id = :site_id
         ORDER BY value_date
         """
         
-        # Execute query for specific site
-        df = pd.read_sql(query, engine, params=(site_id,))
+        # Execute query for specific site (named parameters work on MySQL and SQLite alike)
+        data = fetch_columns(_bind(db), query, params={"site_id": site_id}, dtypes=SITE_DATA_DTYPES)
         
-        if len(df) == 0:
+        if len(data) == 0:
             return None
-            
-        # Convert Date column to datetime
-        df['Date'] = pd.to_datetime(df['Date'])
         
         # Format site_id to match model parameters format
-        df['Site ID'] = df['site_id'].apply(lambda x: f' "{x}' if not pd.isna(x) else x)
+        data['Site ID'] = format_site_ids(data['site_id'])
         
-        return df
+        return data
         
     except Exception as e:
         print(f"Site-specific database query failed: {e}")
         return None
 
 # Get available site IDs from database
-def get_available_sites():
+def get_available_sites(db: Optional[Session] = None):
     """Get list of available site IDs from database"""
     try:
         query = "SELECT DISTINCT site_id FROM site_suburb_data ORDER BY site_id"
-        df = pd.read_sql(query, engine)
-        return df['site_id'].tolist()
+        return fetch_columns(_bind(db), query)['site_id'].tolist()
     except Exception as e:
         print(f"Failed to get available sites: {e}")
         return []
 
 # Search sites by suburb name
-def search_sites_by_suburb(suburb_name: str):
+def search_sites_by_suburb(suburb_name: str, db: Optional[Session] = None):
     """Search sites by suburb name"""
     try:
         query = """
         SELECT DISTINCT site_id, nearest_suburb
         FROM site_suburb_data 
-        WHERE nearest_suburb LIKE %s
+        WHERE nearest_suburb LIKE :pattern
         ORDER BY nearest_suburb, site_id
         """
         
         # Use LIKE for partial matching
         search_pattern = f"%{suburb_name}%"
-        df = pd.read_sql(query, engine, params=(search_pattern,))
+        data = fetch_columns(_bind(db), query, params={"pattern": search_pattern})
         
-        if len(df) == 0:
+        if len(data) == 0:
             return []
         
         # Return list of dictionaries with site_id and suburb_name
-        return df.to_dict('records')
+        return data.records()
         
     except Exception as e:
         print(f"Failed to search sites by suburb: {e}")
         return []
 
 # Get available suburbs
-def get_available_suburbs():
+def get_available_suburbs(db: Optional[Session] = None):
     """Get list of available suburb names from database"""
     try:
         query = """
@@ -160,8 +163,7 @@ def get_available_suburbs():
         GROUP BY nearest_suburb 
         ORDER BY site_count DESC, nearest_suburb
         """
-        df = pd.read_sql(query, engine)
-        return df.to_dict('records')
+        return fetch_columns(_bind(db), query).records()
     except Exception as e:
         print(f"Failed to get available suburbs: {e}")
         return []
@@ -253,7 +255,7 @@ def get_recommendations(risk_level: str, parameters: Dict[str, float]) -> list:
     
     return recommendations
 
-def predict_water_quality(site_id: str) -> Dict[str, Any]:
+def predict_water_quality(site_id: str, db: Optional[Session] = None) -> Dict[str, Any]:
     """Make water quality prediction for a given site"""
     
     # Load model parameters (keep using JSON file)
@@ -266,7 +268,7 @@ def predict_water_quality(site_id: str) -> Dict[str, Any]:
     # Check if site exists in model parameters
     if formatted_site_id not in model_params:
         # Get available sites from database for error message
-        available_sites = get_available_sites()
+        available_sites = get_available_sites(db)
         similar_sites = [s for s in available_sites if clean_site_id in str(s)]
         
         if not similar_sites:
@@ -281,32 +283,61 @@ def predict_water_quality(site_id: str) -> Dict[str, Any]:
             )
     
     # Get site-specific data from database (optimized)
-    site_data = get_site_data(clean_site_id)
+    site_data = get_site_data(clean_site_id, db)
     if site_data is None or len(site_data) == 0:
         raise HTTPException(
             status_code=404,
             detail=f"No historical data found for site '{site_id}'"
         )
     
-    # Get model parameters for this site
-    site_model = model_params[formatted_site_id]
-    
     # Calculate prediction date (1 month from now)
     prediction_date = datetime.now() + timedelta(days=30)
-    
+
+    return predict_from_history(
+        site_id,
+        model_params[formatted_site_id],
+        history_length=len(site_data),
+        last_values=site_data.row(-1),
+        prediction_date=prediction_date
+    )
+
+# Parameters predicted for every site
+PARAMETER_NAMES = [
+    'Chloride as Cl', 'Calcium (Total)', 'Total Magnesium',
+    'Sodium as Na', 'Potassium as K', 'Salinity as EC@25 (lab)', 'pH'
+]
+
+# site_suburb_data columns and the parameter names the model uses for them
+SITE_DATA_COLUMNS = {
+    'chloride_cl': 'Chloride as Cl',
+    'calcium_total': 'Calcium (Total)',
+    'magnesium_total': 'Total Magnesium',
+    'sodium_na': 'Sodium as Na',
+    'potassium_k': 'Potassium as K',
+    'salinity_ec': 'Salinity as EC@25 (lab)',
+    'ph_value': 'pH'
+}
+
+# Column types for the prediction queries: NULL measurements become NaN, dates datetime64
+SITE_DATA_DTYPES = {**{param: 'float64' for param in PARAMETER_NAMES}, 'Date': 'datetime64[s]'}
+
+def predict_from_history(
+    site_id: str,
+    site_model: Dict[str, Any],
+    history_length: int,
+    last_values,
+    prediction_date: datetime
+) -> Dict[str, Any]:
+    """Make a prediction for one site from its history length and latest measurements"""
     # Make predictions for each parameter
     predicted_parameters = {}
-    parameter_names = [
-        'Chloride as Cl', 'Calcium (Total)', 'Total Magnesium',
-        'Sodium as Na', 'Potassium as K', 'Salinity as EC@25 (lab)', 'pH'
-    ]
-    
-    for param in parameter_names:
+
+    for param in PARAMETER_NAMES:
         if param in site_model:
             model_info = site_model[param]
             if model_info.get('method') == 'linear_regression':
                 # Get historical data length for prediction
-                n = len(site_data)
+                n = history_length
                 
                 if n == 0:
                     # Use default values if no historical data
@@ -319,8 +350,8 @@ def predict_water_quality(site_id: str) -> Dict[str, Any]:
                     predicted_parameters[param] = float(y_pred)
             else:
                 # Use repeat last method
-                if len(site_data) > 0:
-                    last_value = site_data[param].iloc[-1]
+                if history_length > 0:
+                    last_value = last_values[param]
                     predicted_parameters[param] = float(last_value)
                 else:
                     predicted_parameters[param] = 0.0
@@ -345,8 +376,32 @@ def predict_water_quality(site_id: str) -> Dict[str, Any]:
         "recommendations": recommendations
     }
 
+def predict_sites(site_data: ColumnTable, model_params: Dict[str, Any], prediction_date: datetime) -> Dict[str, Dict[str, Any]]:
+    """Predict every modelled site in already-loaded history columns (ordered by site and date)"""
+    if len(site_data) == 0:
+        return {}
+
+    site_ids = clean_site_ids(site_data['site_id'])
+    # First occurrence in reverse order = last measured row per site, as predict_water_quality uses row(-1)
+    unique_ids, reversed_first, lengths = np.unique(site_ids[::-1], return_index=True, return_counts=True)
+    last_positions = len(site_ids) - 1 - reversed_first
+
+    predictions = {}
+    for site_id, history_length, position in zip(unique_ids.tolist(), lengths.tolist(), last_positions.tolist()):
+        site_model = model_params.get(f' "{site_id}')
+        if site_model is None:
+            continue
+        predictions[site_id] = predict_from_history(
+            site_id,
+            site_model,
+            history_length=history_length,
+            last_values=site_data.row(position),
+            prediction_date=prediction_date
+        )
+    return predictions
+
 @router.post("/predict", response_model=PredictionResponse)
-async def predict_water_quality_api(request: PredictionRequest):
+async def predict_water_quality_api(request: PredictionRequest, db: AsyncSession = Depends(get_async_db)):
     """
     Predict water quality for a given site ID
     
@@ -357,7 +412,8 @@ async def predict_water_quality_api(request: PredictionRequest):
         PredictionResponse with prediction results
     """
     try:
-        result = predict_water_quality(request.site_id)
+        # Queries run on the async connection; the event loop stays free while they wait
+        result = await db.run_sync(lambda session: predict_water_quality(request.site_id, session))
         return PredictionResponse(**result)
     except HTTPException:
         raise
@@ -365,11 +421,11 @@ async def predict_water_quality_api(request: PredictionRequest):
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
 @router.get("/sites")
-async def get_available_sites_api():
+async def get_available_sites_api(db: AsyncSession = Depends(get_async_db)):
     """Get list of available site IDs for prediction"""
     try:
         # Get available sites from database
-        available_sites_list = get_available_sites()
+        available_sites_list = await db.run_sync(get_available_sites)
         
         # Clean up site IDs for better display
         cleaned_sites = []
@@ -389,11 +445,11 @@ async def get_available_sites_api():
         raise HTTPException(status_code=500, detail=f"Failed to load sites: {str(e)}")
 
 @router.get("/suburbs")
-async def get_available_suburbs_api():
+async def get_available_suburbs_api(db: AsyncSession = Depends(get_async_db)):
     """Get list of available suburb names"""
     try:
         # Get available suburbs from database
-        suburbs_list = get_available_suburbs()
+        suburbs_list = await db.run_sync(get_available_suburbs)
         
         return {
             "total_suburbs": len(suburbs_list),
@@ -404,11 +460,11 @@ async def get_available_suburbs_api():
         raise HTTPException(status_code=500, detail=f"Failed to load suburbs: {str(e)}")
 
 @router.post("/search-by-suburb")
-async def search_sites_by_suburb_api(request: SuburbSearchRequest):
+async def search_sites_by_suburb_api(request: SuburbSearchRequest, db: AsyncSession = Depends(get_async_db)):
     """Search sites by suburb name"""
     try:
         # Search sites by suburb name
-        search_results = search_sites_by_suburb(request.suburb_name)
+        search_results = await db.run_sync(lambda session: search_sites_by_suburb(request.suburb_name, session))
         
         if not search_results:
             return {
@@ -428,14 +484,14 @@ async def search_sites_by_suburb_api(request: SuburbSearchRequest):
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
 @router.get("/health")
-async def health_check():
+async def health_check(db: AsyncSession = Depends(get_async_db)):
     """Health check for the prediction API"""
     try:
         # Try to load model parameters (JSON file)
         model_params = load_model_parameters()
         
         # Try to query database
-        available_sites_list = get_available_sites()
+        available_sites_list = await db.run_sync(get_available_sites)
         
         return {
             "status": "healthy",
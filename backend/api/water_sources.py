@@ -1,8 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List, Optional
-from database import get_db
+from typing import List, Optional, Tuple
+from database import get_async_db, get_db
 from crud import (
+    parse_fields,
+    run_async,
     get_all_water_sources,
     get_water_sources_by_status,
     get_water_sources_by_type,
@@ -10,133 +15,338 @@ from crud import (
     get_water_sources_by_town,
     get_water_sources_with_coordinates,
     get_water_sources_count,
+    estimate_water_sources_count,
     get_water_sources_by_radius,
-    search_water_sources
+    get_water_source_facets,
+    search_water_sources,
+    iter_water_sources,
+    get_water_sources_with_risk,
+    search_water_sources_text,
+    suggest_water_source_terms
+)
+from serializers import (
+    JSONBytesResponse,
+    dumps,
+    encode_rows,
+    encode_csv,
+    encode_ndjson,
+    encode_geojson_features
 )
-from models import WaterSource
 
 router = APIRouter(prefix="/api/water-sources", tags=["water-sources"])
 
-@router.get("/", response_model=List[dict])
+def get_fields(
+    fields: Optional[str] = Query(
+        None,
+        description="Comma-separated columns to return (e.g. id,lat,lon,status); '*' for all. "
+                    "Large text columns (status_notes, comments) are omitted unless requested"
+    )
+) -> Tuple[str, ...]:
+    # Resolve the sparse fieldset shared by every list endpoint
+    try:
+        return parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/", response_class=JSONBytesResponse)
 async def get_water_sources(
     skip: int = Query(0, ge=0, description="Number of records to skip"),
     limit: int = Query(100, ge=1, le=1000, description="Number of records to return"),
-    db: Session = Depends(get_db)
+    fields: Tuple[str, ...] = Depends(get_fields),
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Get all water source data
     try:
-        water_sources = get_all_water_sources(db, skip=skip, limit=limit)
-        return [source.to_dict() for source in water_sources]
+        water_sources = await run_async(db, get_all_water_sources, skip=skip, limit=limit, fields=fields)
+        return JSONBytesResponse(encode_rows(water_sources, fields))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get water source data: {str(e)}")
 
 @router.get("/count")
-async def get_total_count(db: Session = Depends(get_db)):
-    # Get total count of water sources
+async def get_total_count(
+    status: Optional[List[str]] = Query(None, description="Status filter (repeat for several values)"),
+    source_type: Optional[List[str]] = Query(None, description="Type filter (repeat for several values)"),
+    lga: Optional[List[str]] = Query(None, description="Local government area filter (repeat for several values)"),
+    town: Optional[List[str]] = Query(None, description="Town filter (repeat for several values)"),
+    suitable_use: Optional[List[str]] = Query(None, description="Suitable use filter (repeat for several values)"),
+    approximate: bool = Query(False, description="Estimate the unfiltered total from table statistics instead of counting"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Get total count of water sources (filters as for /filter)
     try:
-        count = get_water_sources_count(db)
+        filtered = any([status, source_type, lga, town, suitable_use])
+        if approximate and not filtered:
+            estimate = await run_async(db, estimate_water_sources_count)
+            if estimate is not None:
+                return {"total_count": estimate, "approximate": True}
+        count = await run_async(
+            db,
+            get_water_sources_count,
+            status=status,
+            source_type=source_type,
+            lga=lga,
+            town=town,
+            suitable_use=suitable_use
+        )
+        if approximate:
+            # No statistics for this backend (or filters given): the exact count is returned
+            return {"total_count": count, "approximate": False}
         return {"total_count": count}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get total count: {str(e)}")
 
-@router.get("/with-coordinates", response_model=List[dict])
+@router.get("/with-coordinates", response_class=JSONBytesResponse)
 async def get_water_sources_with_coords(
     skip: int = Query(0, ge=0, description="Number of records to skip"),
     limit: int = Query(100, ge=1, le=1000, description="Number of records to return"),
-    db: Session = Depends(get_db)
+    fields: Tuple[str, ...] = Depends(get_fields),
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Get all water sources with coordinate information
     try:
-        water_sources = get_water_sources_with_coordinates(db)
-        # Apply pagination
-        water_sources = water_sources[skip:skip + limit]
-        return [source.to_dict() for source in water_sources]
+        water_sources = await run_async(db, get_water_sources_with_coordinates, skip=skip, limit=limit, fields=fields)
+        return JSONBytesResponse(encode_rows(water_sources, fields))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get coordinate data: {str(e)}")
 
-@router.get("/filter", response_model=List[dict])
+@router.get("/filter", response_class=JSONBytesResponse)
 async def filter_water_sources(
-    status: Optional[str] = Query(None, description="Status filter"),
-    source_type: Optional[str] = Query(None, description="Type filter"),
-    lga: Optional[str] = Query(None, description="Local government area filter"),
-    town: Optional[str] = Query(None, description="Town filter"),
+    status: Optional[List[str]] = Query(None, description="Status filter (repeat for several values)"),
+    source_type: Optional[List[str]] = Query(None, description="Type filter (repeat for several values)"),
+    lga: Optional[List[str]] = Query(None, description="Local government area filter (repeat for several values)"),
+    town: Optional[List[str]] = Query(None, description="Town filter (repeat for several values)"),
+    suitable_use: Optional[List[str]] = Query(None, description="Suitable use filter (repeat for several values)"),
     skip: int = Query(0, ge=0, description="Number of records to skip"),
     limit: int = Query(100, ge=1, le=1000, description="Number of records to return"),
-    db: Session = Depends(get_db)
+    fields: Tuple[str, ...] = Depends(get_fields),
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Filter water sources by conditions
+    # Values within a filter are OR-ed, filters are AND-ed, matching ignores case
     try:
-        water_sources = search_water_sources(
-            db=db,
+        water_sources = await run_async(
+            db,
+            search_water_sources,
             status=status,
             source_type=source_type,
             lga=lga,
             town=town,
+            suitable_use=suitable_use,
             skip=skip,
-            limit=limit
+            limit=limit,
+            fields=fields
         )
-        return [source.to_dict() for source in water_sources]
+        return JSONBytesResponse(encode_rows(water_sources, fields))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to filter water sources: {str(e)}")
 
-@router.get("/nearby", response_model=List[dict])
+@router.get("/with-risk", response_class=JSONBytesResponse)
+async def get_water_sources_with_risk_endpoint(
+    status: Optional[List[str]] = Query(None, description="Status filter (repeat for several values)"),
+    source_type: Optional[List[str]] = Query(None, description="Type filter (repeat for several values)"),
+    lga: Optional[List[str]] = Query(None, description="Local government area filter (repeat for several values)"),
+    town: Optional[List[str]] = Query(None, description="Town filter (repeat for several values)"),
+    suitable_use: Optional[List[str]] = Query(None, description="Suitable use filter (repeat for several values)"),
+    skip: int = Query(0, ge=0, description="Number of records to skip"),
+    limit: int = Query(100, ge=1, le=1000, description="Number of records to return"),
+    fields: Tuple[str, ...] = Depends(get_fields),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Water sources with embedded forecast risk from the monitoring sites near them, in one call
+    try:
+        water_sources = await run_async(
+            db,
+            get_water_sources_with_risk,
+            status=status,
+            source_type=source_type,
+            lga=lga,
+            town=town,
+            suitable_use=suitable_use,
+            skip=skip,
+            limit=limit,
+            fields=fields
+        )
+        return JSONBytesResponse(encode_rows(water_sources, fields + ("risk",)))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get water sources with risk: {str(e)}")
+
+# Media type per export format
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "geojson": "application/geo+json",
+}
+
+def _export_body(export_format: str, first_chunk, chunks, fields: Tuple[str, ...]):
+    # Encode each fetched chunk as it arrives; the response never holds more than one chunk
+    if export_format == "csv":
+        yield encode_csv(first_chunk, fields, header=True)
+        for chunk in chunks:
+            yield encode_csv(chunk, fields)
+    elif export_format == "ndjson":
+        yield encode_ndjson(first_chunk, fields)
+        for chunk in chunks:
+            yield encode_ndjson(chunk, fields)
+    else:
+        features = encode_geojson_features(first_chunk, fields)
+        yield b'{"type":"FeatureCollection","features":[' + features
+        separator = b"," if features else b""
+        for chunk in chunks:
+            features = encode_geojson_features(chunk, fields)
+            if features:
+                yield separator + features
+                separator = b","
+        yield b"]}"
+
+@router.get("/export")
+async def export_water_sources(
+    export_format: str = Query("ndjson", alias="format", pattern="^(csv|ndjson|geojson)$", description="csv, ndjson or geojson"),
+    status: Optional[List[str]] = Query(None, description="Status filter (repeat for several values)"),
+    source_type: Optional[List[str]] = Query(None, description="Type filter (repeat for several values)"),
+    lga: Optional[List[str]] = Query(None, description="Local government area filter (repeat for several values)"),
+    town: Optional[List[str]] = Query(None, description="Town filter (repeat for several values)"),
+    suitable_use: Optional[List[str]] = Query(None, description="Suitable use filter (repeat for several values)"),
+    fields: Tuple[str, ...] = Depends(get_fields),
+    db: Session = Depends(get_db)
+):
+    # Stream the whole (optionally filtered) table for bulk consumers, instead of paging with OFFSET
+    try:
+        # GeoJSON geometry needs lat/lon even when they are not among the requested properties
+        selected = fields + ("lat", "lon") if export_format == "geojson" else fields
+        chunks = iter_water_sources(
+            db=db,
+            status=status,
+            source_type=source_type,
+            lga=lga,
+            town=town,
+            suitable_use=suitable_use,
+            fields=selected
+        )
+        # Fetch the first chunk here so query errors still return a 500 rather than a truncated stream
+        # Export keeps the sync session: its server-side cursor is read on worker threads, chunk by chunk
+        first_chunk = await run_in_threadpool(next, chunks, [])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to export water sources: {str(e)}")
+
+    return StreamingResponse(
+        _export_body(export_format, first_chunk, chunks, fields),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="water-sources.{export_format}"'}
+    )
+
+@router.get("/facets", response_class=JSONBytesResponse)
+async def get_water_source_facets_endpoint(
+    status: Optional[List[str]] = Query(None, description="Status filter (repeat for several values)"),
+    source_type: Optional[List[str]] = Query(None, description="Type filter (repeat for several values)"),
+    lga: Optional[List[str]] = Query(None, description="Local government area filter (repeat for several values)"),
+    town: Optional[List[str]] = Query(None, description="Town filter (repeat for several values)"),
+    suitable_use: Optional[List[str]] = Query(None, description="Suitable use filter (repeat for several values)"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Distinct status/type/LGA/town/suitable_use values with counts, for the filter UI
+    try:
+        facets = await run_async(
+            db,
+            get_water_source_facets,
+            status=status,
+            source_type=source_type,
+            lga=lga,
+            town=town,
+            suitable_use=suitable_use
+        )
+        return JSONBytesResponse(dumps(facets))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get water source facets: {str(e)}")
+
+@router.get("/search", response_class=JSONBytesResponse)
+async def search_water_sources_endpoint(
+    q: str = Query(..., min_length=1, max_length=200, description="Search text; the last word also matches as a prefix"),
+    limit: int = Query(20, ge=1, le=100, description="Number of records to return"),
+    fields: Tuple[str, ...] = Depends(get_fields),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Ranked full-text search over site name, address, town and comments
+    try:
+        results = await run_async(db, search_water_sources_text, q, limit=limit, fields=fields)
+        return JSONBytesResponse(encode_rows(results, fields + ("score",)))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to search water sources: {str(e)}")
+
+@router.get("/search/suggest", response_class=JSONBytesResponse)
+async def suggest_water_source_terms_endpoint(
+    q: str = Query(..., min_length=1, max_length=100, description="Partial word to complete"),
+    limit: int = Query(10, ge=1, le=50, description="Number of suggestions to return"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Autocomplete suggestions from the search index
+    try:
+        return JSONBytesResponse(dumps(await run_async(db, suggest_water_source_terms, q, limit=limit)))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get search suggestions: {str(e)}")
+
+@router.get("/nearby", response_class=JSONBytesResponse)
 async def get_nearby_water_sources(
     lat: float = Query(..., description="Center point latitude"),
     lon: float = Query(..., description="Center point longitude"),
     radius_km: float = Query(10.0, ge=0.1, le=100.0, description="Search radius (km)"),
-    db: Session = Depends(get_db)
+    fields: Tuple[str, ...] = Depends(get_fields),
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Get nearby water sources by geographic coordinates
     try:
-        water_sources = get_water_sources_by_radius(db, lat, lon, radius_km)
-        return [source.to_dict() for source in water_sources]
+        water_sources = await run_async(db, get_water_sources_by_radius, lat, lon, radius_km, fields=fields)
+        return JSONBytesResponse(encode_rows(water_sources, fields))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get nearby water sources: {str(e)}")
 
-@router.get("/status/{status}", response_model=List[dict])
+@router.get("/status/{status}", response_class=JSONBytesResponse)
 async def get_water_sources_by_status_endpoint(
     status: str,
-    db: Session = Depends(get_db)
+    fields: Tuple[str, ...] = Depends(get_fields),
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Get water sources by status
     try:
-        water_sources = get_water_sources_by_status(db, status)
-        return [source.to_dict() for source in water_sources]
+        water_sources = await run_async(db, get_water_sources_by_status, status, fields=fields)
+        return JSONBytesResponse(encode_rows(water_sources, fields))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get water sources by status: {str(e)}")
 
-@router.get("/type/{source_type}", response_model=List[dict])
+@router.get("/type/{source_type}", response_class=JSONBytesResponse)
 async def get_water_sources_by_type_endpoint(
     source_type: str,
-    db: Session = Depends(get_db)
+    fields: Tuple[str, ...] = Depends(get_fields),
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Get water sources by type
     try:
-        water_sources = get_water_sources_by_type(db, source_type)
-        return [source.to_dict() for source in water_sources]
+        water_sources = await run_async(db, get_water_sources_by_type, source_type, fields=fields)
+        return JSONBytesResponse(encode_rows(water_sources, fields))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get water sources by type: {str(e)}")
 
-@router.get("/lga/{lga}", response_model=List[dict])
+@router.get("/lga/{lga}", response_class=JSONBytesResponse)
 async def get_water_sources_by_lga_endpoint(
     lga: str,
-    db: Session = Depends(get_db)
+    fields: Tuple[str, ...] = Depends(get_fields),
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Get water sources by local government area
     try:
-        water_sources = get_water_sources_by_lga(db, lga)
-        return [source.to_dict() for source in water_sources]
+        water_sources = await run_async(db, get_water_sources_by_lga, lga, fields=fields)
+        return JSONBytesResponse(encode_rows(water_sources, fields))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get water sources by LGA: {str(e)}")
 
-@router.get("/town/{town}", response_model=List[dict])
+@router.get("/town/{town}", response_class=JSONBytesResponse)
 async def get_water_sources_by_town_endpoint(
     town: str,
-    db: Session = Depends(get_db)
+    fields: Tuple[str, ...] = Depends(get_fields),
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Get water sources by town
     try:
-        water_sources = get_water_sources_by_town(db, town)
-        return [source.to_dict() for source in water_sources]
+        water_sources = await run_async(db, get_water_sources_by_town, town, fields=fields)
+        return JSONBytesResponse(encode_rows(water_sources, fields))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get water sources by town: {str(e)}")
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Benchmark requests/sec for sync and async database sessions under concurrent load
+
+Runs the same crud reads (SQL path, snapshot off) behind two async routes: one
+calling crud with the sync Session, as every router did before, and one going
+through crud.run_async with the AsyncSession dependency. Each route is driven by
+N concurrent clients on one event loop for a fixed time.
+
+SQLite answers in-process, so every statement also sleeps --latency-ms in the
+driver's own thread to stand in for the network round trip to MySQL: the sync
+driver sleeps on the event loop thread, aiosqlite in its worker thread.
+
+Usage: python benchmarks/bench_async_sessions.py [--rows 5000] [--latency-ms 5] [--seconds 3] [--concurrency 1 4 12]
+"""
+import argparse
+import asyncio
+import time
+
+from common import make_sqlite_sessionmaker, override_app_db
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.util import await_only
+
+import crud
+import snapshot as ewsp_snapshot
+from database import get_async_db, get_db
+from serializers import JSONBytesResponse, encode_rows
+
+FIELDS = ("id", "site_name", "near_town", "lga", "status", "lat", "lon")
+
+# name -> (crud function, kwargs, encoder)
+QUERIES = {
+    "filtered count": (
+        crud.get_water_sources_count,
+        {"lga": ["Buloke", "mildura"], "status": "operational"},
+        lambda result: {"total_count": result},
+    ),
+    "filter page": (
+        crud.search_water_sources,
+        {"lga": ["Buloke", "mildura"], "skip": 2000, "limit": 100, "fields": FIELDS},
+        lambda rows: JSONBytesResponse(encode_rows(rows, FIELDS)),
+    ),
+}
+
+
+def add_round_trip(engine, latency: float):
+    """Sleep `latency` seconds at the start of every statement, in the thread running it"""
+    def trace(statement):
+        time.sleep(latency)
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        result = connection_record.driver_connection.set_trace_callback(trace)
+        if asyncio.iscoroutine(result):
+            # aiosqlite: register on its worker thread (connect events run inside the async greenlet)
+            await_only(result)
+
+
+def build_app() -> FastAPI:
+    bench_app = FastAPI()
+
+    @bench_app.get("/sync/{query}")
+    async def sync_route(query: str, db: Session = Depends(get_db)):
+        # The previous pattern: blocking driver calls on the event loop thread
+        function, kwargs, encode = QUERIES[query]
+        return encode(function(db, **kwargs))
+
+    @bench_app.get("/async/{query}")
+    async def async_route(query: str, db: AsyncSession = Depends(get_async_db)):
+        function, kwargs, encode = QUERIES[query]
+        return encode(await crud.run_async(db, function, **kwargs))
+
+    return bench_app
+
+
+async def drive(client: httpx.AsyncClient, path: str, concurrency: int, seconds: float):
+    """(requests/sec, p50 ms, p95 ms) for `concurrency` clients looping on `path`"""
+    latencies = []
+    deadline = time.perf_counter() + seconds
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = await client.get(path)
+            response.raise_for_status()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return (
+        len(latencies) / elapsed,
+        latencies[len(latencies) // 2],
+        latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+    )
+
+
+async def run(args):
+    bench_app = build_app()
+    session_factory = make_sqlite_sessionmaker(args.rows)
+    async_engine = override_app_db(bench_app, session_factory, async_poolclass=AsyncAdaptedQueuePool)
+    add_round_trip(session_factory.kw["bind"], args.latency_ms / 1000)
+    session_factory.kw["bind"].dispose()  # drop the seeding connection, opened without the round trip
+    add_round_trip(async_engine.sync_engine, args.latency_ms / 1000)
+    ewsp_snapshot.SNAPSHOT_ENABLED = False
+
+    print(f"{args.rows} rows seeded, snapshot off, {args.latency_ms:g} ms simulated round trip, {args.seconds:g} s per run")
+    print(f"{'query':<16}{'clients':>8}{'session':>9}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    async with httpx.AsyncClient(app=bench_app, base_url="http://bench") as client:
+        for query in QUERIES:
+            for concurrency in args.concurrency:
+                for mode in ("sync", "async"):
+                    path = f"/{mode}/{query}"
+                    await drive(client, path, concurrency, 0.2)  # warm-up
+                    rate, p50, p95 = await drive(client, path, concurrency, args.seconds)
+                    print(f"{query:<16}{concurrency:>8}{mode:>9}{rate:>10.0f}{p50:>10.1f}{p95:>10.1f}")
+    await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    # Above pool_size + max_overflow (15) clients the sync pattern stalls: requests waiting for a
+    # connection block the loop thread that the requests holding one need to finish and release it
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 12])
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark response compression
+
+Requests large JSON responses through the full app (snapshot reads,
+conditional GET and compression middleware) with each Accept-Encoding and
+reports wire bytes and latency. "cold" clears the compressed-body cache before
+every request; "hot" lets repeated requests reuse the cached compressed body.
+
+Usage: python benchmarks/bench_compression.py [--rows 5000] [--repeat 30]
+"""
+import argparse
+import os
+
+from common import make_sqlite_sessionmaker, override_app_db, time_call
+
+os.environ.pop("OPENAI_API_KEY", None)  # checklist uses the local fallback
+
+from fastapi.testclient import TestClient
+
+import compression
+import snapshot
+from main import app
+
+REQUESTS = [
+    ("GET", "/api/water-sources/?limit=1000", None),
+    ("GET", "/api/water-sources/?limit=1000&fields=*", None),
+    ("GET", "/api/water-sources/filter?status=Operational&status=Limited&limit=1000", None),
+    ("POST", "/api/guidance/checklist", {
+        "mode": "flood", "place": "temporary",
+        "profile": {"pregnant": True, "infant": True},
+        "issues": ["toilet_unusable", "no_running_water"],
+    }),
+]
+
+
+def find_compression_cache():
+    # The middleware instance is built lazily by Starlette; walk the stack to find it
+    layer = app.middleware_stack
+    while layer is not None:
+        if isinstance(layer, compression.CompressionMiddleware):
+            return layer.cache
+        layer = getattr(layer, "app", None)
+    raise RuntimeError("CompressionMiddleware is not installed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    override_app_db(app, make_sqlite_sessionmaker(args.rows))
+    snapshot.reset_snapshot()
+    client = TestClient(app)
+    client.get("/health")
+    cache = find_compression_cache()
+
+    encodings = ["identity", "gzip"] + (["br"] if compression.brotli is not None else [])
+    print(f"{args.rows} rows seeded; gzip level {compression.GZIP_LEVEL}, brotli quality {compression.BROTLI_QUALITY}")
+    print(f"{'request':<62}{'encoding':<10}{'cache':<7}{'bytes':>11}{'mean ms':>9}{'p95 ms':>9}")
+
+    for method, path, body in REQUESTS:
+        for encoding in encodings:
+            headers = {"Accept-Encoding": encoding}
+
+            def send():
+                # Read the raw wire bytes rather than the decoded body
+                with client.stream(method, path, json=body, headers=headers) as response:
+                    return b"".join(response.iter_raw())
+
+            modes = ["-"] if encoding == "identity" else ["cold", "hot"]
+            for mode in modes:
+                if mode == "cold":
+                    def call():
+                        cache.clear()
+                        return send()
+                else:
+                    call = send
+                mean, p95, raw = time_call(call, args.repeat)
+                label = f"{method} {path}"
+                print(f"{label[:61]:<62}{encoding:<10}{mode:<7}{len(raw):>11,}{mean:>9.2f}{p95:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Benchmark the streaming export
+
+Streams /api/water-sources/export in each format at several table sizes and
+reports time to first byte, total time, bytes and peak Python memory
+(tracemalloc) while streaming. Peak memory should stay roughly flat as the
+table grows, since only one fetched chunk is held at a time.
+
+Usage: python benchmarks/bench_export.py [--sizes 5000,20000,50000]
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+from common import make_sqlite_sessionmaker, override_app_db
+
+import snapshot
+from main import app
+
+
+async def stream(path, query):
+    # Drive the ASGI app directly and discard body chunks as they arrive (a test client
+    # would buffer the whole response); returns (ttfb_ms, total_ms, bytes, peak_bytes)
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+        "root_path": "", "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 0), "server": ("bench", 80),
+    }
+    timings = {"first": None}
+    size = 0
+    requested = False
+    finished = asyncio.Event()
+
+    async def receive():
+        # One empty request body, then block (the response polls receive() for disconnects)
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal size
+        if message["type"] == "http.response.body" and message.get("body"):
+            if timings["first"] is None:
+                timings["first"] = time.perf_counter()
+            size += len(message["body"])
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    await app(scope, receive, send)
+    finished.set()
+    total = time.perf_counter()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (timings["first"] - start) * 1000, (total - start) * 1000, size, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="5000,20000,50000")
+    args = parser.parse_args()
+
+    print(f"{'rows':>8}  {'format':<8}{'ttfb ms':>9}{'total ms':>10}{'bytes':>13}{'peak MiB':>10}")
+    for rows in [int(size) for size in args.sizes.split(",")]:
+        override_app_db(app, make_sqlite_sessionmaker(rows))
+        snapshot.reset_snapshot()
+        for export_format in ("csv", "ndjson", "geojson"):
+            ttfb, total, size, peak = asyncio.run(stream("/api/water-sources/export", f"format={export_format}&fields=*"))
+            print(f"{rows:>8}  {export_format:<8}{ttfb:>9.1f}{total:>10.1f}{size:>13,}{peak / 2**20:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Benchmark the prediction module's site data fetch
+
+Compares the original pandas path (pd.read_sql, pd.to_datetime and a per-row
+apply building 'Site ID') with the NumPy fetch path (fetch_columns into typed
+arrays, vectorised 'Site ID' formatting). Both fetch one site's history (a
+handful of rows, as /predict does) and the whole table (as load_site_data does).
+
+The pandas path reads through the raw sqlite3 connection, which pandas
+supports without SQLAlchemy; the DataFrame it builds is the same.
+
+Usage: python benchmarks/bench_fetch.py [--sites 2000] [--readings-per-site 50] [--repeat 20]
+"""
+import argparse
+import contextlib
+import io
+
+from common import time_call
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import local_db
+from api.water_quality_prediction import get_site_data, load_site_data
+from lazy import lazy_module
+from models import SiteSuburbData
+
+pd = lazy_module("pandas")
+
+# The prediction module's queries, as pd.read_sql ran them
+COLUMNS = """
+    site_id,
+    chloride_cl as 'Chloride as Cl',
+    calcium_total as 'Calcium (Total)',
+    magnesium_total as 'Total Magnesium',
+    sodium_na as 'Sodium as Na',
+    potassium_k as 'Potassium as K',
+    salinity_ec as 'Salinity as EC@25 (lab)',
+    value_date as 'Date',
+    ph_value as 'pH'
+"""
+SITE_QUERY = f"SELECT {COLUMNS} FROM site_suburb_data WHERE site_id = :site_id ORDER BY value_date"
+ALL_QUERY = f"SELECT {COLUMNS} FROM site_suburb_data ORDER BY site_id, value_date"
+
+
+def pandas_fetch(connection, query, params=None):
+    # What get_site_data and load_site_data did before
+    df = pd.read_sql(query, connection, params=params)
+    df['Date'] = pd.to_datetime(df['Date'])
+    df['Site ID'] = df['site_id'].apply(lambda x: f' "{x}' if not pd.isna(x) else x)
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sites", type=int, default=2000)
+    parser.add_argument("--readings-per-site", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    local_db.create_schema(engine)
+    local_db.insert_rows(
+        engine, SiteSuburbData.__table__, local_db.synthetic_site_data(args.sites, args.readings_per_site)
+    )
+    site_id = next(local_db.synthetic_site_data(1, 1))["site_id"]
+    raw = engine.raw_connection().driver_connection
+
+    print(f"{args.sites} sites x {args.readings_per_site} readings")
+    print(f"{'query':<12}{'path':<26}{'rows':>10}{'mean ms':>10}{'p95 ms':>10}")
+    # load_site_data prints a line per call
+    with Session(engine) as db, contextlib.redirect_stdout(io.StringIO()):
+        cases = [
+            ("one site", "pd.read_sql + apply", lambda: pandas_fetch(raw, SITE_QUERY, {"site_id": site_id})),
+            ("one site", "fetch_columns (NumPy)", lambda: get_site_data(site_id, db)),
+            ("all sites", "pd.read_sql + apply", lambda: pandas_fetch(raw, ALL_QUERY)),
+            ("all sites", "fetch_columns (NumPy)", lambda: load_site_data(db)),
+        ]
+        results = [(query, path, time_call(func, args.repeat)) for query, path, func in cases]
+    for query, path, (mean, p95, result) in results:
+        print(f"{query:<12}{path:<26}{len(result):>10,}{mean:>10.2f}{p95:>10.2f}")
+    raw.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Benchmark the API's import (cold start) time against a budget
+
+Imports main in fresh interpreters with `python -X importtime`, reports the
+median time spent in `import main` and the slowest modules it pulled in, and
+exits with status 1 when the median exceeds the budget or when a module that
+should load lazily (numpy, pandas, openai) was imported. The test suite
+checks the lazy imports on every run (tests/test_main.py) and the budget when
+STARTUP_BUDGET_MS is set; this script adds the per-module breakdown.
+
+Usage: python benchmarks/bench_importtime.py [--runs 5] [--top 15] [--budget-ms 1200]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Startup budget for `import main`, in milliseconds
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "1200"))
+
+# Loaded on first use (startup hook or request), never by importing the app
+DEFERRED_MODULES = ("numpy", "pandas", "openai")
+
+
+def import_profile():
+    """{module: (self_us, cumulative_us, depth)} for one `import main` in a fresh interpreter"""
+    # The report goes to stderr; the loaded module names to stdout
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import sys, main; print(' '.join(sys.modules))"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+    )
+    profile = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        profile[name.strip()] = (int(self_us), int(cumulative_us), depth)
+    return profile, set(result.stdout.split())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS)
+    args = parser.parse_args()
+
+    totals = []
+    profiles = []
+    for _ in range(args.runs):
+        profile, loaded = import_profile()
+        totals.append(profile["main"][1] / 1000)
+        profiles.append(profile)
+
+    median = statistics.median(totals)
+    # Slowest modules by cumulative time, from the median run
+    profile = profiles[totals.index(sorted(totals)[len(totals) // 2])]
+    print(f"import main: median {median:.0f} ms, min {min(totals):.0f} ms, max {max(totals):.0f} ms over {args.runs} runs")
+    print(f"{'cumulative ms':>14}{'self ms':>10}  module")
+    slowest = sorted((item for item in profile.items() if item[0] != "main"), key=lambda item: -item[1][1])
+    for name, (self_us, cumulative_us, depth) in slowest[:args.top]:
+        print(f"{cumulative_us / 1000:>14.1f}{self_us / 1000:>10.1f}  {'  ' * depth}{name}")
+
+    failures = []
+    eager = [name for name in DEFERRED_MODULES if name in loaded]
+    if eager:
+        failures.append(f"imported at startup, should load lazily: {', '.join(eager)}")
+    if median > args.budget_ms:
+        failures.append(f"median {median:.0f} ms exceeds the {args.budget_ms:.0f} ms budget")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print(f"OK: within the {args.budget_ms:.0f} ms budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Load test: water-source read latency while slow LLM requests are in flight
+
+Drives the app on one event loop. A stub stands in for the OpenAI client and
+blocks for --llm-seconds per completion, as the SDK does. Readers issue
+GET /api/water-sources back to back, first alone and then while --llm-clients
+clients keep posting distinct /api/guidance/chat requests. With LLM calls on
+their own threads behind a per-route limit, the read latency under load stays
+at its idle level; with the calls on the event loop, every read waits for the
+completion in progress.
+
+Usage: python benchmarks/bench_llm_isolation.py [--rows 5000] [--llm-seconds 1.0] [--llm-clients 16] [--readers 4] [--seconds 5]
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import time
+from types import SimpleNamespace
+
+from common import make_sqlite_sessionmaker, override_app_db
+
+import httpx
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+import llm
+from main import app
+
+
+class SlowCompletions:
+    """The part of the OpenAI client the routes use, answering after a fixed delay"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, **kwargs):
+        time.sleep(self.seconds)
+        message = SimpleNamespace(content="Wash hands with soap and safe water.")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else float("nan")
+
+
+async def read_loop(client, latencies, stop):
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = await client.get("/api/water-sources/", params={"limit": 100})
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - started) * 1000)
+
+
+async def chat_loop(client, counter, completed, stop):
+    while not stop.is_set():
+        # Distinct questions: chat answers are neither cached nor shared
+        payload = {
+            "messages": [{"role": "user", "content": f"Question {next(counter)}"}],
+            "context": {"mode": "general", "place": "home"},
+            "checklist": {},
+            "sources": [],
+        }
+        response = await client.post("/api/guidance/chat", json=payload)
+        response.raise_for_status()
+        completed.append(response)
+
+
+async def measure(client, readers: int, llm_clients: int, seconds: float):
+    latencies, completed, stop = [], [], asyncio.Event()
+    counter = itertools.count()
+    tasks = [asyncio.create_task(chat_loop(client, counter, completed, stop)) for _ in range(llm_clients)]
+    # Let the LLM requests reach their calls before reading
+    await asyncio.sleep(0.1 if llm_clients else 0)
+    tasks += [asyncio.create_task(read_loop(client, latencies, stop)) for _ in range(readers)]
+    await asyncio.sleep(seconds)
+    stop.set()
+    await asyncio.gather(*tasks)
+    return latencies, len(completed)
+
+
+async def run(args, async_engine):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        # Warm-up: loads the snapshot
+        await client.get("/api/water-sources/", params={"limit": 100})
+        print(f"{'LLM clients':<14}{'reads':>8}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'LLM done':>10}")
+        for llm_clients in (0, args.llm_clients):
+            latencies, completed = await measure(client, args.readers, llm_clients, args.seconds)
+            print(
+                f"{llm_clients:<14}{len(latencies):>8,}{percentile(latencies, 0.5):>10.2f}"
+                f"{percentile(latencies, 0.95):>10.2f}{max(latencies):>10.2f}{completed:>10}"
+            )
+    print(f"LLM calls per route at once: {llm.LLM_ROUTE_CONCURRENCY} (LLM_ROUTE_CONCURRENCY)")
+    await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--llm-seconds", type=float, default=1.0)
+    parser.add_argument("--llm-clients", type=int, default=16)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    session_factory = make_sqlite_sessionmaker(args.rows)
+    async_engine = override_app_db(app, session_factory, async_poolclass=AsyncAdaptedQueuePool)
+
+    # The stub becomes the shared client the routes get from llm.get_client()
+    os.environ["OPENAI_API_KEY"] = "sk-bench"
+    llm._client, llm._client_key = SlowCompletions(args.llm_seconds), "sk-bench"
+
+    print(f"{args.rows} water sources, {args.readers} readers, completions take {args.llm_seconds:.1f}s")
+    asyncio.run(run(args, async_engine))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Benchmark full-text search latency against the in-memory index
+
+Reports build/sync time and p50/p99 latency for typical full-word and
+autocomplete queries.
+
+Usage: python benchmarks/bench_search.py [--rows 5000] [--repeat 500]
+"""
+import argparse
+import time
+
+from common import make_sqlite_sessionmaker
+
+import search_index
+import snapshot
+
+QUERIES = ["ouyen", "main rd", "creek tank 12", "sea l", "robinv", "station rd charlton", "treat", "k"]
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=500)
+    args = parser.parse_args()
+
+    session_factory = make_sqlite_sessionmaker(args.rows)
+    with session_factory() as db:
+        snap = snapshot.load_snapshot(db)
+
+    index = search_index.SearchIndex()
+    start = time.perf_counter()
+    index.sync(snap)
+    print(f"initial build: {(time.perf_counter() - start) * 1000:.1f} ms for {len(index)} rows")
+    start = time.perf_counter()
+    index.sync(snap)
+    print(f"no-change sync: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    print(f"{'query':<24}{'hits':>6}{'p50 ms':>10}{'p99 ms':>10}")
+    for query in QUERIES:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results = index.search(query, limit=20)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        print(f"{query:<24}{len(results):>6}{percentile(timings, 0.5):>10.2f}{percentile(timings, 0.99):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Benchmark water-source response serialization
+
+Compares the original pipeline (ORM hydration, WaterSource.to_dict(),
+response_model=List[dict] revalidation and the stdlib JSON encoder) with the
+bulk path (Core row tuples, column-wise conversion, JSON bytes).
+
+Usage: python benchmarks/bench_serialization.py [--rows 5000] [--limit 1000]
+"""
+import argparse
+import json
+
+from common import make_sqlite_sessionmaker, time_call
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy.orm import undefer
+from typing import List
+
+import serializers
+from crud import get_all_water_sources
+from models import WaterSource, WATER_SOURCE_FIELDS
+
+
+def legacy_pipeline(session_factory, limit):
+    # What the router did before: ORM objects -> to_dict -> revalidate -> stdlib json
+    # (text columns undeferred so to_dict() does not lazy-load them row by row)
+    with session_factory() as db:
+        sources = (
+            db.query(WaterSource)
+            .options(undefer(WaterSource.status_notes), undefer(WaterSource.comments))
+            .offset(0).limit(limit).all()
+        )
+        payload = [source.to_dict() for source in sources]
+    validated = TypeAdapter(List[dict]).validate_python(payload)
+    return json.dumps(jsonable_encoder(validated), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def bulk_pipeline(session_factory, limit):
+    with session_factory() as db:
+        rows = get_all_water_sources(db, skip=0, limit=limit, fields=WATER_SOURCE_FIELDS)
+    return serializers.encode_rows(rows, WATER_SOURCE_FIELDS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    session_factory = make_sqlite_sessionmaker(args.rows)
+
+    print(f"{args.limit} rows, all columns ({args.rows} rows seeded)")
+    print(f"{'pipeline':<34}{'bytes':>12}{'mean ms':>10}{'p95 ms':>10}")
+    cases = [("legacy ORM + to_dict + revalidate", lambda: legacy_pipeline(session_factory, args.limit))]
+    cases.append(("bulk tuples + " + ("orjson" if serializers.orjson else "json"),
+                  lambda: bulk_pipeline(session_factory, args.limit)))
+    if serializers.orjson is not None:
+        def bulk_stdlib():
+            encoder, serializers.orjson = serializers.orjson, None
+            try:
+                return bulk_pipeline(session_factory, args.limit)
+            finally:
+                serializers.orjson = encoder
+        cases.append(("bulk tuples + stdlib json", bulk_stdlib))
+
+    for label, func in cases:
+        mean, p95, body = time_call(func, args.repeat)
+        print(f"{label:<34}{len(body):>12,}{mean:>10.1f}{p95:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Benchmark sparse fieldsets on the water-sources list endpoints
+
+Compares bytes transferred and latency for the full row (fields=*), the default
+fieldset (heavy text columns deferred) and a map-style projection.
+
+Usage: python benchmarks/bench_sparse_fields.py [--rows 5000] [--limit 1000]
+"""
+import argparse
+
+from common import make_sqlite_sessionmaker, override_app_db, time_call
+
+from fastapi.testclient import TestClient
+from main import app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    override_app_db(app, make_sqlite_sessionmaker(args.rows))
+    client = TestClient(app)
+
+    cases = [
+        ("all columns (fields=*)", "*"),
+        ("default (text deferred)", None),
+        ("map (id,lat,lon,status)", "id,lat,lon,status"),
+    ]
+    print(f"GET /api/water-sources/with-coordinates?limit={args.limit} ({args.rows} rows seeded)")
+    print(f"{'case':<28}{'bytes':>12}{'mean ms':>10}{'p95 ms':>10}")
+    for label, fields in cases:
+        params = {"limit": args.limit}
+        if fields:
+            params["fields"] = fields
+        mean, p95, response = time_call(
+            lambda: client.get("/api/water-sources/with-coordinates", params=params), args.repeat
+        )
+        print(f"{label:<28}{len(response.content):>12,}{mean:>10.1f}{p95:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Shared helpers for the backend benchmarks
+
+Benchmarks run against a temporary SQLite copy of the ewsp table seeded with
+local_db's synthetic rows, so they can be run without access to the RDS instance.
+"""
+import atexit
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Allow running as `python benchmarks/<script>.py` from the backend directory
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from local_db import create_schema, insert_rows, synthetic_water_sources
+from models import WaterSource
+
+# guidance.py configures INFO logging; keep per-request httpx and cache-hit lines out of the results
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("api.guidance").setLevel(logging.WARNING)
+
+def make_sqlite_sessionmaker(rows: int):
+    """Create a temporary SQLite ewsp table seeded with `rows` synthetic rows"""
+    # A file rather than :memory:, so the async (aiosqlite) engine can open the same database
+    directory = tempfile.mkdtemp(prefix="watersafe-bench-")
+    atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    path = os.path.join(directory, "watersafe.db")
+    engine = create_engine(
+        f"sqlite:///{path}",
+        connect_args={"check_same_thread": False},
+    )
+    create_schema(engine)
+    insert_rows(engine, WaterSource.__table__, synthetic_water_sources(rows))
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def override_app_db(app, session_factory, async_poolclass=NullPool):
+    """Point the app's get_db and get_async_db dependencies at `session_factory`'s database
+
+    The default NullPool suits TestClient, which runs every request on a new event loop;
+    benchmarks driving the app on a single loop can pass a pooling class instead.
+    """
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from database import async_database_url, get_async_db, get_db
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async_engine = create_async_engine(
+        async_database_url(str(session_factory.kw["bind"].url)), poolclass=async_poolclass
+    )
+    async_session_factory = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    async def override_get_async_db():
+        async with async_session_factory() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    return async_engine
+
+
+def time_call(func, repeat: int = 20):
+    """Return (mean_ms, p95_ms, last_result) over `repeat` calls after one warm-up"""
+    result = func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    mean = sum(timings) / len(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    return mean, p95, result
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Bulk loader for site_suburb_data and ewsp
+
+Streams a CSV in chunks, normalises each chunk with vectorised pandas
+operations and upserts it with multi-row statements: INSERT ... ON DUPLICATE
+KEY UPDATE on MySQL, INSERT ... ON CONFLICT DO UPDATE on SQLite. Rows are
+matched on their natural key, so re-running a load changes nothing. With
+--load-data, MySQL chunks go through LOAD DATA LOCAL INFILE ... REPLACE
+instead, falling back to upserts when the server or client does not allow it.
+After a load the table's data version is bumped (see data_versions.py), so the
+ewsp snapshot and the risk linkage reload even when only values changed.
+
+Accepted files:
+- site_suburb_data: site_suburb_data.csv (site_id, chloride_cl, ..., value_date,
+  ph_value, nearest_suburb) or the merged model format
+  (Merged_Top6_pH_Avg_Cleaned.csv: "Site ID", "Chloride as Cl", ..., "Date", "pH").
+  Samples taken at one site on one day are numbered in file order (sample_no);
+  the key is (site_id, value_date, sample_no).
+- ewsp: the /api/water-sources/export CSV, keyed on id. The exported location
+  (str() of the POINT's WKB bytes) cannot be loaded back, so location is
+  rebuilt from lat/lon as POINT(lon lat), through ST_GeomFromText on MySQL.
+
+Usage: python bulk_load.py {site_suburb_data,ewsp} FILE [--url URL] [--chunk-size 50000]
+                           [--batch-size 1000] [--load-data]
+"""
+import argparse
+import csv
+import logging
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import pandas as pd
+from sqlalchemy import Date, DateTime, Double, Float, Integer, create_engine, func, inspect
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+
+import data_versions
+from models import DataVersion, SiteSuburbData, WaterSource
+
+logger = logging.getLogger(__name__)
+
+# CSV rows read and normalised at a time
+CHUNK_SIZE = 50000
+# Rows per multi-row INSERT (11 columns x 1000 rows stays well under SQLite's 32766 parameters)
+BATCH_SIZE = 1000
+
+# ewsp.location for rows without coordinates
+LOCATION_UNKNOWN = "POINT(0 0)"
+
+SITE_MEASUREMENTS = ("chloride_cl", "calcium_total", "magnesium_total", "sodium_na", "potassium_k", "salinity_ec", "ph_value")
+
+# Merged model format -> site_suburb_data columns
+MERGED_SITE_COLUMNS = {
+    "Site ID": "site_id",
+    "Chloride as Cl": "chloride_cl",
+    "Calcium (Total)": "calcium_total",
+    "Total Magnesium": "magnesium_total",
+    "Sodium as Na": "sodium_na",
+    "Potassium as K": "potassium_k",
+    "Salinity as EC@25 (lab)": "salinity_ec",
+    "Date": "value_date",
+    "pH": "ph_value",
+}
+
+
+def normalise_site_ids(values: pd.Series) -> pd.Series:
+    """' "100017' (merged format), '100017 ' and '100017' all become '100017'; blanks become NA"""
+    ids = values.astype("string").str.replace('"', "", regex=False).str.strip()
+    return ids.mask(ids == "")
+
+
+def normalise_dates(values: pd.Series) -> pd.Series:
+    """Parse 1979/3/28 and 1976-05-25 alike into datetime.date; unparseable values become None"""
+    parsed = pd.to_datetime(
+        values.astype("string").str.strip().str.replace("/", "-", regex=False), format="%Y-%m-%d", errors="coerce"
+    )
+    return parsed.dt.date.astype(object).where(parsed.notna(), None)
+
+
+def location_wkt(lat: pd.Series, lon: pd.Series) -> pd.Series:
+    """POINT(lon lat) WKT (x is the longitude); POINT(0 0) where a coordinate is missing, as location is NOT NULL"""
+    located = lat.notna() & lon.notna()
+    wkt = "POINT(" + lon.astype(str) + " " + lat.astype(str) + ")"
+    return wkt.where(located, LOCATION_UNKNOWN).astype(object)
+
+
+def _strings(values: pd.Series) -> pd.Series:
+    stripped = values.astype("string").str.strip()
+    return stripped.mask(stripped == "")
+
+
+class SiteSampleNumbers:
+    """Numbers samples sharing a site and day in file order, across chunks"""
+
+    def __init__(self):
+        self._seen: Dict[str, int] = {}
+
+    def number(self, site_ids: pd.Series, dates: pd.Series) -> pd.Series:
+        keys = site_ids.astype(str) + "|" + dates.astype(str)
+        numbers = keys.groupby(keys, sort=False).cumcount() + keys.map(self._seen).fillna(0).astype(int)
+        # The next sample of a key in a later chunk continues after its highest number so far
+        self._seen.update((numbers.groupby(keys, sort=False).max() + 1).to_dict())
+        return numbers
+
+
+def normalise_site_chunk(frame: pd.DataFrame, samples: SiteSampleNumbers) -> pd.DataFrame:
+    """site_suburb_data rows from either accepted format; rows without a site id or date are dropped"""
+    frame = frame.rename(columns=MERGED_SITE_COLUMNS)
+    rows = pd.DataFrame(index=frame.index)
+    rows["site_id"] = normalise_site_ids(frame["site_id"])
+    rows["value_date"] = normalise_dates(frame["value_date"])
+    for column in SITE_MEASUREMENTS:
+        rows[column] = pd.to_numeric(frame[column], errors="coerce")
+    if "nearest_suburb" in frame:
+        rows["nearest_suburb"] = _strings(frame["nearest_suburb"])
+    rows = rows[rows["site_id"].notna() & rows["value_date"].notna()].copy()
+    rows["sample_no"] = samples.number(rows["site_id"], rows["value_date"])
+    return rows
+
+
+def normalise_ewsp_chunk(frame: pd.DataFrame) -> pd.DataFrame:
+    """ewsp rows typed by the table's columns, location rebuilt from lat/lon; rows without an id are dropped"""
+    rows = pd.DataFrame(index=frame.index)
+    for column in WaterSource.__table__.columns:
+        if column.name not in frame or column.name == "location":
+            continue
+        values = frame[column.name]
+        if isinstance(column.type, DateTime):
+            parsed = pd.to_datetime(values.astype("string").str.strip(), errors="coerce", format="ISO8601")
+            rows[column.name] = parsed.astype(object).where(parsed.notna(), None)
+        elif isinstance(column.type, Date):
+            rows[column.name] = normalise_dates(values)
+        elif isinstance(column.type, Integer):
+            rows[column.name] = pd.to_numeric(values, errors="coerce").astype("Int64")
+        elif isinstance(column.type, (Double, Float)):
+            rows[column.name] = pd.to_numeric(values, errors="coerce")
+        else:
+            rows[column.name] = _strings(values)
+    if "lat" in rows and "lon" in rows:
+        rows["location"] = location_wkt(rows["lat"], rows["lon"])
+    return rows[rows["id"].notna()]
+
+
+def records(rows: pd.DataFrame) -> List[dict]:
+    """Row dicts with None for every missing value"""
+    return rows.astype(object).where(rows.notna(), None).to_dict("records")
+
+
+def upsert_statement(dialect: str, table, rows: List[dict], key_columns: Sequence[str]):
+    """One multi-row INSERT that updates the non-key columns of rows whose key already exists"""
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+
+        if table is WaterSource.__table__ and "location" in rows[0]:
+            # POINT column: WKT in, geometry stored (updates take it from VALUES(location))
+            rows = [{**row, "location": func.ST_GeomFromText(row["location"])} for row in rows]
+        statement = insert(table).values(rows)
+        update_columns = [name for name in rows[0] if name not in key_columns]
+        return statement.on_duplicate_key_update({name: statement.inserted[name] for name in update_columns})
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+
+        statement = insert(table).values(rows)
+        update_columns = [name for name in rows[0] if name not in key_columns]
+        return statement.on_conflict_do_update(
+            index_elements=list(key_columns), set_={name: statement.excluded[name] for name in update_columns}
+        )
+    raise ValueError(f"Upserts are not implemented for {dialect}")
+
+
+def upsert_rows(connection: Connection, table, rows: List[dict], key_columns: Sequence[str], batch_size: int = BATCH_SIZE) -> int:
+    for start in range(0, len(rows), batch_size):
+        connection.execute(upsert_statement(connection.dialect.name, table, rows[start:start + batch_size], key_columns))
+    return len(rows)
+
+
+def load_data_infile(connection: Connection, table, rows: pd.DataFrame) -> int:
+    """MySQL LOAD DATA LOCAL INFILE ... REPLACE of one normalised chunk (whole rows are replaced)"""
+    handle, path = tempfile.mkstemp(suffix=".csv", prefix=f"{table.name}-")
+    try:
+        with os.fdopen(handle, "w", newline="", encoding="utf-8") as f:
+            # Without an escape character LOAD DATA reads an unquoted NULL as NULL (and "" as an embedded quote)
+            rows.to_csv(f, index=False, header=False, na_rep="NULL", quoting=csv.QUOTE_MINIMAL, date_format="%Y-%m-%d %H:%M:%S")
+        # WKT locations are read into a variable and stored as geometry
+        columns = ", ".join("@location" if name == "location" else f"`{name}`" for name in rows.columns)
+        assignments = " SET `location` = ST_GeomFromText(@location)" if "location" in rows.columns else ""
+        connection.exec_driver_sql(
+            f"LOAD DATA LOCAL INFILE %s REPLACE INTO TABLE `{table.name}` CHARACTER SET utf8mb4 "
+            f"FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' LINES TERMINATED BY '\\n' ({columns})"
+            f"{assignments}",
+            (path,)
+        )
+    finally:
+        os.remove(path)
+    return len(rows)
+
+
+def _require_key(connection: Connection, table, key_columns: Sequence[str]):
+    # Upserts only deduplicate against a primary key or unique index on exactly these columns
+    inspector = inspect(connection)
+    keys = [inspector.get_pk_constraint(table.name).get("constrained_columns") or []]
+    keys += [constraint["column_names"] for constraint in inspector.get_unique_constraints(table.name)]
+    keys += [index["column_names"] for index in inspector.get_indexes(table.name) if index.get("unique")]
+    if not any(set(key) == set(key_columns) for key in keys):
+        raise ValueError(
+            f"{table.name} needs a unique key on ({', '.join(key_columns)}) for idempotent loads; see the bulk_load.py notes in README.md"
+        )
+
+
+def _site_normaliser() -> Callable[[pd.DataFrame], pd.DataFrame]:
+    # Sample numbering carries over between the chunks of one file
+    numbers = SiteSampleNumbers()
+    return lambda frame: normalise_site_chunk(frame, numbers)
+
+
+# table name -> (table, key columns, factory for one file's chunk normaliser)
+TABLES: Dict[str, tuple] = {
+    "site_suburb_data": (SiteSuburbData.__table__, ("site_id", "value_date", "sample_no"), _site_normaliser),
+    "ewsp": (WaterSource.__table__, ("id",), lambda: normalise_ewsp_chunk),
+}
+
+
+def load_csv(
+    engine: Engine,
+    table_name: str,
+    path: str,
+    chunk_size: int = CHUNK_SIZE,
+    batch_size: int = BATCH_SIZE,
+    use_load_data: bool = False,
+    progress: Optional[Callable[[int, int, float], None]] = None
+) -> dict:
+    """Load `path` into `table_name`; returns counts of rows read, loaded and rejected, seconds and the new data version"""
+    table, key_columns, make_normaliser = TABLES[table_name]
+    normalise = make_normaliser()
+    use_load_data = use_load_data and engine.dialect.name == "mysql"
+    with engine.connect() as connection:
+        _require_key(connection, table, key_columns)
+
+    start = time.perf_counter()
+    read = loaded = 0
+    for frame in pd.read_csv(path, chunksize=chunk_size, dtype=str, keep_default_na=False):
+        rows = normalise(frame)
+        read += len(frame)
+        if rows.empty:
+            continue
+        # One transaction per chunk: an interrupted load is resumed by running it again
+        with engine.begin() as connection:
+            if use_load_data:
+                try:
+                    loaded += load_data_infile(connection, table, rows)
+                except DBAPIError as e:
+                    logger.warning(f"LOAD DATA LOCAL INFILE unavailable, using upserts: {e.orig}")
+                    use_load_data = False
+            if not use_load_data:
+                loaded += upsert_rows(connection, table, records(rows), key_columns, batch_size)
+        if progress is not None:
+            progress(read, loaded, time.perf_counter() - start)
+
+    version = None
+    if loaded:
+        with engine.begin() as connection:
+            DataVersion.__table__.create(connection, checkfirst=True)
+            version = data_versions.bump(connection, table_name)
+    return {
+        "read": read,
+        "loaded": loaded,
+        "rejected": read - loaded,
+        "seconds": time.perf_counter() - start,
+        "version": version,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk load a CSV into site_suburb_data or ewsp")
+    parser.add_argument("table", choices=sorted(TABLES))
+    parser.add_argument("path", help="CSV file")
+    parser.add_argument("--url", default=None, help="SQLAlchemy URL (default: the app's database, see DATABASE_URL)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="CSV rows per chunk and transaction")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Rows per multi-row INSERT")
+    parser.add_argument("--load-data", action="store_true", help="Use LOAD DATA LOCAL INFILE on MySQL when allowed")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    url = args.url
+    if url is None:
+        from dotenv import load_dotenv
+        load_dotenv()
+        from database import SQLALCHEMY_DATABASE_URL
+        url = SQLALCHEMY_DATABASE_URL
+    # LOAD DATA LOCAL needs the client side enabled as well as the server's local_infile
+    connect_args = {"local_infile": True} if args.load_data and url.startswith("mysql") else {}
+    engine = create_engine(url, connect_args=connect_args)
+
+    def progress(read, loaded, seconds):
+        print(f"  {read:,} rows read, {loaded:,} loaded, {loaded / max(seconds, 1e-9):,.0f} rows/s", end="\r", flush=True)
+
+    try:
+        result = load_csv(engine, args.table, args.path, args.chunk_size, args.batch_size, args.load_data, progress)
+    except (ValueError, FileNotFoundError) as e:
+        parser.error(str(e))
+    print(" " * 79, end="\r")
+    print(
+        f"{args.table}: {result['loaded']:,} rows loaded, {result['rejected']:,} rejected "
+        f"(no id or date) in {result['seconds']:.1f} s, {result['loaded'] / max(result['seconds'], 1e-9):,.0f} rows/s"
+    )
+    if result["version"] is not None:
+        print(f"{args.table} data version is now {result['version']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
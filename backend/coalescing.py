@@ -0,0 +1,99 @@
+"""
+Single-flight request coalescing
+
+Concurrent identical GET requests (same path, query and content-affecting
+headers) share one in-flight computation: the first request runs the route
+and every request that arrives while it is running receives a replay of its
+response. Streaming responses are not shared: as soon as the leader starts
+streaming, its waiters run the route themselves instead of waiting for the
+stream to end.
+"""
+import asyncio
+from typing import Dict, Optional, Sequence
+
+import metrics
+
+# Request headers that can change the response body
+KEY_HEADERS = (b"accept", b"authorization", b"cookie")
+
+_requests = {
+    result: metrics.counter(
+        "coalesce_requests_total",
+        "GET requests seen by the single-flight layer, by outcome (leader ran the route, coalesced shared its result)",
+        result=result,
+    )
+    for result in ("leader", "coalesced", "fallback")
+}
+_inflight_gauge = metrics.gauge("coalesce_inflight", "Distinct GET computations currently in flight")
+
+
+class CoalescingMiddleware:
+    """ASGI middleware sharing one response among concurrent identical GETs"""
+
+    def __init__(self, app, path_prefixes: Sequence[str] = ("/api/water-sources", "/api/prediction")):
+        self.app = app
+        self.path_prefixes = tuple(path_prefixes)
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+
+    def _key(self, scope) -> tuple:
+        headers = tuple(sorted((key.lower(), value) for key, value in scope["headers"] if key.lower() in KEY_HEADERS))
+        return scope["path"], scope.get("query_string", b""), headers
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "GET"
+            or not scope["path"].startswith(self.path_prefixes)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        key = self._key(scope)
+        flight = self._inflight.get(key)
+        if flight is not None:
+            # shield: a waiter going away must not cancel the shared computation
+            messages = await asyncio.shield(flight)
+            if messages is not None:
+                _requests["coalesced"].inc()
+                for message in messages:
+                    # Outer middleware may edit headers in place, so each replay gets its own copy
+                    if message["type"] == "http.response.start":
+                        message = {**message, "headers": list(message.get("headers", []))}
+                    await send(message)
+                return
+            # The leader's response could not be shared (streamed or failed): run it ourselves
+            _requests["fallback"].inc()
+            await self.app(scope, receive, send)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        _inflight_gauge.inc()
+        _requests["leader"].inc()
+        recorded: Optional[list] = []
+
+        def resolve(messages: Optional[list]):
+            if not future.done():
+                future.set_result(messages)
+                # Requests arriving from now on start a flight of their own
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+
+        async def send_and_record(message):
+            nonlocal recorded
+            if recorded is not None:
+                if message["type"] == "http.response.body" and message.get("more_body", False):
+                    # Streaming: do not buffer for replay, and release the waiters now rather than after the stream
+                    recorded = None
+                    resolve(None)
+                elif message["type"] == "http.response.start":
+                    recorded.append({**message, "headers": list(message.get("headers", []))})
+                else:
+                    recorded.append(message)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            _inflight_gauge.dec()
+            resolve(recorded if recorded and recorded[-1]["type"] == "http.response.body" else None)
@@ -0,0 +1,108 @@
+"""
+Query results as typed NumPy columns
+
+fetch_columns() reads a result with fetchmany() and turns each chunk straight
+into one NumPy array per column: float64 for measurements (NULL becomes NaN),
+datetime64 for dates (strings from SQLite and date objects from MySQL alike,
+NULL becomes NaT) and object arrays for everything else. That avoids building a
+DataFrame, then re-parsing its dates, for the few rows most prediction
+queries return. Site IDs are cleaned and formatted for the model with
+vectorised string operations.
+"""
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from lazy import lazy_module
+
+np = lazy_module("numpy")
+
+# Rows converted to arrays at a time, bounding the tuples held alongside the arrays
+FETCH_CHUNK_ROWS = 10000
+
+
+class ColumnTable:
+    """Named, equal-length NumPy columns from one query"""
+
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        self.columns = columns
+        self.size = len(next(iter(columns.values()))) if columns else 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def __setitem__(self, name: str, values: np.ndarray):
+        self.columns[name] = values
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.columns
+
+    def take(self, positions) -> "ColumnTable":
+        """Rows at `positions` (indices or a boolean mask)"""
+        return ColumnTable({name: values[positions] for name, values in self.columns.items()})
+
+    def row(self, position: int) -> dict:
+        """One row as {column: value}"""
+        return {name: values[position] for name, values in self.columns.items()}
+
+    def records(self) -> List[dict]:
+        """All rows as dicts of Python values"""
+        names = list(self.columns)
+        return [dict(zip(names, row)) for row in zip(*(values.tolist() for values in self.columns.values()))]
+
+
+def _to_array(values: Iterable, dtype: Optional[str]) -> np.ndarray:
+    if dtype is not None:
+        return np.array(values, dtype=dtype)
+    # Explicit object arrays: np.array() would build 2-D arrays from sequences and cast mixed values
+    values = list(values)
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def fetch_columns(
+    bind,
+    query,
+    params: Optional[dict] = None,
+    dtypes: Optional[Dict[str, str]] = None,
+    chunk_size: int = FETCH_CHUNK_ROWS
+) -> ColumnTable:
+    """Run `query` (SQL text or a statement) on a Session, Connection or Engine and return its columns"""
+    if isinstance(bind, Engine):
+        with bind.connect() as connection:
+            return fetch_columns(connection, query, params, dtypes, chunk_size)
+    dtypes = dtypes or {}
+    result = bind.execute(text(query) if isinstance(query, str) else query, params or {})
+    names = list(result.keys())
+    chunks = {name: [] for name in names}
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        for name, values in zip(names, zip(*rows)):
+            chunks[name].append(_to_array(values, dtypes.get(name)))
+    return ColumnTable({
+        name: np.concatenate(parts) if len(parts) > 1 else parts[0] if parts else _to_array((), dtypes.get(name))
+        for name, parts in chunks.items()
+    })
+
+
+def clean_site_ids(site_ids: np.ndarray) -> np.ndarray:
+    """' "100017' and '100017 ' become '100017'"""
+    return np.char.strip(np.char.replace(site_ids.astype(str), '"', ''))
+
+
+def format_site_ids(site_ids: np.ndarray) -> np.ndarray:
+    """Site IDs in the model parameters' ' "<id>' form; missing IDs stay None"""
+    formatted = np.empty(len(site_ids), dtype=object)
+    present = np.asarray(site_ids != None)  # noqa: E711 (elementwise comparison)
+    formatted[present] = np.char.add(' "', site_ids[present].astype(str)).tolist()
+    formatted[~present] = None
+    return formatted
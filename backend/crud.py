@@ -1,82 +1,368 @@
+import asyncio
+import weakref
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
-from typing import List, Optional
-from models import WaterSource
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, or_, select, func, text
+from collections import Counter
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+from models import WaterSource, WATER_SOURCE_FIELDS, DEFAULT_FIELDS
+import snapshot as ewsp_snapshot
+import search_index
+import risk_linkage
 
-def get_all_water_sources(db: Session, skip: int = 0, limit: int = 100) -> List[WaterSource]:
+def parse_fields(fields: Optional[str]) -> Tuple[str, ...]:
+    # Parse a comma-separated ?fields= value into validated column names
+    # None/empty selects DEFAULT_FIELDS (heavy text columns deferred), "*" selects every column
+    if fields is None or not fields.strip():
+        return DEFAULT_FIELDS
+    if fields.strip() == "*":
+        return WATER_SOURCE_FIELDS
+
+    requested = []
+    for name in fields.split(","):
+        name = name.strip()
+        if name and name not in requested:
+            requested.append(name)
+    if not requested:
+        # Only separators (",", " , "): an empty select list is never valid SQL
+        raise ValueError(f"No fields given. Available fields: {', '.join(WATER_SOURCE_FIELDS)}")
+
+    unknown = [name for name in requested if name not in WATER_SOURCE_FIELDS]
+    if unknown:
+        raise ValueError(
+            f"Unknown field(s): {', '.join(unknown)}. Available fields: {', '.join(WATER_SOURCE_FIELDS)}"
+        )
+    return tuple(requested)
+
+# Core table columns; selecting these skips ORM entity hydration entirely
+_columns = WaterSource.__table__.c
+
+def _select_fields(fields: Sequence[str]):
+    # Select only the requested columns so unused (and deferred) columns never leave the database
+    return select(*[_columns[field] for field in fields])
+
+def _fetch(db: Session, statement) -> List[tuple]:
+    # Execute a Core select and return plain row tuples
+    return db.execute(statement).all()
+
+def _snapshot(db: Session) -> Optional[ewsp_snapshot.WaterSourceSnapshot]:
+    # In-memory ewsp snapshot when enabled; reads fall back to SQL otherwise
+    if not ewsp_snapshot.SNAPSHOT_ENABLED:
+        return None
+    return ewsp_snapshot.get_snapshot(db)
+
+# A filter is one value or several alternatives; matching is case-insensitive
+FilterValue = Union[str, Sequence[str], None]
+
+def _filter_values(value: FilterValue) -> Tuple[str, ...]:
+    # Normalise a filter to a tuple of non-empty values
+    if value is None:
+        return ()
+    if isinstance(value, str):
+        value = [value]
+    return tuple(item.strip() for item in value if item and item.strip())
+
+def _filters(**filters: FilterValue) -> Dict[str, Tuple[str, ...]]:
+    # Keep only the filters that are set, keyed by column name
+    normalised = {column: _filter_values(value) for column, value in filters.items()}
+    return {column: values for column, values in normalised.items() if values}
+
+def _filters_key(filters: Dict[str, Tuple[str, ...]]) -> tuple:
+    # Hashable, order-independent form of the filters for per-version caching
+    return tuple(sorted((column, tuple(sorted({value.lower() for value in values}))) for column, values in filters.items()))
+
+def _filter_mask(snapshot: "ewsp_snapshot.WaterSourceSnapshot", filters: Dict[str, Tuple[str, ...]]):
+    # OR the per-value bitsets within a column, AND across columns
+    packed = None
+    for column, values in filters.items():
+        bits = snapshot.match_any(column, values)
+        packed = bits if packed is None else packed & bits
+    return snapshot.all() if packed is None else snapshot.unpack(packed)
+
+def _filter_statement(statement, filters: Dict[str, Tuple[str, ...]]):
+    # Add a case-insensitive IN condition for every filter that is set
+    for column, values in filters.items():
+        statement = statement.where(func.lower(_columns[column]).in_({value.lower() for value in values}))
+    return statement
+
+def get_all_water_sources(db: Session, skip: int = 0, limit: int = 100, fields: Sequence[str] = DEFAULT_FIELDS) -> List[tuple]:
     # Get all water source data
-    return db.query(WaterSource).offset(skip).limit(limit).all()
+    snapshot = _snapshot(db)
+    if snapshot is not None:
+        return snapshot.rows(snapshot.all(), fields, skip, limit)
+    return _fetch(db, _select_fields(fields).offset(skip).limit(limit))
 
-def get_water_sources_by_status(db: Session, status: str) -> List[WaterSource]:
+def get_water_sources_by_status(db: Session, status: str, fields: Sequence[str] = DEFAULT_FIELDS) -> List[tuple]:
     # Filter water sources by status
-    return db.query(WaterSource).filter(WaterSource.status == status).all()
+    snapshot = _snapshot(db)
+    if snapshot is not None:
+        return snapshot.rows(snapshot.equals("status", status), fields)
+    return _fetch(db, _select_fields(fields).where(_columns.status == status))
 
-def get_water_sources_by_type(db: Session, source_type: str) -> List[WaterSource]:
+def get_water_sources_by_type(db: Session, source_type: str, fields: Sequence[str] = DEFAULT_FIELDS) -> List[tuple]:
     # Filter water sources by type
-    return db.query(WaterSource).filter(WaterSource.type == source_type).all()
+    snapshot = _snapshot(db)
+    if snapshot is not None:
+        return snapshot.rows(snapshot.equals("type", source_type), fields)
+    return _fetch(db, _select_fields(fields).where(_columns.type == source_type))
 
-def get_water_sources_by_lga(db: Session, lga: str) -> List[WaterSource]:
+def get_water_sources_by_lga(db: Session, lga: str, fields: Sequence[str] = DEFAULT_FIELDS) -> List[tuple]:
     # Filter water sources by local government area
-    return db.query(WaterSource).filter(WaterSource.lga == lga).all()
+    snapshot = _snapshot(db)
+    if snapshot is not None:
+        return snapshot.rows(snapshot.equals("lga", lga), fields)
+    return _fetch(db, _select_fields(fields).where(_columns.lga == lga))
 
-def get_water_sources_by_town(db: Session, town: str) -> List[WaterSource]:
+def get_water_sources_by_town(db: Session, town: str, fields: Sequence[str] = DEFAULT_FIELDS) -> List[tuple]:
     # Filter water sources by nearby town
-    return db.query(WaterSource).filter(WaterSource.near_town == town).all()
+    snapshot = _snapshot(db)
+    if snapshot is not None:
+        return snapshot.rows(snapshot.equals("near_town", town), fields)
+    return _fetch(db, _select_fields(fields).where(_columns.near_town == town))
 
-def get_water_sources_with_coordinates(db: Session) -> List[WaterSource]:
+def get_water_sources_with_coordinates(
+    db: Session,
+    skip: int = 0,
+    limit: Optional[int] = None,
+    fields: Sequence[str] = DEFAULT_FIELDS
+) -> List[tuple]:
     # Get all water sources with coordinate information
-    return db.query(WaterSource).filter(
+    snapshot = _snapshot(db)
+    if snapshot is not None:
+        return snapshot.rows(snapshot.has_coordinates(), fields, skip, limit)
+
+    statement = _select_fields(fields).where(
         and_(
-            WaterSource.lat.isnot(None),
-            WaterSource.lon.isnot(None)
+            _columns.lat.isnot(None),
+            _columns.lon.isnot(None)
         )
-    ).all()
+    )
+    # Paginate in SQL rather than slicing the full result set
+    if skip:
+        statement = statement.offset(skip)
+    if limit is not None:
+        statement = statement.limit(limit)
+    return _fetch(db, statement)
+
+def get_water_sources_count(
+    db: Session,
+    status: FilterValue = None,
+    source_type: FilterValue = None,
+    lga: FilterValue = None,
+    town: FilterValue = None,
+    suitable_use: FilterValue = None
+) -> int:
+    # Get total count of water sources, optionally with the same filters as search_water_sources
+    filters = _filters(status=status, type=source_type, lga=lga, near_town=town, suitable_use=suitable_use)
+    snapshot = _snapshot(db)
+    if snapshot is not None:
+        if not filters:
+            return snapshot.size
+        # Cached per table version, like facets
+        return snapshot.derived(("count", _filters_key(filters)), lambda snap: int(_filter_mask(snap, filters).sum()))
+    return db.execute(_filter_statement(select(func.count()).select_from(WaterSource.__table__), filters)).scalar()
 
-def get_water_sources_count(db: Session) -> int:
-    # Get total count of water sources
-    return db.query(WaterSource).count()
+def estimate_water_sources_count(db: Session) -> Optional[int]:
+    # Row estimate from MySQL table statistics (no scan); None when the backend keeps no such statistics
+    if db.get_bind().dialect.name != "mysql":
+        return None
+    estimate = db.execute(
+        text(
+            "SELECT TABLE_ROWS FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table"
+        ),
+        {"table": WaterSource.__tablename__}
+    ).scalar()
+    return None if estimate is None else int(estimate)
 
-def get_water_sources_by_radius(db: Session, center_lat: float, center_lon: float, radius_km: float) -> List[WaterSource]:
+def get_water_sources_by_radius(
+    db: Session,
+    center_lat: float,
+    center_lon: float,
+    radius_km: float,
+    fields: Sequence[str] = DEFAULT_FIELDS
+) -> List[tuple]:
 
     # Filter water sources by geographic radius
     # Use simple rectangular bounding box filtering, then perform precise distance calculation at application layer
-    
+
     # 1 degree latitude ≈ 111 km
     lat_delta = radius_km / 111.0
     # 1 degree longitude ≈ 111 * cos(lat) km
     lon_delta = radius_km / (111.0 * abs(center_lat))
-    
-    return db.query(WaterSource).filter(
+
+    snapshot = _snapshot(db)
+    if snapshot is not None:
+        lat = snapshot.numeric["lat"]
+        lon = snapshot.numeric["lon"]
+        # NaN (missing coordinates) compares False, matching the IS NOT NULL conditions
+        mask = (
+            (lat >= center_lat - lat_delta) & (lat <= center_lat + lat_delta) &
+            (lon >= center_lon - lon_delta) & (lon <= center_lon + lon_delta)
+        )
+        return snapshot.rows(mask, fields)
+
+    return _fetch(db, _select_fields(fields).where(
         and_(
-            WaterSource.lat.isnot(None),
-            WaterSource.lon.isnot(None),
-            WaterSource.lat >= center_lat - lat_delta,
-            WaterSource.lat <= center_lat + lat_delta,
-            WaterSource.lon >= center_lon - lon_delta,
-            WaterSource.lon <= center_lon + lon_delta
+            _columns.lat.isnot(None),
+            _columns.lon.isnot(None),
+            _columns.lat >= center_lat - lat_delta,
+            _columns.lat <= center_lat + lat_delta,
+            _columns.lon >= center_lon - lon_delta,
+            _columns.lon <= center_lon + lon_delta
         )
-    ).all()
+    ))
 
 def search_water_sources(
-    db: Session, 
-    status: Optional[str] = None,
-    source_type: Optional[str] = None,
-    lga: Optional[str] = None,
-    town: Optional[str] = None,
+    db: Session,
+    status: FilterValue = None,
+    source_type: FilterValue = None,
+    lga: FilterValue = None,
+    town: FilterValue = None,
     skip: int = 0,
-    limit: int = 100
-) -> List[WaterSource]:
+    limit: int = 100,
+    fields: Sequence[str] = DEFAULT_FIELDS,
+    suitable_use: FilterValue = None
+) -> List[tuple]:
     # Comprehensive search for water sources
-    query = db.query(WaterSource)
-    
-    # Add filter conditions
-    if status:
-        query = query.filter(WaterSource.status == status)
-    if source_type:
-        query = query.filter(WaterSource.type == source_type)
-    if lga:
-        query = query.filter(WaterSource.lga == lga)
-    if town:
-        query = query.filter(WaterSource.near_town == town)
-    
-    return query.offset(skip).limit(limit).all()
+    # Each filter takes one value or a list of alternatives, matched case-insensitively
+    filters = _filters(status=status, type=source_type, lga=lga, near_town=town, suitable_use=suitable_use)
+    snapshot = _snapshot(db)
+    if snapshot is not None:
+        return snapshot.rows(_filter_mask(snapshot, filters), fields, skip, limit)
+
+    statement = _filter_statement(_select_fields(fields), filters)
+    return _fetch(db, statement.offset(skip).limit(limit))
+
+def get_water_sources_with_risk(
+    db: Session,
+    status: FilterValue = None,
+    source_type: FilterValue = None,
+    lga: FilterValue = None,
+    town: FilterValue = None,
+    suitable_use: FilterValue = None,
+    skip: int = 0,
+    limit: int = 100,
+    fields: Sequence[str] = DEFAULT_FIELDS
+) -> List[tuple]:
+    # Water sources with the forecast risk of their linked monitoring sites (same filters as search_water_sources)
+    # Always served from the snapshot; each row is `fields` values followed by its risk summary or None
+    filters = _filters(status=status, type=source_type, lga=lga, near_town=town, suitable_use=suitable_use)
+    snapshot = ewsp_snapshot.get_snapshot(db)
+    linkage = risk_linkage.get_linkage(db, snapshot)
+    return linkage.rows(snapshot, _filter_mask(snapshot, filters), fields, skip, limit)
+
+# Rows per fetch when streaming exports
+EXPORT_CHUNK_SIZE = 1000
+
+def iter_water_sources(
+    db: Session,
+    status: FilterValue = None,
+    source_type: FilterValue = None,
+    lga: FilterValue = None,
+    town: FilterValue = None,
+    suitable_use: FilterValue = None,
+    fields: Sequence[str] = DEFAULT_FIELDS,
+    chunk_size: int = EXPORT_CHUNK_SIZE
+) -> Iterator[List[tuple]]:
+    # Stream matching rows in chunks through a server-side cursor (same filters as search_water_sources)
+    # Memory stays bounded by one chunk however large the table is
+    filters = _filters(status=status, type=source_type, lga=lga, near_town=town, suitable_use=suitable_use)
+    statement = _filter_statement(_select_fields(fields), filters).order_by(_columns.id)
+    result = db.execute(statement.execution_options(yield_per=chunk_size))
+    try:
+        for chunk in result.partitions():
+            yield chunk
+    finally:
+        result.close()
+
+# Columns reported by get_water_source_facets, keyed by their response name
+FACET_FIELDS = {
+    "status": "status",
+    "type": "type",
+    "lga": "lga",
+    "near_town": "near_town",
+    "suitable_use": "suitable_use",
+}
+
+def _facet_buckets(counter: Counter) -> List[dict]:
+    # Most common first, ties by value; rows without a value are not a facet
+    buckets = [(value, count) for value, count in counter.items() if value is not None]
+    buckets.sort(key=lambda bucket: (-bucket[1], str(bucket[0])))
+    return [{"value": value, "count": count} for value, count in buckets]
+
+def get_water_source_facets(
+    db: Session,
+    status: FilterValue = None,
+    source_type: FilterValue = None,
+    lga: FilterValue = None,
+    town: FilterValue = None,
+    suitable_use: FilterValue = None
+) -> dict:
+    # Distinct values and counts for every facet column, narrowed by the applied filters
+    filters = _filters(status=status, type=source_type, lga=lga, near_town=town, suitable_use=suitable_use)
+    snapshot = _snapshot(db)
+    if snapshot is not None:
+        def build(snap):
+            mask = _filter_mask(snap, filters)
+            return {
+                "total": int(mask.sum()),
+                "facets": {
+                    name: _facet_buckets(Counter(snap.columns[column][mask].tolist()))
+                    for name, column in FACET_FIELDS.items()
+                },
+            }
+        # Cached per table version: repeated calls cost nothing until the snapshot refreshes
+        return snapshot.derived(("facets", _filters_key(filters)), build)
+
+    total = db.execute(_filter_statement(select(func.count()).select_from(WaterSource.__table__), filters)).scalar()
+    facets = {}
+    for name, column in FACET_FIELDS.items():
+        statement = _filter_statement(select(_columns[column], func.count()).group_by(_columns[column]), filters)
+        facets[name] = _facet_buckets(Counter(dict(db.execute(statement).all())))
+    return {"total": total, "facets": facets}
+
+
+def search_water_sources_text(
+    db: Session,
+    query: str,
+    limit: int = 20,
+    fields: Sequence[str] = DEFAULT_FIELDS
+) -> List[tuple]:
+    # Full-text search over site name, address, town and comments
+    # Always served from the in-memory index; each row is `fields` values followed by its BM25 score
+    snapshot = ewsp_snapshot.get_snapshot(db)
+    ranked = search_index.search(snapshot, query, limit)
+    positions = snapshot.positions_by_id()
+    rows = snapshot.rows_at([positions[row_id] for row_id, _ in ranked], fields)
+    return [row + (round(score, 4),) for row, (_, score) in zip(rows, ranked)]
+
+def suggest_water_source_terms(db: Session, prefix: str, limit: int = 10) -> List[dict]:
+    # Autocomplete: indexed terms starting with the last word of `prefix`
+    return search_index.suggest(ewsp_snapshot.get_snapshot(db), prefix, limit)
+
+# Reads that always go through the snapshot, whatever SNAPSHOT_ENABLED says
+_SNAPSHOT_READS = {get_water_sources_with_risk, search_water_sources_text, suggest_water_source_terms}
+
+# One lock per event loop (TestClient runs each request on its own loop)
+_state_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]" = weakref.WeakKeyDictionary()
+
+def _state_lock() -> asyncio.Lock:
+    loop = asyncio.get_running_loop()
+    lock = _state_locks.get(loop)
+    if lock is None:
+        lock = _state_locks[loop] = asyncio.Lock()
+    return lock
+
+async def run_async(db: AsyncSession, function: Callable[..., Any], *args, **kwargs) -> Any:
+    # Run any of the functions above on an AsyncSession: the same statements execute through the
+    # async driver, so the event loop serves other requests while the database works
+    # Snapshot and risk-linkage loads hold thread locks across their queries; on the event loop a
+    # second read blocking on such a lock would stall the loop thread the load needs to finish,
+    # so reads that can trigger a load take turns on an asyncio lock instead (warm reads do no I/O
+    # and never wait on it for long)
+    if not ewsp_snapshot.SNAPSHOT_ENABLED and function not in _SNAPSHOT_READS:
+        return await db.run_sync(function, *args, **kwargs)
+    async with _state_lock():
+        return await db.run_sync(function, *args, **kwargs)
+
@@ -0,0 +1,63 @@
+"""
+Version counters for bulk-loaded tables
+
+bulk_load.py bumps a table's counter in data_versions after every load. The
+ewsp snapshot and site data fingerprints include it, so loads that only update
+rows in place (leaving COUNT(*) and MAX(...) unchanged) still refresh the
+snapshot, the risk linkage and their ETags. Databases without the
+data_versions table report version 0.
+"""
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import inspect, select, update
+from sqlalchemy.engine import Connection
+
+from models import DataVersion
+
+# Seconds before a database found without data_versions is checked again
+TABLE_RECHECK_SECONDS = 60.0
+
+_table = DataVersion.__table__
+
+# Database URL -> (table present, monotonic time of the check); presence is remembered for good
+_checked = {}
+_lock = threading.Lock()
+
+
+def _has_table(connection: Connection) -> bool:
+    key = connection.engine.url.render_as_string()
+    with _lock:
+        checked = _checked.get(key)
+    if checked is not None and (checked[0] or time.monotonic() - checked[1] < TABLE_RECHECK_SECONDS):
+        return checked[0]
+    present = inspect(connection).has_table(_table.name)
+    with _lock:
+        _checked[key] = (present, time.monotonic())
+    return present
+
+
+def fetch(db, name: str) -> int:
+    """Current version of table `name` (a Session or Connection); 0 when never bumped"""
+    connection = db if isinstance(db, Connection) else db.connection()
+    if not _has_table(connection):
+        return 0
+    return connection.execute(select(_table.c.version).where(_table.c.name == name)).scalar() or 0
+
+
+def bump(connection: Connection, name: str) -> int:
+    """Increment the version of table `name` (creating the counter at 1); returns the new version"""
+    now = datetime.utcnow()
+    updated = connection.execute(
+        update(_table).where(_table.c.name == name).values(version=_table.c.version + 1, updated_at=now)
+    ).rowcount
+    if not updated:
+        connection.execute(_table.insert().values(name=name, version=1, updated_at=now))
+    return connection.execute(select(_table.c.version).where(_table.c.name == name)).scalar()
+
+
+def reset():
+    """Forget which databases have the table (tests)"""
+    with _lock:
+        _checked.clear()
@@ -1,18 +1,264 @@
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+import logging
+import os
+import threading
+import time
 
-DB_USER = "admin"
-DB_PASSWORD = "GreedIsGood123"
-DB_HOST = "ta15.c3geweai45gs.ap-southeast-2.rds.amazonaws.com"
-DB_PORT = "3306"
-DB_NAME = "watersafe"
+from sqlalchemy import create_engine, make_url, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
-SQLALCHEMY_DATABASE_URL = (
+import metrics
+import query_stats
+import replicas
+
+logger = logging.getLogger(__name__)
+
+DB_USER = os.getenv("DB_USER", "admin")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "GreedIsGood123")
+DB_HOST = os.getenv("DB_HOST", "ta15.c3geweai45gs.ap-southeast-2.rds.amazonaws.com")
+DB_PORT = os.getenv("DB_PORT", "3306")
+DB_NAME = os.getenv("DB_NAME", "watersafe")
+
+# Full URL overriding the DB_* settings, e.g. sqlite:///./watersafe.db seeded by local_db.py
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+SQLALCHEMY_DATABASE_URL = DATABASE_URL or (
     f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 )
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_pre_ping=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Connection pool settings
+# Size the pool against real concurrency: sync routes and dependencies run in a
+# 40-thread pool per uvicorn worker, so pool_size + max_overflow bounds how many
+# of them can hold a connection at once
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# Seconds before a connection is replaced; keep below MySQL wait_timeout
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Seconds a checkout waits for a free connection before failing
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Test each connection with a round trip on checkout (safe default; recycle alone avoids most stale connections)
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() not in ("0", "false", "no")
+# Connections opened at startup so the first requests do not pay connect latency
+DB_POOL_WARM = int(os.getenv("DB_POOL_WARM", "2"))
+
+_checkout_wait = metrics.histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection (including connect)"
+)
+_overflow_events = metrics.counter("db_pool_overflow_total", "Connections opened beyond pool_size")
+_checkout_timeouts = metrics.counter("db_pool_timeouts_total", "Checkouts that gave up after pool_timeout")
+
+
+class _InstrumentedCheckout:
+    """Pool mixin recording checkout wait time, overflow connections and timeouts"""
+
+    def _do_get(self):
+        overflow_before = self._overflow
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            _checkout_timeouts.inc()
+            raise
+        finally:
+            _checkout_wait.observe(time.perf_counter() - start)
+            if self._overflow > max(overflow_before, 0):
+                _overflow_events.inc()
+
+
+class InstrumentedQueuePool(_InstrumentedCheckout, QueuePool):
+    """QueuePool recording checkout wait time, overflow connections and timeouts"""
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedCheckout, AsyncAdaptedQueuePool):
+    """Async-driver pool with the same checkout metrics"""
+
+
+# Comma-separated read-replica URLs (sync drivers, like the primary); empty sends everything to the primary
+DB_REPLICA_URLS = [url.strip() for url in os.getenv("DB_REPLICA_URLS", "").split(",") if url.strip()]
+
+
+def _connect_args(url: str) -> dict:
+    # Pooled SQLite connections are shared between threadpool threads
+    return {"check_same_thread": False} if make_url(url).get_backend_name() == "sqlite" else {}
+
+
+def _create_engine(url: str):
+    return query_stats.instrument(create_engine(
+        url,
+        connect_args=_connect_args(url),
+        poolclass=InstrumentedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_pre_ping=DB_POOL_PRE_PING
+    ))
+
+
+def _create_async_engine(url: str):
+    # Imported here so the async driver is only needed once an async engine is used
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    async_engine = create_async_engine(
+        async_database_url(url),
+        connect_args=_connect_args(url),
+        poolclass=InstrumentedAsyncQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_pre_ping=DB_POOL_PRE_PING
+    )
+    query_stats.instrument(async_engine.sync_engine)
+    return async_engine
+
+
+engine = _create_engine(SQLALCHEMY_DATABASE_URL)
+
+replica_set = replicas.ReplicaSet([
+    replicas.Replica(f"replica{index}", url, _create_engine(url), _create_async_engine)
+    for index, url in enumerate(DB_REPLICA_URLS, start=1)
+])
+
+
+class RoutingSession(Session):
+    """Session reading from a healthy replica inside read_from_replicas(), otherwise from the primary"""
+
+    def __init__(self, *args, replica_set: replicas.ReplicaSet = replica_set, asynchronous: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replica_set = replica_set
+        self.asynchronous = asynchronous
+        self._replica = None
+        self._wrote = False
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        primary = super().get_bind(mapper=mapper, clause=clause, **kwargs)
+        if self._flushing or getattr(clause, "is_dml", False):
+            # Read-your-writes: once this session writes, it stays on the primary
+            self._wrote = True
+        if self._wrote or kwargs.get("bind") is not None or not replicas.is_read_only():
+            replicas.record_route("primary")
+            return primary
+        # One replica per session, so a request's reads see one consistent copy
+        if self._replica is None or not self._replica.healthy:
+            self._replica = self.replica_set.choose()
+        if self._replica is None:
+            replicas.record_route("primary")
+            return primary
+        replicas.record_route("replica")
+        return self._replica.async_engine.sync_engine if self.asynchronous else self._replica.engine
+
+
+SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine)
+
+metrics.gauge("db_pool_size", "Configured pool size").set(DB_POOL_SIZE)
+metrics.gauge("db_pool_checked_out", "Connections currently in use").set_function(lambda: engine.pool.checkedout())
+metrics.gauge("db_pool_idle", "Idle connections held by the pool").set_function(lambda: engine.pool.checkedin())
+metrics.gauge(
+    "db_pool_overflow", "Overflow connections currently open (negative: unused pool slots)"
+).set_function(lambda: engine.pool.overflow())
+
+# Async drivers for each sync driver, used by the AsyncSession path
+ASYNC_DRIVERS = {
+    "mysql+pymysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+def async_database_url(url: str) -> str:
+    """The same database addressed through its async driver (mysql+pymysql -> mysql+aiomysql)"""
+    parsed = make_url(url)
+    if parsed.drivername in ASYNC_DRIVERS.values():
+        return url
+    driver = ASYNC_DRIVERS.get(parsed.drivername)
+    if driver is None:
+        raise ValueError(f"No async driver configured for {parsed.drivername}")
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_database_url(SQLALCHEMY_DATABASE_URL)
+
+_async_engine = None
+_async_sessionmaker = None
+_async_lock = threading.Lock()
+
+def get_async_engine():
+    """The async engine, created on first use so the driver is only imported when needed"""
+    global _async_engine, _async_sessionmaker
+    if _async_engine is None:
+        with _async_lock:
+            if _async_engine is None:
+                from sqlalchemy.ext.asyncio import async_sessionmaker
+
+                async_engine = _create_async_engine(ASYNC_DATABASE_URL)
+                pool = async_engine.sync_engine.pool
+                metrics.gauge("db_pool_checked_out", "Connections currently in use", engine="async").set_function(
+                    lambda: pool.checkedout()
+                )
+                metrics.gauge("db_pool_idle", "Idle connections held by the pool", engine="async").set_function(
+                    lambda: pool.checkedin()
+                )
+                metrics.gauge(
+                    "db_pool_overflow", "Overflow connections currently open (negative: unused pool slots)", engine="async"
+                ).set_function(lambda: pool.overflow())
+                _async_sessionmaker = async_sessionmaker(
+                    async_engine,
+                    sync_session_class=RoutingSession,
+                    asynchronous=True,
+                    autoflush=False,
+                    expire_on_commit=False
+                )
+                _async_engine = async_engine
+    return _async_engine
+
+async def dispose_async_engine():
+    """Close the async engines' pooled connections (no-op for engines never created)"""
+    global _async_engine, _async_sessionmaker
+    async_engine = _async_engine
+    if async_engine is not None:
+        _async_engine = None
+        _async_sessionmaker = None
+        await async_engine.dispose()
+    for replica in replica_set.replicas:
+        await replica.dispose_async_engine()
+
+def warm_pool(count: int = DB_POOL_WARM) -> int:
+    """Open up to `count` connections of the sync engine and return them to the pool; returns how many were opened"""
+    connections = []
+    try:
+        for _ in range(min(count, DB_POOL_SIZE)):
+            connection = engine.connect()
+            connection.execute(text("SELECT 1"))
+            connections.append(connection)
+    except Exception as e:
+        # The app still starts; connections are opened on demand instead
+        logger.warning(f"Connection pool warm-up stopped after {len(connections)} connection(s): {e}")
+    finally:
+        for connection in connections:
+            connection.close()
+    logger.info(f"Connection pool warmed: {len(connections)} idle connection(s)")
+    return len(connections)
+
+async def warm_async_pool(count: int = DB_POOL_WARM) -> int:
+    """warm_pool() for the async engine the routes query through; run it on the app's event loop"""
+    connections = []
+    try:
+        async_engine = get_async_engine()
+        for _ in range(min(count, DB_POOL_SIZE)):
+            connection = await async_engine.connect()
+            try:
+                await connection.execute(text("SELECT 1"))
+            except Exception:
+                await connection.close()
+                raise
+            connections.append(connection)
+    except Exception as e:
+        logger.warning(f"Async connection pool warm-up stopped after {len(connections)} connection(s): {e}")
+    finally:
+        for connection in connections:
+            await connection.close()
+    logger.info(f"Async connection pool warmed: {len(connections)} idle connection(s)")
+    return len(connections)
 
 def get_db():
     """Get database session"""
@@ -21,3 +267,9 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    """Get async database session"""
+    get_async_engine()
+    async with _async_sessionmaker() as db:
+        yield db
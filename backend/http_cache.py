@@ -0,0 +1,154 @@
+"""
+HTTP conditional caching for GET endpoints backed by the ewsp snapshot
+
+Every successful GET under the configured prefix that is served from the
+snapshot gets an ETag derived from the table-version fingerprint, a
+Last-Modified of when this process saw that fingerprint change, and a
+Cache-Control max-age. Requests whose If-None-Match (or If-Modified-Since)
+still matches are answered with 304 before the route runs, so unchanged
+data costs neither a query nor a body. Responses read from live SQL (the
+snapshot disabled, or /export) carry no validators: the fingerprint is only
+tracked while the snapshot is in use. /with-risk validators also cover the
+risk linkage's version (site data fingerprint and forecast date), which is the
+same in every worker holding the same data; other paths never depend on it.
+"""
+import hashlib
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Callable, Optional, Tuple
+
+import risk_linkage
+import snapshot as ewsp_snapshot
+
+# Seconds clients and proxies may reuse a response without revalidating
+WATER_SOURCES_CACHE_MAX_AGE = int(os.getenv("WATER_SOURCES_CACHE_MAX_AGE", "60"))
+
+# Routes reading live SQL even with the snapshot enabled
+LIVE_SQL_PATHS = ("/api/water-sources/export",)
+
+# Routes embedding forecast risk from the risk linkage
+RISK_PATHS = ("/api/water-sources/with-risk",)
+
+
+def snapshot_version(path: str) -> Optional[Tuple[str, datetime]]:
+    """(version token, last modified) of the loaded ewsp snapshot, without querying
+
+    None for responses not served from the snapshot.
+    """
+    if not ewsp_snapshot.SNAPSHOT_ENABLED or path.startswith(LIVE_SQL_PATHS):
+        return None
+    snapshot = ewsp_snapshot.current_snapshot()
+    if snapshot is None:
+        return None
+    changed_at = snapshot.changed_at
+    token = repr(snapshot.version)
+    if path.startswith(RISK_PATHS):
+        # Forecast risk also depends on the site data and forecast date. Until this worker holds
+        # a linkage for the current snapshot and day, the route builds one and validators follow it
+        linkage = risk_linkage.linkage_for(snapshot)
+        if linkage is None:
+            return None
+        token += repr(linkage.version)
+        changed_at = max(changed_at, linkage.changed_at)
+    return token, datetime.fromtimestamp(changed_at, timezone.utc)
+
+
+def _http_date(value: datetime) -> str:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc).replace(microsecond=0), usegmt=True)
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # Weak comparison (RFC 9110 13.1.2): ignore W/ prefixes
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def _not_modified_since(if_modified_since: str, last_modified: str) -> bool:
+    try:
+        return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+
+
+class ConditionalGetMiddleware:
+    """ASGI middleware adding ETag/Last-Modified/Cache-Control and answering 304s"""
+
+    def __init__(
+        self,
+        app,
+        path_prefix: str = "/api/water-sources",
+        max_age: int = WATER_SOURCES_CACHE_MAX_AGE,
+        version_provider: Callable[[str], Optional[Tuple[str, datetime]]] = snapshot_version,
+    ):
+        self.app = app
+        self.path_prefix = path_prefix
+        self.max_age = max_age
+        self.version_provider = version_provider
+
+    def _validators(self, scope) -> Optional[Tuple[str, str]]:
+        version = self.version_provider(scope["path"])
+        if version is None:
+            return None
+        token, last_modified = version
+        # The representation depends on the path and query as well as the table version
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(token.encode())
+        digest.update(scope["path"].encode())
+        digest.update(b"?" + scope.get("query_string", b""))
+        return f'W/"{digest.hexdigest()}"', _http_date(last_modified)
+
+    def _cache_headers(self, etag: str, last_modified: str) -> list:
+        return [
+            (b"etag", etag.encode("latin-1")),
+            (b"last-modified", last_modified.encode("latin-1")),
+            (b"cache-control", f"public, max-age={self.max_age}".encode("latin-1")),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "GET"
+            or not scope["path"].startswith(self.path_prefix)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        validators = self._validators(scope)
+        if validators is not None:
+            etag, last_modified = validators
+            headers = {key.lower(): value for key, value in scope["headers"]}
+            if_none_match = headers.get(b"if-none-match")
+            if_modified_since = headers.get(b"if-modified-since")
+            if if_none_match is not None:
+                not_modified = _etag_matches(if_none_match.decode("latin-1"), etag)
+            elif if_modified_since is not None:
+                not_modified = _not_modified_since(if_modified_since.decode("latin-1"), last_modified)
+            else:
+                not_modified = False
+
+            if not_modified:
+                await send({"type": "http.response.start", "status": 304, "headers": self._cache_headers(etag, last_modified)})
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        async def send_with_validators(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                # Recompute after the route ran: a cold request may have just loaded the snapshot
+                current = self._validators(scope)
+                if current is not None:
+                    message = dict(message)
+                    message["headers"] = list(message.get("headers", [])) + self._cache_headers(*current)
+            await send(message)
+
+        await self.app(scope, receive, send_with_validators)
@@ -0,0 +1,38 @@
+"""
+Deferred imports for heavy modules
+
+`np = lazy_module("numpy")` binds a stand-in that imports numpy on its first
+attribute access. Importing the app then skips numpy and pandas (about a
+third of a second together) until the startup hook or a request uses them.
+Annotations naming lazy modules must not be evaluated at import time: use
+`from __future__ import annotations` or string annotations.
+"""
+import importlib
+from types import ModuleType
+
+
+class LazyModule:
+    """Stand-in for a module, imported on first attribute access"""
+
+    def __init__(self, name: str):
+        self.__dict__["_lazy_name"] = name
+        self.__dict__["_lazy_module"] = None
+
+    def _load(self) -> ModuleType:
+        module = self._lazy_module
+        if module is None:
+            module = self.__dict__["_lazy_module"] = importlib.import_module(self._lazy_name)
+        return module
+
+    def __getattr__(self, attribute: str):
+        # Only called for attributes not set on the stand-in itself (mock.patch sets them there)
+        return getattr(self._load(), attribute)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self._lazy_module is not None else "not loaded"
+        return f"<lazy module {self._lazy_name!r} ({state})>"
+
+
+def lazy_module(name: str) -> LazyModule:
+    """A stand-in for module `name` that imports it on first use"""
+    return LazyModule(name)
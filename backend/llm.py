@@ -0,0 +1,217 @@
+"""
+Shared OpenAI client for the guidance and symptoms routes
+
+One client per process, created on first use so importing the app does not
+load the SDK. Every LLM route reuses its HTTP connection pool, so keep-alive
+connections and TLS sessions outlive a single request. complete() sends a
+chat completion with per-call timeouts and retries transient failures
+(connection errors, timeouts, 408/409/429 and 5xx) a bounded number of
+times with full-jitter exponential backoff. Latency, retries, outcomes and
+token usage are recorded per route at /metrics.
+
+The SDK calls block, so routes await them through run_blocking()/acomplete():
+they run on a dedicated thread pool, apart from the default threadpool that
+sync database work uses, and at most LLM_ROUTE_CONCURRENCY calls per route run
+at once. Requests past the limit wait on the event loop without holding a
+thread, and slow completions never stall other requests.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Placeholder keys that mean "no key configured" (development mode)
+PLACEHOLDER_KEYS = ("sk-test-key-for-development", "your_openai_api_key_here")
+
+DEFAULT_MODEL = "gpt-4o-mini-2024-07-18"
+
+# Seconds for a whole completion call and for opening a connection
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "30"))
+OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", "5"))
+
+# Connection pool (per worker process): open connections, and idle ones kept for reuse
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "10"))
+OPENAI_KEEPALIVE_SECONDS = float(os.getenv("OPENAI_KEEPALIVE_SECONDS", "60"))
+
+# Retries after the first attempt; backoff before retry n is uniform in [0, min(cap, base * 2**n)]
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+OPENAI_RETRY_BASE_SECONDS = float(os.getenv("OPENAI_RETRY_BASE_SECONDS", "0.5"))
+OPENAI_RETRY_MAX_SECONDS = float(os.getenv("OPENAI_RETRY_MAX_SECONDS", "8"))
+
+# Threads running blocking LLM calls (per worker process), and calls per route running at once
+LLM_WORKER_THREADS = int(os.getenv("LLM_WORKER_THREADS", "16"))
+LLM_ROUTE_CONCURRENCY = int(os.getenv("LLM_ROUTE_CONCURRENCY", "8"))
+
+# Completions take seconds, past the default buckets
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+T = TypeVar("T")
+
+_client = None
+_client_key: Optional[str] = None
+_client_lock = threading.Lock()
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+# Semaphores belong to one event loop: route -> semaphore, per loop
+_route_limits: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+
+
+def api_key() -> Optional[str]:
+    """The configured OpenAI API key, or None when unset or a placeholder"""
+    key = (os.getenv("OPENAI_API_KEY") or "").strip()
+    return key if key and key not in PLACEHOLDER_KEYS else None
+
+
+def get_client():
+    """The shared OpenAI client, or None in development mode (no usable API key or no SDK)"""
+    global _client, _client_key
+    key = api_key()
+    if key is None:
+        return None
+    # A changed key gets a new client; calls in flight finish on the old one
+    if _client is None or _client_key != key:
+        with _client_lock:
+            if _client is None or _client_key != key:
+                try:
+                    import httpx
+                    from openai import OpenAI
+                    http_client = httpx.Client(
+                        limits=httpx.Limits(
+                            max_connections=OPENAI_MAX_CONNECTIONS,
+                            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                            keepalive_expiry=OPENAI_KEEPALIVE_SECONDS,
+                        ),
+                        timeout=httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=OPENAI_CONNECT_TIMEOUT_SECONDS),
+                    )
+                    # Retries happen in complete(), where they are counted
+                    _client = OpenAI(api_key=key, http_client=http_client, max_retries=0)
+                    _client_key = key
+                    logger.info(f"OpenAI client initialized (model {os.getenv('OPENAI_MODEL', DEFAULT_MODEL)})")
+                except Exception as e:
+                    logger.warning(f"OpenAI client initialization failed, using development mode: {e}")
+                    return None
+    return _client
+
+
+def close_client():
+    """Close the shared client's connections (a later call creates a new client)"""
+    global _client, _client_key
+    with _client_lock:
+        client, _client, _client_key = _client, None, None
+    if client is not None:
+        client.close()
+
+
+def _is_transient(error: Exception) -> bool:
+    import openai
+    if isinstance(error, openai.APIConnectionError):  # includes APITimeoutError
+        return True
+    return isinstance(error, openai.APIStatusError) and (
+        error.status_code in (408, 409, 429) or error.status_code >= 500
+    )
+
+
+def _backoff(retry: int) -> float:
+    # Full jitter: retrying workers spread out instead of hitting the API in step
+    return random.uniform(0, min(OPENAI_RETRY_MAX_SECONDS, OPENAI_RETRY_BASE_SECONDS * 2 ** retry))
+
+
+def _record_usage(route: str, response):
+    usage = getattr(response, "usage", None)
+    for kind in ("prompt", "completion"):
+        tokens = getattr(usage, f"{kind}_tokens", None)
+        if isinstance(tokens, int):
+            metrics.counter("llm_tokens_total", "Tokens used by LLM completions", route=route, kind=kind).inc(tokens)
+
+
+def complete(
+    route: str,
+    messages: List[Dict[str, str]],
+    client=None,
+    model: Optional[str] = None,
+    max_retries: Optional[int] = None,
+    **params
+) -> str:
+    """Text of a chat completion, retrying transient failures; raises once retries are used up
+
+    client defaults to the shared client; route labels the metrics.
+    """
+    client = client if client is not None else get_client()
+    if client is None:
+        raise RuntimeError("OpenAI client not configured")
+    model = model or os.getenv("OPENAI_MODEL", DEFAULT_MODEL)
+    max_retries = OPENAI_MAX_RETRIES if max_retries is None else max_retries
+    latency = metrics.histogram("llm_request_seconds", "LLM completion attempt latency", buckets=LATENCY_BUCKETS, route=route)
+
+    retry = 0
+    while True:
+        started = time.perf_counter()
+        try:
+            response = client.chat.completions.create(model=model, messages=messages, **params)
+        except Exception as e:
+            latency.observe(time.perf_counter() - started)
+            if retry >= max_retries or not _is_transient(e):
+                metrics.counter("llm_requests_total", "LLM completions by outcome", route=route, result="error").inc()
+                raise
+            delay = _backoff(retry)
+            retry += 1
+            metrics.counter("llm_retries_total", "LLM completion attempts retried after a transient failure", route=route).inc()
+            logger.warning(f"LLM call for {route} failed ({e}), retry {retry}/{max_retries} in {delay:.2f}s")
+            time.sleep(delay)
+            continue
+        latency.observe(time.perf_counter() - started)
+        metrics.counter("llm_requests_total", "LLM completions by outcome", route=route, result="ok").inc()
+        _record_usage(route, response)
+        return response.choices[0].message.content.strip()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=LLM_WORKER_THREADS, thread_name_prefix="llm")
+    return _executor
+
+
+def _route_limit(route: str) -> asyncio.Semaphore:
+    limits = _route_limits.setdefault(asyncio.get_running_loop(), {})
+    if route not in limits:
+        limits[route] = asyncio.Semaphore(LLM_ROUTE_CONCURRENCY)
+    return limits[route]
+
+
+async def run_blocking(route: str, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Await a blocking LLM call, run on the LLM threads once fewer than LLM_ROUTE_CONCURRENCY of route's calls are running"""
+    started = time.perf_counter()
+    async with _route_limit(route):
+        metrics.histogram("llm_queue_seconds", "Time LLM calls waited for their route's concurrency limit", route=route).observe(
+            time.perf_counter() - started
+        )
+        inflight = metrics.gauge("llm_inflight", "LLM calls running", route=route)
+        inflight.inc()
+        try:
+            # Copy the context, as run_in_threadpool does
+            call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+            return await asyncio.get_running_loop().run_in_executor(_get_executor(), call)
+        finally:
+            inflight.dec()
+
+
+async def acomplete(route: str, messages: List[Dict[str, str]], **params) -> str:
+    """complete() without blocking the event loop"""
+    return await run_blocking(route, complete, route, messages, **params)
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Local database for offline development, tests and benchmarks
+
+Creates the ewsp and site_suburb_data schemas in a local database (normally a
+SQLite file) and seeds them: site_suburb_data from the bundled
+model/site_suburb_data.csv or a synthetic generator, ewsp from a synthetic
+generator. Both generators scale to millions of rows. Point the app at the
+result with DATABASE_URL and every router runs against it unchanged:
+
+    python local_db.py --url sqlite:///./watersafe.db --water-sources 100000
+    DATABASE_URL=sqlite:///./watersafe.db uvicorn main:app
+
+Usage: python local_db.py [--url URL] [--water-sources N] [--site-data csv|synthetic]
+                          [--sites N] [--readings-per-site N] [--seed N] [--drop]
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+from sqlalchemy import Table, create_engine, func, select
+from sqlalchemy.engine import Engine
+
+from models import Base, DataVersion, SiteSuburbData, WaterSource
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model")
+SITE_DATA_CSV = os.path.join(MODEL_DIR, "site_suburb_data.csv")
+MODEL_PARAMETERS_JSON = os.path.join(MODEL_DIR, "site_model_params_1Month.json")
+
+DEFAULT_URL = "sqlite:///./watersafe.db"
+
+# Rows per INSERT batch while seeding
+SEED_BATCH_SIZE = 10000
+
+STATUSES = ["Operational", "Limited", "Closed", "Unknown"]
+TYPES = ["tank", "bore", "standpipe", "dam", "river"]
+USES = ["drinking", "stock", "firefighting", "domestic"]
+LGAS = ["Buloke", "Mildura", "Swan Hill", "Gannawarra", "Loddon", "Yarriambiack"]
+TOWNS = ["Nyarrin", "Sea Lake", "Ouyen", "Robinvale", "Charlton", "Wycheproof", "Kerang", "Hopetoun"]
+
+_SITE_MEASUREMENTS = ("chloride_cl", "calcium_total", "magnesium_total", "sodium_na", "potassium_k", "salinity_ec", "ph_value")
+
+
+def synthetic_water_sources(count: int, seed: int = 42) -> Iterator[dict]:
+    """Yield dicts shaped like ewsp rows, with realistic text column sizes"""
+    rng = random.Random(seed)
+    base_created = datetime(2024, 1, 1, 8, 0)
+    for index in range(1, count + 1):
+        town = rng.choice(TOWNS)
+        lat = round(rng.uniform(-36.5, -34.0), 6)
+        lon = round(rng.uniform(141.0, 144.5), 6)
+        yield {
+            "id": index,
+            "FID": f"EWSP-{index:07d}",
+            "site_name": f"{town} {rng.choice(TYPES).title()} {index}",
+            "near_town": town,
+            "address": f"{rng.randint(1, 999)} {rng.choice(['Main', 'Creek', 'Station', 'Church'])} Rd, {town}",
+            "lga": rng.choice(LGAS),
+            "type": rng.choice(TYPES),
+            "status": rng.choice(STATUSES),
+            "status_notes": "Checked by council officer; access via locked gate, key at depot. " * rng.randint(2, 8),
+            "suitable_use": rng.choice(USES),
+            "lat": lat,
+            "lon": lon,
+            "location": f"POINT({lon} {lat})",
+            "url": f"https://www.water.vic.gov.au/ewsp/{index}",
+            "image_name": f"ewsp_{index}.jpg",
+            "comments": "Water carted in during dry periods; treat before drinking. " * rng.randint(1, 10),
+            "date_ewsp_checked_dt": date(2023, 1, 1) + timedelta(days=rng.randint(0, 600)),
+            "date_installed_dt": date(1990, 1, 1) + timedelta(days=rng.randint(0, 12000)),
+            "created_at": base_created + timedelta(minutes=index),
+        }
+
+
+def _csv_number(value: str) -> Optional[float]:
+    value = value.strip()
+    return float(value) if value else None
+
+
+def _csv_date(value: str) -> Optional[date]:
+    # The bundled file writes dates as 1979/3/28
+    value = value.strip()
+    return datetime.strptime(value, "%Y/%m/%d").date() if value else None
+
+
+def site_data_from_csv(path: str = SITE_DATA_CSV) -> Iterator[dict]:
+    """Yield site_suburb_data rows from the bundled CSV"""
+    samples = Counter()
+    with open(path, newline="", encoding="utf-8") as f:
+        for record in csv.DictReader(f):
+            row = {column: _csv_number(record[column]) for column in _SITE_MEASUREMENTS}
+            row["site_id"] = record["site_id"].strip()
+            row["value_date"] = _csv_date(record["value_date"])
+            row["nearest_suburb"] = record["nearest_suburb"].strip() or None
+            # Several samples can share a site and day; number them as bulk_load.py does
+            key = (row["site_id"], row["value_date"])
+            row["sample_no"] = samples[key]
+            samples[key] += 1
+            yield row
+
+
+def _modelled_site_ids(path: str = MODEL_PARAMETERS_JSON) -> list:
+    # Site ids the prediction model has parameters for (keys look like ' "100017')
+    try:
+        with open(path) as f:
+            return [key.strip().replace('"', '') for key in json.load(f)]
+    except (OSError, ValueError):
+        return []
+
+
+def synthetic_site_data(sites: int, readings_per_site: int, seed: int = 42) -> Iterator[dict]:
+    """Yield site_suburb_data rows: monthly readings per site, using modelled site ids first"""
+    rng = random.Random(seed)
+    site_ids = _modelled_site_ids()[:sites]
+    site_ids += [f"9{index:06d}" for index in range(len(site_ids), sites)]
+    for site_id in site_ids:
+        suburb = rng.choice(TOWNS)
+        # Site baseline; readings wander around it
+        salinity = rng.uniform(100, 8000)
+        for reading in range(readings_per_site):
+            scale = rng.uniform(0.7, 1.3)
+            yield {
+                "site_id": site_id,
+                "chloride_cl": round(salinity * 0.3 * scale, 2),
+                "calcium_total": round(rng.uniform(5, 300), 2),
+                "magnesium_total": round(rng.uniform(5, 400) * scale, 2),
+                "sodium_na": round(salinity * 0.18 * scale, 2),
+                "potassium_k": round(rng.uniform(0.5, 30), 2),
+                "salinity_ec": round(salinity * scale, 1),
+                "value_date": date(1990, 1, 15) + timedelta(days=30 * reading),
+                "ph_value": round(rng.uniform(5.5, 8.8), 2),
+                "sample_no": 0,
+                "nearest_suburb": suburb,
+            }
+
+
+def create_schema(engine: Engine, drop: bool = False):
+    """Create the ewsp, site_suburb_data and data_versions tables (dropping them first with drop=True)"""
+    tables = [WaterSource.__table__, SiteSuburbData.__table__, DataVersion.__table__]
+    if drop:
+        Base.metadata.drop_all(engine, tables=tables)
+    Base.metadata.create_all(engine, tables=tables)
+
+
+def insert_rows(
+    engine: Engine,
+    table: Table,
+    rows: Iterable[dict],
+    batch_size: int = SEED_BATCH_SIZE,
+    progress: Optional[Callable[[int], None]] = None
+) -> int:
+    """Insert `rows` in batches inside one transaction; returns the number inserted"""
+    total = 0
+    with engine.begin() as connection:
+        if connection.dialect.name == "sqlite":
+            # Bulk load: skip per-commit syncs (a crash mid-seed just means re-seeding)
+            connection.exec_driver_sql("PRAGMA synchronous = OFF")
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                connection.execute(table.insert(), batch)
+                total += len(batch)
+                batch = []
+                if progress is not None:
+                    progress(total)
+        if batch:
+            connection.execute(table.insert(), batch)
+            total += len(batch)
+    return total
+
+
+def seed(
+    engine: Engine,
+    water_sources: int = 5000,
+    site_data: str = "csv",
+    sites: int = 400,
+    readings_per_site: int = 40,
+    seed: int = 42,
+    drop: bool = False,
+    progress: Optional[Callable[[str, int], None]] = None
+) -> Dict[str, int]:
+    """Create the schema and seed both tables; returns the rows inserted per table"""
+    create_schema(engine, drop=drop)
+    site_rows = site_data_from_csv() if site_data == "csv" else synthetic_site_data(sites, readings_per_site, seed)
+
+    def report(name):
+        return (lambda count: progress(name, count)) if progress is not None else None
+
+    return {
+        "ewsp": insert_rows(engine, WaterSource.__table__, synthetic_water_sources(water_sources, seed), progress=report("ewsp")),
+        "site_suburb_data": insert_rows(engine, SiteSuburbData.__table__, site_rows, progress=report("site_suburb_data")),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create and seed a local WaterSafe database")
+    parser.add_argument("--url", default=os.getenv("DATABASE_URL", DEFAULT_URL), help=f"SQLAlchemy URL (default: DATABASE_URL or {DEFAULT_URL})")
+    parser.add_argument("--water-sources", type=int, default=5000, help="Synthetic ewsp rows")
+    parser.add_argument("--site-data", choices=["csv", "synthetic"], default="csv", help="Seed site_suburb_data from the bundled CSV or the generator")
+    parser.add_argument("--sites", type=int, default=400, help="Synthetic sites (--site-data synthetic)")
+    parser.add_argument("--readings-per-site", type=int, default=40, help="Readings per synthetic site")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for the generators")
+    parser.add_argument("--drop", action="store_true", help="Drop and recreate the tables first")
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    if not args.drop:
+        with engine.connect() as connection:
+            existing = [table.name for table in (WaterSource.__table__, SiteSuburbData.__table__)
+                        if engine.dialect.has_table(connection, table.name)
+                        and connection.execute(select(func.count()).select_from(table)).scalar()]
+        if existing:
+            parser.error(f"{args.url} already has rows in: {', '.join(existing)}; pass --drop to recreate")
+
+    start = time.perf_counter()
+
+    def progress(name, count):
+        print(f"  {name}: {count:,} rows", end="\r", flush=True)
+
+    counts = seed(
+        engine,
+        water_sources=args.water_sources,
+        site_data=args.site_data,
+        sites=args.sites,
+        readings_per_site=args.readings_per_site,
+        seed=args.seed,
+        drop=args.drop,
+        progress=progress
+    )
+    elapsed = time.perf_counter() - start
+    for name, count in counts.items():
+        print(f"{name}: {count:,} rows" + " " * 20)
+    print(f"Seeded {args.url} in {elapsed:.1f} s")
+    print(f"Run the API against it with: DATABASE_URL={args.url} uvicorn main:app")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from dotenv import load_dotenv
+import asyncio
 import os
+import threading
 
 # Load environment variables from .env file
 load_dotenv()
@@ -10,8 +14,51 @@ from api.water_sources import router as water_sources_router
 from api.water_quality_prediction import router as prediction_router
 from api.guidance import router as guidance_router
 from api.symptoms import router as symptoms_router
+from snapshot import start_background_refresh, stop_background_refresh
+from database import dispose_async_engine, replica_set, warm_async_pool, warm_pool
+from replicas import ReadReplicaMiddleware
+from http_cache import ConditionalGetMiddleware
+from compression import CompressionMiddleware
+from coalescing import CoalescingMiddleware
+from query_stats import QueryStatsMiddleware
+from llm import close_client
+import metrics
 
-app = FastAPI(title="WaterSafe API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Background resources start here rather than at import, so importing the app stays cheap
+    # Open DB_POOL_WARM connections in the background so an unreachable database does not block startup:
+    # for the sync engine on a thread, and for the async engine the routes use on this loop
+    threading.Thread(target=warm_pool, name="db-pool-warm", daemon=True).start()
+    warm_async = asyncio.create_task(warm_async_pool())
+    # Replicas join the rotation once their first check passes; until then reads use the primary
+    replica_set.start_health_checks()
+    # Load the ewsp snapshot and keep it in sync with the table in the background
+    start_background_refresh()
+    yield
+    stop_background_refresh()
+    replica_set.stop_health_checks()
+    warm_async.cancel()
+    try:
+        await warm_async
+    except asyncio.CancelledError:
+        pass
+    await dispose_async_engine()
+    close_client()
+
+app = FastAPI(title="WaterSafe API", version="1.0.0", lifespan=lifespan)
+
+# Database statements timed and attributed to the request and route running them (/metrics, slow-query log)
+app.add_middleware(QueryStatsMiddleware)
+
+# Concurrent identical GETs share one computation (registered early, so only route output is shared)
+app.add_middleware(CoalescingMiddleware, path_prefixes=("/api/water-sources", "/api/prediction"))
+
+# Database reads of GET requests go to healthy read replicas when DB_REPLICA_URLS is set
+app.add_middleware(ReadReplicaMiddleware)
+
+# ETag/Last-Modified/304 handling for water-source reads (registered before CORS so 304s still carry CORS headers)
+app.add_middleware(ConditionalGetMiddleware, path_prefix="/api/water-sources")
 
 # CORS settings - Support local development and Vercel deployment
 app.add_middleware(
@@ -35,6 +82,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# gzip/brotli for large JSON bodies (outermost, so it sees the final headers and body)
+app.add_middleware(CompressionMiddleware)
+
 # Add API routes
 app.include_router(water_sources_router)
 app.include_router(prediction_router, prefix="/api/prediction", tags=["prediction"])
@@ -49,6 +99,11 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    # Process metrics in the Prometheus text format
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     import os
@@ -0,0 +1,208 @@
+"""
+In-process metrics registry
+
+Counters, gauges and histograms shared by the middleware and data layers,
+exposed at /metrics in the Prometheus text format. Metrics are per process;
+scrape every worker.
+"""
+import math
+import threading
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+# Default histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (
+        f'{name}="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonically increasing count"""
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def _reset(self):
+        self._value = 0.0
+
+
+class Gauge:
+    """Value that goes up and down, or is read from a callback at scrape time"""
+
+    def __init__(self):
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+        self._lock = threading.Lock()
+
+    def set(self, value: float):
+        self._value = value
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self._value -= amount
+
+    def set_function(self, function: Callable[[], float]):
+        self._function = function
+
+    @property
+    def value(self) -> float:
+        return self._function() if self._function is not None else self._value
+
+    def _reset(self):
+        self._value = 0.0
+
+
+class Histogram:
+    """Distribution of observations in cumulative buckets"""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * len(self.buckets)
+        self._sum = 0.0
+        self._count = 0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self._sum += value
+            self._count += 1
+            self._max = max(self._max, value)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[index] += 1
+                    break
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    @property
+    def max(self) -> float:
+        return self._max
+
+    def cumulative(self):
+        """[(upper bound, cumulative count)] including +Inf"""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets, self._counts):
+            total += count
+            result.append((bound, total))
+        result.append((math.inf, self._count))
+        return result
+
+    def _reset(self):
+        self._counts = [0] * len(self.buckets)
+        self._sum = 0.0
+        self._count = 0
+        self._max = 0.0
+
+
+_TYPES = {Counter: "counter", Gauge: "gauge", Histogram: "histogram"}
+
+
+class Registry:
+    """Named metric families, each holding one metric per label set"""
+
+    def __init__(self):
+        self._families: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, kind, name: str, help: str, labels: Dict[str, object], **options):
+        key = _label_key(labels)
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = {"kind": kind, "help": help, "metrics": {}}
+            elif family["kind"] is not kind:
+                raise ValueError(f"Metric {name} is already registered as a {_TYPES[family['kind']]}")
+            metric = family["metrics"].get(key)
+            if metric is None:
+                metric = family["metrics"][key] = kind(**options)
+            return metric
+
+    def counter(self, name: str, help: str = "", **labels) -> Counter:
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str = "", **labels) -> Gauge:
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name: str, help: str = "", buckets: Sequence[float] = DEFAULT_BUCKETS, **labels) -> Histogram:
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def value(self, name: str, **labels) -> Optional[float]:
+        """Current value of a counter or gauge (histograms: observation count), None if absent"""
+        family = self._families.get(name)
+        metric = family["metrics"].get(_label_key(labels)) if family else None
+        if metric is None:
+            return None
+        return metric.count if isinstance(metric, Histogram) else metric.value
+
+    def reset(self):
+        """Zero every metric (callback gauges keep their callbacks)"""
+        with self._lock:
+            for family in self._families.values():
+                for metric in family["metrics"].values():
+                    metric._reset()
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            families = sorted(self._families.items())
+        for name, family in families:
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {_TYPES[family['kind']]}")
+            for key, metric in sorted(family["metrics"].items()):
+                if isinstance(metric, Histogram):
+                    for bound, count in metric.cumulative():
+                        lines.append(f"{name}_bucket{_format_labels(key, ('le', _format_value(bound)))} {count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {_format_value(metric.sum)}")
+                    lines.append(f"{name}_count{_format_labels(key)} {metric.count}")
+                else:
+                    lines.append(f"{name}{_format_labels(key)} {_format_value(metric.value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
@@ -1,5 +1,6 @@
-from sqlalchemy import Column, String, Text, Double, Date, DateTime, BigInteger
+from sqlalchemy import Column, String, Text, Double, Date, DateTime, BigInteger, Integer, SmallInteger, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import deferred
 
 Base = declarative_base()
 
@@ -20,7 +21,7 @@ class WaterSource(Base):
     # Water source type and status
     type = Column(String(255), nullable=True)
     status = Column(String(255), nullable=True)
-    status_notes = Column(Text, nullable=True)
+    status_notes = deferred(Column(Text, nullable=True))  # Heavy column, loaded only on access
     suitable_use = Column(String(255), nullable=True)
     
     # Geographic coordinates
@@ -31,7 +32,7 @@ class WaterSource(Base):
     # Other information
     url = Column(String(512), nullable=True)
     image_name = Column(String(255), nullable=True)
-    comments = Column(Text, nullable=True)
+    comments = deferred(Column(Text, nullable=True))  # Heavy column, loaded only on access
     
     # Timestamps
     date_ewsp_checked_dt = Column(Date, nullable=True)
@@ -71,3 +72,49 @@ class WaterSource(Base):
                 "lon": self.lon,
                 "error": f"Data conversion failed: {str(e)}"
             }
+
+
+# Column names in table order, used for sparse fieldsets (?fields=...)
+WATER_SOURCE_FIELDS = tuple(column.name for column in WaterSource.__table__.columns)
+
+# Large text columns are left out of responses unless explicitly requested
+HEAVY_FIELDS = ("status_notes", "comments")
+
+DEFAULT_FIELDS = tuple(field for field in WATER_SOURCE_FIELDS if field not in HEAVY_FIELDS)
+
+
+class SiteSuburbData(Base):
+    # Water quality measurements per monitoring site - Maps to existing site_suburb_data table
+    # Queries read it with text() by column name; the model defines the schema for local databases
+    __tablename__ = "site_suburb_data"
+    # Natural key used by bulk_load.py upserts
+    __table_args__ = (UniqueConstraint("site_id", "value_date", "sample_no", name="uq_site_suburb_data_sample"),)
+
+    # Surrogate key (INTEGER on SQLite so it autoincrements)
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+
+    site_id = Column(String(64), nullable=False)
+
+    # Measurements used by the prediction model
+    chloride_cl = Column(Double, nullable=True)
+    calcium_total = Column(Double, nullable=True)
+    magnesium_total = Column(Double, nullable=True)
+    sodium_na = Column(Double, nullable=True)
+    potassium_k = Column(Double, nullable=True)
+    salinity_ec = Column(Double, nullable=True)
+    value_date = Column(Date, nullable=True)
+    ph_value = Column(Double, nullable=True)
+
+    # Position among samples taken at the same site on the same day (0 for the first)
+    sample_no = Column(SmallInteger, nullable=False, default=0, server_default="0")
+
+    nearest_suburb = Column(String(255), nullable=True)
+
+
+class DataVersion(Base):
+    # Version counter per bulk-loaded table, bumped by bulk_load.py after every load
+    __tablename__ = "data_versions"
+
+    name = Column(String(64), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=True)
@@ -0,0 +1,155 @@
+"""
+Per-request database query instrumentation
+
+Cursor-execute events on every engine time each statement and read its row
+count, which covers ORM queries, text() queries and pd.read_sql alike.
+Statements are attributed to the request running them (via QueryStatsMiddleware)
+and labelled with its route template in /metrics. Statements slower than
+DB_SLOW_QUERY_SECONDS are logged, and so are requests running more than
+DB_QUERIES_PER_REQUEST_WARN statements, with the most repeated one (usually
+an N+1 loop). Statements run outside a request (snapshot refresh, health
+checks, scripts) are labelled route="background".
+"""
+import collections
+import contextvars
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Statements taking longer than this are logged
+DB_SLOW_QUERY_SECONDS = float(os.getenv("DB_SLOW_QUERY_SECONDS", "0.2"))
+# Requests running more statements than this are logged as likely N+1 queries
+DB_QUERIES_PER_REQUEST_WARN = int(os.getenv("DB_QUERIES_PER_REQUEST_WARN", "20"))
+
+# Characters of SQL kept in log lines
+_LOGGED_SQL_LENGTH = 500
+
+_QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+_current = contextvars.ContextVar("request_queries", default=None)
+
+
+class RequestQueries:
+    """Statements run on behalf of one request"""
+
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.count = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.statements = collections.Counter()
+
+    @property
+    def route(self) -> str:
+        # The router adds the matched route to the scope before any endpoint code runs
+        route = self.scope.get("route")
+        return getattr(route, "path", None) or "unmatched"
+
+    @property
+    def method(self) -> str:
+        return self.scope.get("method", "")
+
+
+def current() -> Optional[RequestQueries]:
+    """The running request's query stats, None outside a request"""
+    return _current.get()
+
+
+def _route(request: Optional[RequestQueries]) -> str:
+    return request.route if request is not None else "background"
+
+
+def _shorten(statement: str) -> str:
+    statement = " ".join(statement.split())
+    return statement if len(statement) <= _LOGGED_SQL_LENGTH else statement[:_LOGGED_SQL_LENGTH] + "..."
+
+
+def record(statement: str, seconds: float, rows: Optional[int]):
+    """Attribute one executed statement to the current request and the aggregate metrics"""
+    request = current()
+    route = _route(request)
+    metrics.histogram("db_query_duration_seconds", "Statement execution time", route=route).observe(seconds)
+    if rows is not None:
+        metrics.counter("db_query_rows_total", "Rows returned or affected, where the driver reports them", route=route).inc(rows)
+    if request is not None:
+        request.count += 1
+        request.seconds += seconds
+        request.rows += rows or 0
+        request.statements[statement] += 1
+    if seconds >= DB_SLOW_QUERY_SECONDS:
+        metrics.counter("db_slow_queries_total", "Statements slower than DB_SLOW_QUERY_SECONDS", route=route).inc()
+        where = f"{request.method} {route}" if request is not None else route
+        logger.warning(
+            f"Slow query ({seconds * 1000:.0f} ms, {rows if rows is not None else '?'} rows) in {where}: {_shorten(statement)}"
+        )
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_started", None)
+    if started is None:
+        return
+    # -1 when the driver does not know (e.g. sqlite3 SELECTs before they are fetched)
+    rowcount = getattr(cursor, "rowcount", -1)
+    record(statement, time.perf_counter() - started, rowcount if rowcount >= 0 else None)
+
+
+def instrument(engine: Engine) -> Engine:
+    """Time and attribute every statement `engine` runs (idempotent; pass async_engine.sync_engine for async engines)"""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    return engine
+
+
+def _finish(request: RequestQueries):
+    route = request.route
+    metrics.histogram(
+        "db_queries_per_request", "Statements run per request", buckets=_QUERY_COUNT_BUCKETS, route=route
+    ).observe(request.count)
+    if request.count > DB_QUERIES_PER_REQUEST_WARN:
+        metrics.counter("db_query_count_warnings_total", "Requests over DB_QUERIES_PER_REQUEST_WARN statements", route=route).inc()
+        statement, repeats = request.statements.most_common(1)[0]
+        logger.warning(
+            f"{request.method} {route} ran {request.count} queries ({request.seconds * 1000:.0f} ms); "
+            f"possible N+1: {repeats} x {_shorten(statement)}"
+        )
+
+
+@contextmanager
+def track_request(scope: dict):
+    """Attribute the enclosed statements to the request described by `scope`"""
+    request = RequestQueries(scope)
+    token = _current.set(request)
+    try:
+        yield request
+    finally:
+        _current.reset(token)
+        _finish(request)
+
+
+class QueryStatsMiddleware:
+    """ASGI middleware attributing database statements to the request and route running them"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with track_request(scope):
+            await self.app(scope, receive, send)
@@ -0,0 +1,216 @@
+"""
+Read-replica selection for read-only requests
+
+Replicas are chosen round-robin among those that passed their last health
+check: a connection round trip and, on MySQL, replication lag within
+DB_REPLICA_MAX_LAG_SECONDS. A replica whose connection fails is taken out of
+rotation at once and comes back after its next successful check. With no
+usable replica, reads go to the primary.
+
+Only code running inside `read_from_replicas()` (every GET request, via
+ReadReplicaMiddleware) is routed to replicas; writes, scripts and background
+jobs always use the primary.
+"""
+import contextvars
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Connection, Engine
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds between replica health checks
+DB_REPLICA_CHECK_SECONDS = float(os.getenv("DB_REPLICA_CHECK_SECONDS", "10"))
+# Replicas further behind the primary than this are skipped
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "30"))
+
+_read_only = contextvars.ContextVar("read_only", default=False)
+
+_routed = {
+    target: metrics.counter("db_routed_statements_total", "Statements by the database they were sent to", target=target)
+    for target in ("primary", "replica")
+}
+
+
+@contextmanager
+def read_from_replicas():
+    """Route the enclosed reads to replicas (the code inside must not write)"""
+    token = _read_only.set(True)
+    try:
+        yield
+    finally:
+        _read_only.reset(token)
+
+
+def is_read_only() -> bool:
+    return _read_only.get()
+
+
+def record_route(target: str):
+    _routed[target].inc()
+
+
+def mysql_replication_lag(connection: Connection) -> Optional[float]:
+    """Seconds behind the source from SHOW REPLICA STATUS; None when it is not a replica"""
+    try:
+        row = connection.exec_driver_sql("SHOW REPLICA STATUS").mappings().first()
+        lag_column = "Seconds_Behind_Source"
+    except Exception:
+        # MySQL before 8.0.22
+        row = connection.exec_driver_sql("SHOW SLAVE STATUS").mappings().first()
+        lag_column = "Seconds_Behind_Master"
+    if row is None:
+        return None
+    lag = row.get(lag_column)
+    # NULL lag means replication is stopped: never acceptable
+    return float("inf") if lag is None else float(lag)
+
+
+def default_lag_probe(connection: Connection) -> Optional[float]:
+    """Replication lag in seconds where the backend reports it, otherwise None (no lag check)"""
+    if connection.dialect.name == "mysql":
+        return mysql_replication_lag(connection)
+    return None
+
+
+class Replica:
+    """One replica: its engines and the outcome of its last health check"""
+
+    def __init__(self, name: str, url: str, engine: Engine, async_engine_factory: Optional[Callable] = None):
+        self.name = name
+        self.url = url
+        self.engine = engine
+        self.healthy = False
+        self.lag: Optional[float] = None
+        self.checked_at = 0.0
+        self._async_engine_factory = async_engine_factory
+        self._async_engine = None
+        self._lock = threading.Lock()
+        self._healthy_gauge = metrics.gauge("db_replica_healthy", "1 when the replica is in rotation", replica=name)
+        self._lag_gauge = metrics.gauge("db_replica_lag_seconds", "Replication lag at the last check", replica=name)
+        self._watch(engine)
+
+    def _watch(self, engine: Engine):
+        @event.listens_for(engine, "handle_error")
+        def take_out_of_rotation(context):
+            # Lost or refused connections: stop routing here until the next successful check
+            if context.is_disconnect or context.connection is None:
+                self.mark_unhealthy(context.original_exception)
+
+    @property
+    def async_engine(self):
+        """Async engine for the same replica, created on first use"""
+        if self._async_engine is None:
+            with self._lock:
+                if self._async_engine is None:
+                    async_engine = self._async_engine_factory(self.url)
+                    self._watch(async_engine.sync_engine)
+                    self._async_engine = async_engine
+        return self._async_engine
+
+    async def dispose_async_engine(self):
+        async_engine, self._async_engine = self._async_engine, None
+        if async_engine is not None:
+            await async_engine.dispose()
+
+    def mark_unhealthy(self, reason=None):
+        if self.healthy:
+            logger.warning(f"Replica {self.name} taken out of rotation: {reason}")
+        self.healthy = False
+        self._healthy_gauge.set(0)
+
+    def check(self, lag_probe: Callable[[Connection], Optional[float]], max_lag: float) -> bool:
+        """Round trip plus lag check; updates and returns `healthy`"""
+        try:
+            with self.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+                lag = lag_probe(connection)
+        except Exception as e:
+            self.lag = None
+            self.mark_unhealthy(e)
+        else:
+            self.lag = lag
+            self._lag_gauge.set(lag if lag is not None else 0)
+            if lag is not None and lag > max_lag:
+                self.mark_unhealthy(f"lagging {lag:g}s behind the primary")
+            else:
+                if not self.healthy:
+                    logger.info(f"Replica {self.name} in rotation")
+                self.healthy = True
+                self._healthy_gauge.set(1)
+        self.checked_at = time.monotonic()
+        return self.healthy
+
+
+class ReplicaSet:
+    """Round-robin choice among healthy replicas"""
+
+    def __init__(
+        self,
+        replicas: List[Replica],
+        lag_probe: Callable[[Connection], Optional[float]] = default_lag_probe,
+        max_lag: float = DB_REPLICA_MAX_LAG_SECONDS
+    ):
+        self.replicas = replicas
+        self.lag_probe = lag_probe
+        self.max_lag = max_lag
+        self._turns = itertools.count()
+        self._checker: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+    def __len__(self) -> int:
+        return len(self.replicas)
+
+    def choose(self) -> Optional[Replica]:
+        """Next healthy replica, or None when none is usable"""
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._turns) % len(healthy)]
+
+    def check(self) -> int:
+        """Check every replica now; returns how many are healthy"""
+        return sum(replica.check(self.lag_probe, self.max_lag) for replica in self.replicas)
+
+    def _check_loop(self, interval: float):
+        while not self._stop_event.is_set():
+            self.check()
+            self._stop_event.wait(interval)
+
+    def start_health_checks(self, interval: float = DB_REPLICA_CHECK_SECONDS):
+        """Start the daemon thread re-checking every replica every `interval` seconds"""
+        if not self.replicas or (self._checker is not None and self._checker.is_alive()):
+            return
+        self._stop_event.clear()
+        self._checker = threading.Thread(
+            target=self._check_loop, args=(interval,), name="db-replica-health", daemon=True
+        )
+        self._checker.start()
+
+    def stop_health_checks(self, timeout: float = 5.0):
+        self._stop_event.set()
+        if self._checker is not None:
+            self._checker.join(timeout)
+        self._checker = None
+
+
+class ReadReplicaMiddleware:
+    """ASGI middleware sending the database reads of GET requests to replicas"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] in ("GET", "HEAD"):
+            with read_from_replicas():
+                await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
@@ -0,0 +1,240 @@
+"""
+Two-tier cache for LLM-generated responses
+
+L1 is the per-process TTLCache. L2 is a store shared by every worker on the
+host that survives restarts: by default a SQLite file (WAL mode, so readers
+never block the writer) holding zlib-compressed JSON with an absolute expiry
+time. Lookups try L1, then L2; an L2 hit is copied into L1 for the rest of its
+lifetime. Store errors are logged and treated as misses, so a locked or
+unwritable file only costs the LLM call it would have saved. Async routes use
+aget()/aput(), which run store reads and writes in a worker thread so a busy
+SQLite file never stalls the event loop; L1 hits stay on the loop.
+
+Responses can echo users' health details, so the store is private: the
+default file lives in the user's cache directory, is created owner-only
+(0600), and keys are stored as SHA-256 digests. LLM_CACHE_PATH selects
+another SQLite file; set it to "off" for memory-only caching. Other stores plug in through the get/put/clear interface of
+SQLiteStore.
+"""
+import asyncio
+import hashlib
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Callable, Generic, Optional, Type, TypeVar
+
+from pydantic import BaseModel
+
+import metrics
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+def _default_cache_path() -> str:
+    # $XDG_CACHE_HOME/watersafe or ~/.cache/watersafe: owned by the app's user, unlike the shared temp directory
+    cache_home = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "watersafe", "llm-cache.sqlite3")
+
+
+# Shared store file; "off" keeps responses in process memory only
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", _default_cache_path())
+
+# zlib level for stored payloads (LLM JSON compresses 3-5x)
+LLM_CACHE_COMPRESSION_LEVEL = int(os.getenv("LLM_CACHE_COMPRESSION_LEVEL", "6"))
+
+# Defaults for response caches without their own settings
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(15 * 60)))
+RESPONSE_CACHE_ENTRIES = int(os.getenv("RESPONSE_CACHE_ENTRIES", "1024"))
+RESPONSE_CACHE_BYTES = int(os.getenv("RESPONSE_CACHE_BYTES", str(16 * 1024 * 1024)))
+
+# Expired rows are purged once every this many writes
+PURGE_EVERY_PUTS = 256
+
+Model = TypeVar("Model", bound=BaseModel)
+
+
+class SQLiteStore:
+    """Compressed payloads in a SQLite file, keyed by (namespace, key), with expiry times"""
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        # Shared by every thread writing through this store
+        self._puts = itertools.count(1)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        # Owner-only before SQLite opens it; the -wal and -shm files take the same mode
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+        os.chmod(path, 0o600)
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, expires_at REAL NOT NULL, payload BLOB NOT NULL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_responses_expires_at ON responses (expires_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread: async routes reach the store from worker threads, LLM calls from the LLM threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _digest(key: str) -> str:
+        # Keys are derived from request content; only their digest is written to disk
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def get(self, namespace: str, key: str, now: float) -> Optional[tuple]:
+        """(payload, expires_at) of a live entry, or None"""
+        return self._connection().execute(
+            "SELECT payload, expires_at FROM responses WHERE namespace = ? AND key = ? AND expires_at > ?",
+            (namespace, self._digest(key), now)
+        ).fetchone()
+
+    def put(self, namespace: str, key: str, payload: bytes, expires_at: float):
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO responses (namespace, key, expires_at, payload) VALUES (?, ?, ?, ?)",
+            (namespace, self._digest(key), expires_at, payload)
+        )
+        if next(self._puts) % PURGE_EVERY_PUTS == 0:
+            # Index range delete: only the expired rows are visited
+            connection.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+
+    def clear(self, namespace: str):
+        self._connection().execute("DELETE FROM responses WHERE namespace = ?", (namespace,))
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def default_store() -> Optional[SQLiteStore]:
+    """The store at LLM_CACHE_PATH (one per process), or None when disabled or unusable"""
+    path = LLM_CACHE_PATH
+    if not path or path.lower() == "off":
+        return None
+    with _stores_lock:
+        if path not in _stores:
+            try:
+                _stores[path] = SQLiteStore(path)
+            except (sqlite3.Error, OSError) as e:
+                logger.warning(f"LLM response store {path} unavailable, caching in memory only: {e}")
+                _stores[path] = None
+        return _stores[path]
+
+
+class ResponseCache(Generic[Model]):
+    """Pydantic responses cached in process memory (L1) and a shared store (L2; store=None for L1 only)"""
+
+    def __init__(
+        self,
+        name: str,
+        model: Type[Model],
+        ttl: float = RESPONSE_CACHE_TTL,
+        max_entries: int = RESPONSE_CACHE_ENTRIES,
+        max_bytes: int = RESPONSE_CACHE_BYTES,
+        store: Optional[Callable[[], Optional[SQLiteStore]]] = default_store
+    ):
+        self.name = name
+        self.model = model
+        self.ttl = ttl
+        # The store is opened on first use, not when the module defining the cache is imported
+        self._store_factory = store
+        self._store: Optional[SQLiteStore] = None
+        self._store_resolved = False
+        self.memory = TTLCache(
+            name, ttl=ttl, max_entries=max_entries, max_bytes=max_bytes,
+            sizeof=lambda response: len(response.model_dump_json())
+        )
+        self._store_hits = metrics.counter("cache_hits_total", "Cache lookups answered from the cache", cache=f"{name}:store")
+        self._store_misses = metrics.counter("cache_misses_total", "Cache lookups that found nothing fresh", cache=f"{name}:store")
+        self._store_errors = metrics.counter("cache_store_errors_total", "Shared cache store reads or writes that failed", cache=name)
+
+    def __len__(self) -> int:
+        return len(self.memory)
+
+    @property
+    def store(self) -> Optional[SQLiteStore]:
+        if not self._store_resolved:
+            self._store = self._store_factory() if self._store_factory is not None else None
+            self._store_resolved = True
+        return self._store
+
+    def get(self, key: str) -> Optional[Model]:
+        response = self.memory.get(key)
+        if response is not None:
+            return response
+        return self._get_stored(key)
+
+    async def aget(self, key: str) -> Optional[Model]:
+        """get() without blocking the event loop: L2 lookups run in a worker thread"""
+        response = self.memory.get(key)
+        if response is not None or (self._store_resolved and self._store is None):
+            return response
+        return await asyncio.to_thread(self._get_stored, key)
+
+    def _get_stored(self, key: str) -> Optional[Model]:
+        if self.store is None:
+            return None
+        try:
+            row = self.store.get(self.name, key, time.time())
+        except sqlite3.Error as e:
+            self._store_errors.inc()
+            logger.warning(f"{self.name} cache store read failed: {e}")
+            return None
+        if row is None:
+            self._store_misses.inc()
+            return None
+        payload, expires_at = row
+        try:
+            response = self.model.model_validate_json(zlib.decompress(payload))
+        except (zlib.error, ValueError) as e:
+            # Corrupt, or written by an older version of the response model
+            self._store_errors.inc()
+            logger.warning(f"{self.name} cache entry unreadable, ignoring it: {e}")
+            return None
+        self._store_hits.inc()
+        # Keep the entry's original expiry in L1 as well
+        self.memory.put(key, response, ttl=expires_at - time.time())
+        return response
+
+    def put(self, key: str, response: Model):
+        self.memory.put(key, response)
+        self._put_stored(key, response)
+
+    async def aput(self, key: str, response: Model):
+        """put() without blocking the event loop: the L2 write runs in a worker thread"""
+        self.memory.put(key, response)
+        if not (self._store_resolved and self._store is None):
+            await asyncio.to_thread(self._put_stored, key, response)
+
+    def _put_stored(self, key: str, response: Model):
+        if self.store is None:
+            return
+        payload = zlib.compress(response.model_dump_json().encode(), LLM_CACHE_COMPRESSION_LEVEL)
+        try:
+            self.store.put(self.name, key, payload, time.time() + self.ttl)
+        except sqlite3.Error as e:
+            self._store_errors.inc()
+            logger.warning(f"{self.name} cache store write failed: {e}")
+
+    def clear(self):
+        """Empty both tiers"""
+        self.memory.clear()
+        if self.store is not None:
+            self.store.clear(self.name)
+
+    def stats(self) -> dict:
+        return self.memory.stats()
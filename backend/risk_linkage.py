@@ -0,0 +1,246 @@
+"""
+Precomputed links between water sources and prediction sites
+
+Each ewsp row is linked to the monitoring sites in site_suburb_data whose
+nearest_suburb matches its near_town (or, failing that, its lga), and carries
+the forecast risk of those sites. Forecasts for every site are computed in one
+batch from a single site_suburb_data scan. The linkage is rebuilt when the ewsp
+snapshot version, the site data fingerprint or the forecast date changes.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import data_versions
+import snapshot as ewsp_snapshot
+from columnar import ColumnTable, clean_site_ids, fetch_columns
+from lazy import lazy_module
+from api.water_quality_prediction import SITE_DATA_COLUMNS, SITE_DATA_DTYPES, load_model_parameters, predict_sites
+
+np = lazy_module("numpy")
+
+logger = logging.getLogger(__name__)
+
+# Seconds between site_suburb_data fingerprint checks
+SITE_DATA_REFRESH_SECONDS = float(os.getenv("SITE_DATA_REFRESH_SECONDS", "300"))
+
+# Worst risk wins when a source links to several sites
+RISK_SEVERITY = {"Safe": 0, "Moderate": 1, "Unsafe": 2}
+
+
+def _place_key(name) -> Optional[str]:
+    # Case- and whitespace-insensitive place name
+    if name is None:
+        return None
+    key = " ".join(str(name).split()).casefold()
+    return key or None
+
+
+def fetch_site_version(db: Session) -> tuple:
+    """Cheap site_suburb_data fingerprint: (COUNT(*), MAX(value_date), bulk-load data version)"""
+    row = db.execute(text("SELECT COUNT(*), MAX(value_date) FROM site_suburb_data")).one()
+    return (*row, data_versions.fetch(db, "site_suburb_data"))
+
+
+def load_site_history(db: Session) -> ColumnTable:
+    """All site_suburb_data rows ordered by site and date, columns named as the model expects"""
+    columns = ", ".join(f"{column} AS '{name}'" for column, name in SITE_DATA_COLUMNS.items())
+    return fetch_columns(
+        db,
+        f"SELECT site_id, nearest_suburb, {columns}, value_date AS 'Date' "
+        f"FROM site_suburb_data ORDER BY site_id, value_date",
+        dtypes=SITE_DATA_DTYPES,
+    )
+
+
+class SiteForecasts:
+    """Batch forecasts for every modelled site, grouped by nearest suburb"""
+
+    def __init__(self, history: ColumnTable, model_params: dict, version: tuple, prediction_date: datetime):
+        self.version = version
+        self.prediction_date = prediction_date.strftime("%Y-%m-%d")
+        # Forecasts are only recomputed when the site data or the forecast date changed
+        self.changed_at = time.time()
+        predictions = predict_sites(history, model_params, prediction_date)
+
+        suburbs = {}
+        if len(history):
+            suburbs = dict(zip(clean_site_ids(history["site_id"]).tolist(), history["nearest_suburb"].tolist()))
+
+        self.by_suburb: Dict[str, List[dict]] = {}
+        for site_id, prediction in predictions.items():
+            suburb = suburbs.get(site_id)
+            key = _place_key(suburb)
+            if key is None:
+                continue
+            self.by_suburb.setdefault(key, []).append({
+                "site_id": site_id,
+                "nearest_suburb": suburb,
+                "wqi_score": prediction["wqi_score"],
+                "risk_level": prediction["risk_level"],
+            })
+        for sites in self.by_suburb.values():
+            sites.sort(key=lambda site: site["site_id"])
+
+
+def _summarise(sites: Sequence[dict], match: str, prediction_date: str) -> dict:
+    worst = max(sites, key=lambda site: (RISK_SEVERITY.get(site["risk_level"], 0), -site["wqi_score"]))
+    return {
+        "risk_level": worst["risk_level"],
+        "wqi_score": min(site["wqi_score"] for site in sites),
+        "prediction_date": prediction_date,
+        "match": match,
+        "sites": list(sites),
+    }
+
+
+class SourceRiskLinkage:
+    """Per-row forecast risk for one ewsp snapshot and one set of site forecasts"""
+
+    def __init__(self, snapshot: "ewsp_snapshot.WaterSourceSnapshot", forecasts: SiteForecasts):
+        self.ewsp_version = snapshot.version
+        self.site_version = forecasts.version
+        self.prediction_date = forecasts.prediction_date
+        self.changed_at = max(snapshot.changed_at, forecasts.changed_at)
+
+        # One shared summary per suburb; rows linking to the same place reference it
+        summaries: Dict[tuple, dict] = {}
+
+        def summary(match: str, key: Optional[str]) -> Optional[dict]:
+            sites = forecasts.by_suburb.get(key) if key is not None else None
+            if not sites:
+                return None
+            if (match, key) not in summaries:
+                summaries[(match, key)] = _summarise(sites, match, forecasts.prediction_date)
+            return summaries[(match, key)]
+
+        self.risk = np.empty(snapshot.size, dtype=object)
+        towns = snapshot.columns["near_town"].tolist()
+        lgas = snapshot.columns["lga"].tolist()
+        for position, (town, lga) in enumerate(zip(towns, lgas)):
+            self.risk[position] = summary("town", _place_key(town)) or summary("lga", _place_key(lga))
+        self.linked = int(sum(risk is not None for risk in self.risk))
+
+    @property
+    def version(self) -> tuple:
+        return self.ewsp_version, self.site_version, self.prediction_date
+
+    def rows(
+        self,
+        snapshot: "ewsp_snapshot.WaterSourceSnapshot",
+        mask: np.ndarray,
+        fields: Sequence[str],
+        skip: int = 0,
+        limit: Optional[int] = None
+    ) -> List[tuple]:
+        """Selected rows as `fields` values followed by their risk summary (None when unlinked)"""
+        positions = np.flatnonzero(mask)
+        end = None if limit is None else skip + limit
+        positions = positions[skip:end]
+        rows = snapshot.rows_at(positions, fields)
+        return [row + (risk,) for row, risk in zip(rows, self.risk[positions].tolist())]
+
+
+_forecasts: Optional[SiteForecasts] = None
+_linkage: Optional[SourceRiskLinkage] = None
+_lock = threading.Lock()
+_last_site_check = 0.0
+
+
+def _forecast_date() -> datetime:
+    # Forecasts look one month ahead, as predict_water_quality does
+    return datetime.combine(datetime.now().date(), datetime.min.time()) + timedelta(days=30)
+
+
+def _load_forecasts(db: Session, version: Optional[tuple] = None) -> SiteForecasts:
+    global _last_site_check
+    start = time.perf_counter()
+    if version is None:
+        version = fetch_site_version(db)
+    forecasts = SiteForecasts(load_site_history(db), load_model_parameters(), version, _forecast_date())
+    _last_site_check = time.monotonic()
+    logger.info(f"Site forecasts computed for {sum(len(sites) for sites in forecasts.by_suburb.values())} sites "
+                f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+    return forecasts
+
+
+def refresh_linkage(db: Session, snapshot: "ewsp_snapshot.WaterSourceSnapshot", check_sites: bool = True) -> bool:
+    """Rebuild the linkage if either side changed; returns True when rebuilt"""
+    global _forecasts, _linkage, _last_site_check
+    with _lock:
+        forecasts = _forecasts
+        if forecasts is None or forecasts.prediction_date != _forecast_date().strftime("%Y-%m-%d"):
+            forecasts = _load_forecasts(db)
+        elif check_sites:
+            version = fetch_site_version(db)
+            _last_site_check = time.monotonic()
+            if version != forecasts.version:
+                forecasts = _load_forecasts(db, version)
+
+        linkage = _linkage
+        if linkage is not None and forecasts is _forecasts and linkage.ewsp_version == snapshot.version:
+            return False
+        _forecasts = forecasts
+        _linkage = SourceRiskLinkage(snapshot, forecasts)
+        return True
+
+
+def get_linkage(db: Session, snapshot: "ewsp_snapshot.WaterSourceSnapshot") -> SourceRiskLinkage:
+    """Read-through access: build on first use, re-check site data inline only when no refresher is running"""
+    linkage = _linkage
+    stale = (
+        linkage is None
+        or linkage.ewsp_version != snapshot.version
+        or linkage.prediction_date != _forecast_date().strftime("%Y-%m-%d")
+    )
+    check_sites = not ewsp_snapshot.is_refreshing() and time.monotonic() - _last_site_check >= SITE_DATA_REFRESH_SECONDS
+    if stale or check_sites:
+        refresh_linkage(db, snapshot, check_sites=check_sites)
+    return _linkage
+
+
+def current_linkage() -> Optional[SourceRiskLinkage]:
+    """The built linkage, or None if nothing has been built yet (never queries)"""
+    return _linkage
+
+
+def linkage_for(snapshot: "ewsp_snapshot.WaterSourceSnapshot") -> Optional[SourceRiskLinkage]:
+    """The built linkage if it belongs to `snapshot` and today's forecast date, else None (never queries)"""
+    linkage = _linkage
+    if (
+        linkage is None
+        or linkage.ewsp_version != snapshot.version
+        or linkage.prediction_date != _forecast_date().strftime("%Y-%m-%d")
+    ):
+        return None
+    return linkage
+
+
+def reset_linkage():
+    """Drop the linkage and site forecasts (next read rebuilds them)"""
+    global _forecasts, _linkage, _last_site_check
+    with _lock:
+        _forecasts = None
+        _linkage = None
+        _last_site_check = 0.0
+
+
+def _refresh_hook(db: Session):
+    # Background refresher: keep an already-built linkage in step with both tables
+    snapshot = ewsp_snapshot.current_snapshot()
+    if _linkage is None or snapshot is None:
+        return
+    if time.monotonic() - _last_site_check >= SITE_DATA_REFRESH_SECONDS or _linkage.ewsp_version != snapshot.version:
+        if refresh_linkage(db, snapshot):
+            logger.info(f"Source risk linkage rebuilt: {_linkage.linked} of {snapshot.size} sources linked")
+
+
+ewsp_snapshot.add_refresh_hook(_refresh_hook)
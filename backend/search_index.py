@@ -0,0 +1,207 @@
+"""
+In-memory full-text index over water-source names and addresses
+
+An inverted index (term -> {row id: weighted term frequency}) built from the
+ewsp snapshot. Queries are ranked with BM25; the last query term also matches
+as a prefix so the same call serves autocomplete. When the snapshot version
+changes the index is updated incrementally: only rows whose indexed text
+changed are re-tokenised.
+"""
+import bisect
+import heapq
+import math
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# Indexed columns and their weights (a match in the site name outranks one in comments)
+SEARCH_FIELDS = {
+    "site_name": 3.0,
+    "near_town": 2.0,
+    "address": 1.5,
+    "comments": 1.0,
+}
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Cap on how many index terms a trailing prefix may expand to
+MAX_PREFIX_EXPANSIONS = 20
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lower-cased word tokens"""
+    if not text:
+        return []
+    return _TOKEN_RE.findall(str(text).casefold())
+
+
+class SearchIndex:
+    """BM25-ranked inverted index keyed by ewsp row id"""
+
+    def __init__(self):
+        self.version = None
+        self._postings: Dict[str, Dict[int, float]] = {}
+        self._doc_terms: Dict[int, Dict[str, float]] = {}
+        self._doc_lengths: Dict[int, float] = {}
+        self._doc_hashes: Dict[int, int] = {}
+        self._total_length = 0.0
+        self._sorted_terms: Optional[List[str]] = None
+        self._norms: Optional[Dict[int, float]] = None
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    def add(self, doc_id: int, values: Dict[str, Optional[str]]):
+        """Index (or re-index) one row"""
+        if doc_id in self._doc_terms:
+            self.remove(doc_id)
+
+        terms: Dict[str, float] = {}
+        for field, weight in SEARCH_FIELDS.items():
+            for token, count in Counter(tokenize(values.get(field))).items():
+                terms[token] = terms.get(token, 0.0) + count * weight
+        length = sum(terms.values())
+
+        self._doc_terms[doc_id] = terms
+        self._doc_lengths[doc_id] = length
+        self._total_length += length
+        self._norms = None
+        for term, frequency in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                self._postings[term] = postings = {}
+                self._sorted_terms = None
+            postings[doc_id] = frequency
+
+    def remove(self, doc_id: int):
+        """Drop one row from the index"""
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        self._total_length -= self._doc_lengths.pop(doc_id)
+        self._doc_hashes.pop(doc_id, None)
+        self._norms = None
+        for term in terms:
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+                self._sorted_terms = None
+
+    def sync(self, snapshot) -> Tuple[int, int, int]:
+        """Bring the index up to date with `snapshot`; returns (added, updated, removed)"""
+        columns = [snapshot.columns[field] for field in SEARCH_FIELDS]
+        fields = list(SEARCH_FIELDS)
+        seen = set()
+        added = updated = 0
+
+        for position, doc_id in enumerate(snapshot.ids.tolist()):
+            seen.add(doc_id)
+            values = tuple(column[position] for column in columns)
+            digest = hash(values)
+            previous = self._doc_hashes.get(doc_id)
+            if previous == digest:
+                continue
+            self.add(doc_id, dict(zip(fields, values)))
+            self._doc_hashes[doc_id] = digest
+            if previous is None:
+                added += 1
+            else:
+                updated += 1
+
+        stale = [doc_id for doc_id in self._doc_terms if doc_id not in seen]
+        for doc_id in stale:
+            self.remove(doc_id)
+
+        self.version = snapshot.version
+        return added, updated, len(stale)
+
+    def _length_norms(self) -> Dict[int, float]:
+        # BM25 document-length normalisation, recomputed only after the index changes
+        if self._norms is None:
+            average_length = self._total_length / len(self._doc_lengths) if self._doc_lengths else 0.0
+            self._norms = {
+                doc_id: BM25_K1 * (1 - BM25_B + BM25_B * length / average_length) if average_length else BM25_K1
+                for doc_id, length in self._doc_lengths.items()
+            }
+        return self._norms
+
+    def _terms_with_prefix(self, prefix: str) -> List[str]:
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self._postings)
+        start = bisect.bisect_left(self._sorted_terms, prefix)
+        end = bisect.bisect_left(self._sorted_terms, prefix + "\uffff")
+        return self._sorted_terms[start:end]
+
+    def suggest(self, prefix: str, limit: int = 10) -> List[dict]:
+        """Index terms starting with `prefix`, most frequent first"""
+        tokens = tokenize(prefix)
+        if not tokens:
+            return []
+        matches = self._terms_with_prefix(tokens[-1])
+        matches.sort(key=lambda term: (-len(self._postings[term]), term))
+        return [{"term": term, "count": len(self._postings[term])} for term in matches[:limit]]
+
+    def search(self, query: str, limit: int = 20, prefix: bool = True) -> List[Tuple[int, float]]:
+        """Rank rows against `query` with BM25; returns [(row id, score)] best first"""
+        tokens = tokenize(query)
+        if not tokens or not self._doc_terms:
+            return []
+
+        # Trailing token expands to every indexed term it prefixes (autocomplete)
+        query_terms = [(token, 1.0) for token in tokens[:-1]]
+        last = tokens[-1]
+        if prefix and not query[-1:].isspace():
+            expansions = self._terms_with_prefix(last)
+            expansions.sort(key=lambda term: (term != last, -len(self._postings[term])))
+            query_terms.extend((term, 1.0 if term == last else 0.9) for term in expansions[:MAX_PREFIX_EXPANSIONS])
+        else:
+            query_terms.append((last, 1.0))
+
+        doc_count = len(self._doc_terms)
+        norms = self._length_norms()
+        scores: Dict[int, float] = {}
+        for term, boost in query_terms:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            weight = boost * math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5)) * (BM25_K1 + 1)
+            for doc_id, frequency in postings.items():
+                scores[doc_id] = scores.get(doc_id, 0.0) + weight * frequency / (frequency + norms[doc_id])
+
+        return heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+_index = SearchIndex()
+_index_lock = threading.Lock()
+
+
+def _synced_index(snapshot) -> SearchIndex:
+    # Caller holds _index_lock
+    if _index.version != snapshot.version:
+        _index.sync(snapshot)
+    return _index
+
+
+def search(snapshot, query: str, limit: int = 20) -> List[Tuple[int, float]]:
+    """BM25 search against the shared index, synced to `snapshot` first"""
+    with _index_lock:
+        return _synced_index(snapshot).search(query, limit)
+
+
+def suggest(snapshot, prefix: str, limit: int = 10) -> List[dict]:
+    """Autocomplete terms from the shared index, synced to `snapshot` first"""
+    with _index_lock:
+        return _synced_index(snapshot).suggest(prefix, limit)
+
+
+def reset_search_index():
+    """Discard the shared index (rebuilt on next use)"""
+    global _index
+    with _index_lock:
+        _index = SearchIndex()
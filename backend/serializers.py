@@ -0,0 +1,100 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+from typing import Iterable, List, Sequence
+
+from fastapi.responses import Response
+
+# orjson is an optional speedup; fall back to the stdlib encoder when it is not installed
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the deployment environment
+    orjson = None
+
+# Columns holding dates/datetimes, serialised as ISO 8601 strings
+DATE_FIELDS = ("date_ewsp_checked_dt", "date_installed_dt", "created_at")
+
+
+class JSONBytesResponse(Response):
+    """Response for bodies that are already encoded JSON bytes (no revalidation or re-encoding)"""
+    media_type = "application/json"
+
+
+def _default(value):
+    # stdlib fallback for types orjson handles natively
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(payload) -> bytes:
+    """Encode a JSON-compatible payload to bytes with the fastest available encoder"""
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default)
+    return json.dumps(payload, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _isoformat_column(values: Sequence) -> list:
+    return [value.isoformat() if value else None for value in values]
+
+
+def _location_column(values: Sequence) -> list:
+    # Point columns can arrive as WKB bytes; match WaterSource.to_dict() which uses str()
+    return [value if value is None or isinstance(value, str) else str(value) for value in values]
+
+
+def _converted_rows(rows: Iterable[tuple], fields: Sequence[str], iso_dates: bool) -> List[tuple]:
+    # Convert location (and optionally date) columns in one pass per column
+    rows = list(rows)
+    if not rows:
+        return []
+
+    columns = list(zip(*rows))
+    converted = False
+    for index, field in enumerate(fields):
+        if field == "location":
+            columns[index] = _location_column(columns[index])
+            converted = True
+        elif field in DATE_FIELDS and iso_dates:
+            columns[index] = _isoformat_column(columns[index])
+            converted = True
+    return list(zip(*columns)) if converted else rows
+
+
+def rows_to_records(rows: Iterable[tuple], fields: Sequence[str]) -> List[dict]:
+    """Turn row tuples (ordered as `fields`) into dicts, converting whole columns at once"""
+    # orjson encodes date/datetime natively, so only the fallback needs the isoformat pass
+    return [dict(zip(fields, row)) for row in _converted_rows(rows, fields, iso_dates=orjson is None)]
+
+
+def encode_rows(rows: Iterable[tuple], fields: Sequence[str]) -> bytes:
+    """Encode row tuples straight to a JSON array of objects"""
+    return dumps(rows_to_records(rows, fields))
+
+
+def encode_ndjson(rows: Iterable[tuple], fields: Sequence[str]) -> bytes:
+    """Encode row tuples as newline-delimited JSON objects"""
+    return b"".join(dumps(record) + b"\n" for record in rows_to_records(rows, fields))
+
+
+def encode_csv(rows: Iterable[tuple], fields: Sequence[str], header: bool = False) -> bytes:
+    """Encode row tuples as CSV lines (None becomes an empty cell)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if header:
+        writer.writerow(fields)
+    writer.writerows(_converted_rows(rows, fields, iso_dates=True))
+    return buffer.getvalue().encode("utf-8")
+
+
+def encode_geojson_features(rows: Iterable[tuple], fields: Sequence[str]) -> bytes:
+    """Encode row tuples carrying `fields` then lat, lon as comma-separated GeoJSON Point features"""
+    features = []
+    for row in _converted_rows(rows, tuple(fields) + ("lat", "lon"), iso_dates=orjson is None):
+        lat, lon = row[-2], row[-1]
+        geometry = None if lat is None or lon is None else {"type": "Point", "coordinates": [lon, lat]}
+        features.append({"type": "Feature", "geometry": geometry, "properties": dict(zip(fields, row))})
+    return b",".join(dumps(feature) for feature in features)
@@ -0,0 +1,80 @@
+"""
+Single-flight deduplication of expensive generations
+
+Concurrent callers asking for the same key while a generation is in flight
+wait for it and receive its result (or its exception) instead of starting
+their own. Used for LLM calls, which take seconds: a burst of identical cold
+requests costs one call, not one per request. If the leading caller is
+cancelled, one of its waiters runs the generation for the rest.
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+import metrics
+
+T = TypeVar("T")
+
+# Set as the shared result when the leader was cancelled
+_CANCELLED = object()
+
+
+class SingleFlight:
+    """Per-key sharing of in-flight async generations within one event loop"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._calls = {
+            result: metrics.counter(
+                "single_flight_calls_total",
+                "Generations requested, by outcome (leader ran it, shared waited on the leader, fallback reran it)",
+                flight=name, result=result,
+            )
+            for result in ("leader", "shared", "fallback")
+        }
+        metrics.gauge("single_flight_inflight", "Distinct generations currently in flight", flight=name).set_function(
+            lambda: len(self._inflight)
+        )
+
+    @property
+    def saved(self) -> int:
+        """Generations avoided so far: callers that received a leader's result"""
+        return int(self._calls["shared"].value)
+
+    async def run(self, key: Hashable, generate: Callable[[], Awaitable[T]]) -> T:
+        flight = self._inflight.get(key)
+        # Futures belong to one event loop (one per worker under uvicorn)
+        if flight is not None and flight.get_loop() is asyncio.get_running_loop():
+            # shield: a waiter going away must not cancel the shared generation
+            try:
+                result = await asyncio.shield(flight)
+            except Exception:
+                # The leader's failure is shared as well
+                self._calls["shared"].inc()
+                raise
+            if result is not _CANCELLED:
+                self._calls["shared"].inc()
+                return result
+            # The first waiter to get here leads the next attempt, the others wait on it
+            self._calls["fallback"].inc()
+            return await self.run(key, generate)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self._calls["leader"].inc()
+        try:
+            result = await generate()
+        except asyncio.CancelledError:
+            future.set_result(_CANCELLED)
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark it retrieved: with no waiters asyncio would log "exception was never retrieved"
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
@@ -0,0 +1,264 @@
+"""
+In-memory snapshot of the ewsp table
+
+The ewsp table is small and changes rarely, so reads are served from a
+columnar copy held in memory. A cheap fingerprint query
+(MAX(id), COUNT(*), MAX(created_at), plus the bulk-load data version)
+detects changes; a background thread polls it and swaps in a fresh snapshot
+when it moves. The database remains the source of truth.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional, Sequence
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+import data_versions
+from lazy import lazy_module
+from models import WaterSource, WATER_SOURCE_FIELDS
+
+np = lazy_module("numpy")
+
+logger = logging.getLogger(__name__)
+
+# Serve crud reads from the snapshot (set WATER_SOURCE_SNAPSHOT=false to always query MySQL)
+SNAPSHOT_ENABLED = os.getenv("WATER_SOURCE_SNAPSHOT", "true").lower() not in ("0", "false", "no")
+
+# Seconds between fingerprint checks
+SNAPSHOT_REFRESH_SECONDS = float(os.getenv("WATER_SOURCE_SNAPSHOT_REFRESH_SECONDS", "60"))
+
+_table = WaterSource.__table__
+_columns = _table.c
+
+# Columns also kept as float arrays so range filters are vectorised
+NUMERIC_FIELDS = ("lat", "lon")
+
+# Maximum values memoised per snapshot via WaterSourceSnapshot.derived()
+DERIVED_CACHE_SIZE = int(os.getenv("WATER_SOURCE_DERIVED_CACHE_SIZE", "512"))
+
+
+def collation_key(value) -> str:
+    """Comparison key matching MySQL's case-insensitive, PAD SPACE collations ('Open ' = 'open')"""
+    return str(value).rstrip(" ").casefold()
+
+
+class WaterSourceSnapshot:
+    """Immutable columnar copy of the ewsp table at one table version"""
+
+    def __init__(self, rows: Sequence[tuple], version: tuple):
+        self.version = version
+        self.loaded_at = time.time()
+        # When this process saw the fingerprint move to `version` (Last-Modified of responses)
+        self.changed_at = self.loaded_at
+        self.size = len(rows)
+
+        values = list(zip(*rows)) if rows else [() for _ in WATER_SOURCE_FIELDS]
+        self.columns: Dict[str, np.ndarray] = {}
+        for field, column in zip(WATER_SOURCE_FIELDS, values):
+            array = np.empty(self.size, dtype=object)
+            array[:] = column
+            self.columns[field] = array
+        self.ids = np.array(self.columns["id"], dtype=np.int64)
+        self.numeric = {
+            field: np.array([np.nan if value is None else value for value in self.columns[field]], dtype=float)
+            for field in NUMERIC_FIELDS
+        }
+        self._derived: "OrderedDict[Hashable, object]" = OrderedDict()
+        self._derived_lock = threading.Lock()
+
+    @property
+    def max_created_at(self):
+        return self.version[2]
+
+    def all(self) -> np.ndarray:
+        """Boolean mask selecting every row"""
+        return np.ones(self.size, dtype=bool)
+
+    def equals(self, field: str, value) -> np.ndarray:
+        """Boolean mask of rows where `field` = `value`, compared as MySQL does (case-insensitive, trailing spaces ignored)"""
+        return self.unpack(self.match_any(field, [value]))
+
+    def bitmaps(self, field: str) -> Dict[str, np.ndarray]:
+        """Packed per-value bitsets for `field`, keyed by collation_key (built once per version)"""
+        def build(snap):
+            positions: Dict[str, List[int]] = {}
+            for position, value in enumerate(snap.columns[field].tolist()):
+                if value is not None:
+                    positions.setdefault(collation_key(value), []).append(position)
+            bitmaps = {}
+            for key, rows in positions.items():
+                mask = np.zeros(snap.size, dtype=bool)
+                mask[rows] = True
+                bitmaps[key] = np.packbits(mask)
+            return bitmaps
+        return self.derived(("bitmaps", field), build)
+
+    def match_any(self, field: str, values: Sequence[str]) -> np.ndarray:
+        """Packed bitset of rows whose `field` equals any of `values` (compared by collation_key)"""
+        bitmaps = self.bitmaps(field)
+        packed = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        for value in values:
+            bits = bitmaps.get(collation_key(value))
+            if bits is not None:
+                packed |= bits
+        return packed
+
+    def unpack(self, packed: np.ndarray) -> np.ndarray:
+        """Boolean row mask from a packed bitset"""
+        return np.unpackbits(packed, count=self.size).astype(bool)
+
+    def has_coordinates(self) -> np.ndarray:
+        """Boolean mask of rows with both lat and lon set"""
+        return ~np.isnan(self.numeric["lat"]) & ~np.isnan(self.numeric["lon"])
+
+    def derived(self, key: Hashable, builder: Callable[["WaterSourceSnapshot"], object]):
+        """Memoise a value computed from this snapshot; it is discarded with the snapshot on refresh"""
+        with self._derived_lock:
+            if key in self._derived:
+                self._derived.move_to_end(key)
+                return self._derived[key]
+        value = builder(self)
+        with self._derived_lock:
+            self._derived[key] = value
+            while len(self._derived) > DERIVED_CACHE_SIZE:
+                self._derived.popitem(last=False)
+        return value
+
+    def rows(self, mask: np.ndarray, fields: Sequence[str], skip: int = 0, limit: Optional[int] = None) -> List[tuple]:
+        """Materialise the selected rows as tuples ordered like `fields`"""
+        indices = np.flatnonzero(mask)
+        end = None if limit is None else skip + limit
+        return self.rows_at(indices[skip:end], fields)
+
+    def rows_at(self, positions: Sequence[int], fields: Sequence[str]) -> List[tuple]:
+        """Materialise rows at the given positions, in that order"""
+        positions = np.asarray(positions, dtype=np.intp)
+        columns = [self.columns[field][positions].tolist() for field in fields]
+        return list(zip(*columns))
+
+    def positions_by_id(self) -> Dict[int, int]:
+        """Row id -> position in the column arrays"""
+        return self.derived("positions_by_id", lambda snap: {row_id: position for position, row_id in enumerate(snap.ids.tolist())})
+
+
+_snapshot: Optional[WaterSourceSnapshot] = None
+_load_lock = threading.Lock()
+_last_check = 0.0
+_refresh_thread: Optional[threading.Thread] = None
+_stop_event = threading.Event()
+_refresh_hooks: List[Callable[[Session], None]] = []
+
+
+def fetch_version(db: Session) -> tuple:
+    """Cheap table fingerprint: (MAX(id), COUNT(*), MAX(created_at), bulk-load data version)"""
+    row = db.execute(
+        select(func.max(_columns.id), func.count(), func.max(_columns.created_at)).select_from(_table)
+    ).one()
+    # The data version catches bulk loads that update rows in place
+    return (*row, data_versions.fetch(db, _table.name))
+
+
+def load_snapshot(db: Session) -> WaterSourceSnapshot:
+    """Read the whole table into a new snapshot"""
+    start = time.perf_counter()
+    version = fetch_version(db)
+    rows = db.execute(
+        select(*[_columns[field] for field in WATER_SOURCE_FIELDS]).order_by(_columns.id)
+    ).all()
+    snapshot = WaterSourceSnapshot(rows, version)
+    logger.info(f"Loaded ewsp snapshot: {snapshot.size} rows in {(time.perf_counter() - start) * 1000:.1f} ms")
+    return snapshot
+
+
+def refresh_snapshot(db: Session, force: bool = False) -> bool:
+    """Reload the snapshot if the table fingerprint changed; returns True when reloaded"""
+    global _snapshot, _last_check
+    with _load_lock:
+        _last_check = time.monotonic()
+        if not force and _snapshot is not None and fetch_version(db) == _snapshot.version:
+            return False
+        previous, _snapshot = _snapshot, load_snapshot(db)
+        if previous is not None and previous.version == _snapshot.version:
+            # Forced reload of unchanged data: the data last changed when it did before
+            _snapshot.changed_at = previous.changed_at
+        return True
+
+
+def current_snapshot() -> Optional[WaterSourceSnapshot]:
+    """The loaded snapshot, or None if nothing has been loaded yet (never queries)"""
+    return _snapshot
+
+
+def get_snapshot(db: Session) -> WaterSourceSnapshot:
+    """Read-through access: load on first use, re-check inline only when no refresher is running"""
+    snapshot = _snapshot
+    if snapshot is None:
+        refresh_snapshot(db)
+    elif not is_refreshing() and time.monotonic() - _last_check >= SNAPSHOT_REFRESH_SECONDS:
+        refresh_snapshot(db)
+    return _snapshot
+
+
+def reset_snapshot():
+    """Drop the loaded snapshot (next read reloads it)"""
+    global _snapshot, _last_check
+    with _load_lock:
+        _snapshot = None
+        _last_check = 0.0
+
+
+def add_refresh_hook(hook: Callable[[Session], None]):
+    """Run `hook(db)` after every background fingerprint check (for state derived from the snapshot)"""
+    if hook not in _refresh_hooks:
+        _refresh_hooks.append(hook)
+
+
+def _refresh_loop(session_factory, interval: float):
+    while not _stop_event.is_set():
+        try:
+            with session_factory() as db:
+                if refresh_snapshot(db):
+                    logger.info(f"ewsp snapshot refreshed to version {_snapshot.version}")
+                for hook in _refresh_hooks:
+                    try:
+                        hook(db)
+                    except Exception as e:
+                        logger.warning(f"Snapshot refresh hook {getattr(hook, '__qualname__', hook)} failed: {e}")
+        except Exception as e:
+            # Keep serving the previous snapshot; the database may be briefly unavailable
+            logger.warning(f"ewsp snapshot refresh failed: {e}")
+        _stop_event.wait(interval)
+
+
+def is_refreshing() -> bool:
+    return _refresh_thread is not None and _refresh_thread.is_alive()
+
+
+def start_background_refresh(session_factory=None, interval: float = SNAPSHOT_REFRESH_SECONDS):
+    """Start the daemon thread that polls the fingerprint and reloads on change"""
+    global _refresh_thread
+    if not SNAPSHOT_ENABLED or is_refreshing():
+        return
+    if session_factory is None:
+        from database import SessionLocal
+        session_factory = SessionLocal
+    _stop_event.clear()
+    _refresh_thread = threading.Thread(
+        target=_refresh_loop, args=(session_factory, interval), name="ewsp-snapshot-refresh", daemon=True
+    )
+    _refresh_thread.start()
+
+
+def stop_background_refresh(timeout: float = 5.0):
+    """Stop the refresher thread"""
+    global _refresh_thread
+    _stop_event.set()
+    if _refresh_thread is not None:
+        _refresh_thread.join(timeout)
+    _refresh_thread = None
@@ -8,10 +8,22 @@ from unittest.mock import Mock, patch, MagicMock
 import pandas as pd
 import json
 import os
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+# Keep LLM responses out of the shared on-disk cache (tests that need it create their own store)
+os.environ["LLM_CACHE_PATH"] = "off"
 
 # Import the FastAPI app
 from main import app
+from database import get_async_db, get_db
+from models import Base, SiteSuburbData, WaterSource
+import query_stats
+import snapshot
+import search_index
 
 @pytest.fixture(scope="session")
 def event_loop():
@@ -32,6 +44,131 @@ def mock_database():
         mock_engine.connect.return_value.__enter__.return_value = Mock()
         yield mock_engine
 
+def _sample_water_sources():
+    """Rows seeded into the in-memory ewsp table"""
+    rows = [
+        ("Creek Tank", "Nyarrin", "1 Creek Rd", "Buloke", "tank", "Operational", "drinking", -35.1, 142.9),
+        ("Town Bore", "Nyarrin", "2 Main St", "Buloke", "bore", "Operational", "stock", -35.2, 143.0),
+        ("Hill Standpipe", "Sea Lake", "3 Hill Rd", "Buloke", "standpipe", "Limited", "drinking", -35.5, 142.8),
+        ("River Point", "Mildura", "4 River Ave", "Mildura", "tank", "Closed", "firefighting", -34.2, 142.1),
+        ("No Coords Tank", "Mildura", "5 Dry St", "Mildura", "tank", "Operational", "drinking", None, None),
+    ]
+    sources = []
+    for index, (site_name, town, address, lga, source_type, status, use, lat, lon) in enumerate(rows, start=1):
+        sources.append(WaterSource(
+            id=index,
+            FID=f"FID-{index}",
+            site_name=site_name,
+            near_town=town,
+            address=address,
+            lga=lga,
+            type=source_type,
+            status=status,
+            status_notes=f"Inspection notes for {site_name}. " * 20,
+            suitable_use=use,
+            lat=lat,
+            lon=lon,
+            location=f"POINT({lon} {lat})",
+            url=f"https://example.org/ewsp/{index}",
+            image_name=f"site_{index}.jpg",
+            comments=f"Community comments about {site_name}. " * 20,
+            date_ewsp_checked_dt=date(2024, 1, index),
+            date_installed_dt=date(2010, 6, index),
+            created_at=datetime(2024, 2, index, 9, 30),
+        ))
+    return sources
+
+@pytest.fixture
+def water_source_db(tmp_path):
+    """SQLite ewsp table wired into the app's get_db and get_async_db dependencies"""
+    # A file, so the sync and async (aiosqlite) engines see the same database
+    database_path = tmp_path / "watersafe.db"
+    engine = create_engine(
+        f"sqlite:///{database_path}",
+        connect_args={"check_same_thread": False},
+    )
+    # NullPool: TestClient runs each request on a new event loop, so async connections are not reused
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}", poolclass=NullPool)
+    AsyncTestingSession = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    # Instrumented like the app's own engines
+    query_stats.instrument(engine)
+    query_stats.instrument(async_engine.sync_engine)
+    Base.metadata.create_all(engine)
+    TestingSession = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    with TestingSession() as session:
+        session.add_all(_sample_water_sources())
+        session.commit()
+
+    def override_get_db():
+        db = TestingSession()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def override_get_async_db():
+        async with AsyncTestingSession() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    snapshot.reset_snapshot()
+    search_index.reset_search_index()
+    yield TestingSession
+    snapshot.reset_snapshot()
+    search_index.reset_search_index()
+    app.dependency_overrides.pop(get_db, None)
+    app.dependency_overrides.pop(get_async_db, None)
+    engine.dispose()
+
+# Measurements (Cl, Ca, Mg, Na, K, EC, pH) giving a Safe, Unsafe or Moderate WQI
+_SAMPLE_SITE_MEASUREMENTS = {
+    "safe": (10, 10, 10, 10, 1, 50, 7.0),
+    "unsafe": (500, 400, 300, 400, 24, 5000, 4.0),
+    "moderate": (125, 100, 75, 100, 6, 250, 7.0),
+}
+_SAMPLE_SITES = [
+    ("A1", "Nyarrin", "safe"),
+    ("B1", "nyarrin ", "unsafe"),
+    ("C1", "Mildura", "safe"),
+    ("D1", "Buloke", "moderate"),
+    ("E1", "Sea Lake", "unsafe"),  # no model parameters, so never forecast
+]
+
+def _site_model_parameters():
+    """Repeat-last model parameters for every sample site except E1"""
+    from api.water_quality_prediction import PARAMETER_NAMES
+    return {
+        f' "{site_id}': {name: {"method": "repeat_last", "coef": [0.0, 0.0]} for name in PARAMETER_NAMES}
+        for site_id, _, _ in _SAMPLE_SITES if site_id != "E1"
+    }
+
+@pytest.fixture
+def site_data_db(water_source_db):
+    """site_suburb_data alongside the ewsp table, with model parameters for the sample sites"""
+    import risk_linkage
+
+    rows = []
+    for site_id, suburb, quality in _SAMPLE_SITES:
+        # An older reading with the opposite quality first: forecasts must use the latest row
+        older = "unsafe" if quality != "unsafe" else "safe"
+        for value_date, measurements in ((date(2020, 1, 1), _SAMPLE_SITE_MEASUREMENTS[older]),
+                                         (date(2023, 6, 1), _SAMPLE_SITE_MEASUREMENTS[quality])):
+            rows.append(dict(
+                zip(("chloride_cl", "calcium_total", "magnesium_total", "sodium_na", "potassium_k", "salinity_ec", "ph_value"),
+                    measurements),
+                site_id=site_id, value_date=value_date, nearest_suburb=suburb
+            ))
+    with water_source_db() as session:
+        session.execute(SiteSuburbData.__table__.insert(), rows)
+        session.commit()
+
+    risk_linkage.reset_linkage()
+    with patch("risk_linkage.load_model_parameters", side_effect=_site_model_parameters):
+        yield water_source_db
+    risk_linkage.reset_linkage()
+
 @pytest.fixture
 def mock_model_parameters():
     """Mock model parameters data"""
@@ -0,0 +1,162 @@
+"""
+Test cases for the bulk loader
+"""
+import csv
+from datetime import date
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.orm import Session
+
+import bulk_load
+import data_versions
+import local_db
+import snapshot
+from models import SiteSuburbData, WaterSource
+from risk_linkage import fetch_site_version
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'bulk.db'}")
+    local_db.create_schema(engine)
+    data_versions.reset()
+    yield engine
+    engine.dispose()
+    data_versions.reset()
+
+
+def _write_csv(path, header, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    return str(path)
+
+
+class TestBulkLoad:
+    """Test cases for chunked, idempotent CSV loads"""
+
+    def test_normalisation(self):
+        """TC-BE-170: Test site ids, dates and numbers are normalised vectorially"""
+        ids = bulk_load.normalise_site_ids(pd.Series([' "100017', "100017 ", "", '"'], dtype=str))
+        assert ids.tolist()[:2] == ["100017", "100017"]
+        assert ids.isna().tolist()[2:] == [True, True]
+
+        dates = bulk_load.normalise_dates(pd.Series(["1979/3/28", "1976-05-25", "not a date", ""]))
+        assert dates.tolist() == [date(1979, 3, 28), date(1976, 5, 25), None, None]
+
+        # The merged format's headers map onto the table; rows without an id or date are dropped
+        frame = pd.DataFrame({
+            "Site ID": [' "6026', ' "6026', ' "6026', ""],
+            "Chloride as Cl": ["1.5", "x", "2", "3"],
+            "Calcium (Total)": ["1"] * 4, "Total Magnesium": ["1"] * 4, "Sodium as Na": ["1"] * 4,
+            "Potassium as K": ["1"] * 4, "Salinity as EC@25 (lab)": ["1"] * 4, "pH": ["7"] * 4,
+            "Date": ["1990/1/2", "1990/1/2", "1990/1/3", "1990/1/3"],
+        })
+        numbers = bulk_load.SiteSampleNumbers()
+        rows = bulk_load.normalise_site_chunk(frame, numbers)
+        assert rows["site_id"].tolist() == ["6026"] * 3
+        assert rows["sample_no"].tolist() == [0, 1, 0]
+        assert pd.isna(rows["chloride_cl"].iloc[1])
+        assert "nearest_suburb" not in rows
+        # Numbering continues in the next chunk of the same file
+        assert bulk_load.normalise_site_chunk(frame.iloc[:1], numbers)["sample_no"].tolist() == [2]
+
+    def test_site_data_load_is_idempotent(self, engine, tmp_path):
+        """TC-BE-171: Test loading site data twice, in small chunks, leaves one row per sample"""
+        count = select(func.count()).select_from(SiteSuburbData.__table__)
+        first = bulk_load.load_csv(engine, "site_suburb_data", local_db.SITE_DATA_CSV, chunk_size=400, batch_size=150)
+        with engine.connect() as connection:
+            loaded = connection.execute(count).scalar()
+        assert first["loaded"] == first["read"] == loaded
+        assert first["version"] == 1
+
+        second = bulk_load.load_csv(engine, "site_suburb_data", local_db.SITE_DATA_CSV, chunk_size=700)
+        with engine.connect() as connection:
+            assert connection.execute(count).scalar() == loaded
+            assert connection.execute(text("SELECT MAX(sample_no) FROM site_suburb_data")).scalar() > 0
+        assert second["version"] == 2
+
+    def test_merged_format_keeps_other_columns(self, engine, tmp_path):
+        """TC-BE-172: Test a merged-format load updates values without clearing nearest_suburb"""
+        site_csv = _write_csv(
+            tmp_path / "sites.csv",
+            ["site_id", "chloride_cl", "calcium_total", "magnesium_total", "sodium_na", "potassium_k",
+             "salinity_ec", "value_date", "ph_value", "nearest_suburb"],
+            [["6026", "1", "1", "1", "1", "1", "1", "1979/3/28", "5.45", "Nyarrin"]],
+        )
+        merged_csv = _write_csv(
+            tmp_path / "merged.csv",
+            list(bulk_load.MERGED_SITE_COLUMNS),
+            [[' "6026', "9", "1", "1", "1", "1", "1", "1979/3/28", "6.5"],
+             [' "6026', "8", "1", "1", "1", "1", "1", "1979/4/28", "6.0"]],
+        )
+        bulk_load.load_csv(engine, "site_suburb_data", site_csv)
+        bulk_load.load_csv(engine, "site_suburb_data", merged_csv)
+
+        with engine.connect() as connection:
+            rows = connection.execute(
+                select(SiteSuburbData.chloride_cl, SiteSuburbData.ph_value, SiteSuburbData.nearest_suburb)
+                .order_by(SiteSuburbData.value_date)
+            ).all()
+        assert [tuple(row) for row in rows] == [(9.0, 6.5, "Nyarrin"), (8.0, 6.0, None)]
+
+    def test_ewsp_load_bumps_fingerprints(self, engine, tmp_path):
+        """TC-BE-173: Test an ewsp load upserts on id and changes the snapshot and site data fingerprints"""
+        rows = list(local_db.synthetic_water_sources(20))
+        fields = list(rows[0])
+        path = _write_csv(tmp_path / "ewsp.csv", fields, [[row[field] for field in fields] for row in rows])
+
+        with Session(engine) as db:
+            ewsp_before = snapshot.fetch_version(db)
+            sites_before = fetch_site_version(db)
+        bulk_load.load_csv(engine, "ewsp", path)
+        # Re-loading with an edited value updates in place: COUNT and MAX(id) stay the same
+        rows[0]["status"] = "Edited"
+        path = _write_csv(tmp_path / "ewsp.csv", fields, [[row[field] for field in fields] for row in rows])
+        result = bulk_load.load_csv(engine, "ewsp", path)
+
+        with Session(engine) as db:
+            assert db.execute(select(func.count()).select_from(WaterSource.__table__)).scalar() == 20
+            assert db.get(WaterSource, 1).status == "Edited"
+            ewsp_after = snapshot.fetch_version(db)
+            assert fetch_site_version(db) == sites_before
+        assert result["version"] == 2
+        assert ewsp_after != ewsp_before
+        assert ewsp_after[-1] == 2
+
+    def test_ewsp_location_rebuilt_from_coordinates(self, engine, tmp_path):
+        """TC-BE-191: Test exported WKB locations are replaced by POINT(lon lat), stored as geometry on MySQL"""
+        from sqlalchemy.dialects import mysql
+
+        rows = list(local_db.synthetic_water_sources(3))
+        for row in rows:
+            # What the export writes for a MySQL POINT column
+            row["location"] = str(b"\x00\x00\x00\x00\x01\x01\x00\x00\x00")
+        rows[2]["lat"] = rows[2]["lon"] = ""
+        fields = list(rows[0])
+        path = _write_csv(tmp_path / "ewsp.csv", fields, [[row[field] for field in fields] for row in rows])
+        bulk_load.load_csv(engine, "ewsp", path)
+
+        with Session(engine) as db:
+            locations = [db.get(WaterSource, row["id"]).location for row in rows]
+        assert locations[:2] == [f"POINT({row['lon']} {row['lat']})" for row in rows[:2]]
+        assert locations[2] == bulk_load.LOCATION_UNKNOWN
+
+        frame = bulk_load.normalise_ewsp_chunk(pd.DataFrame([{field: str(rows[0][field]) for field in fields}]))
+        statement = bulk_load.upsert_statement("mysql", WaterSource.__table__, bulk_load.records(frame), ("id",))
+        sql = str(statement.compile(dialect=mysql.dialect()))
+        assert "ST_GeomFromText(%s)" in sql
+        assert "location = VALUES(location)" in sql
+
+    def test_missing_unique_key_is_reported(self, tmp_path):
+        """TC-BE-174: Test loading into a site_suburb_data table without the sample key fails clearly"""
+        engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+        with engine.begin() as connection:
+            connection.execute(text(
+                "CREATE TABLE site_suburb_data (id INTEGER PRIMARY KEY, site_id TEXT, value_date DATE, sample_no INTEGER)"
+            ))
+        with pytest.raises(ValueError, match="unique key"):
+            bulk_load.load_csv(engine, "site_suburb_data", local_db.SITE_DATA_CSV)
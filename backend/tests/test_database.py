@@ -276,3 +276,325 @@ class TestDatabase:
         
         # Session should be closed
         mock_session.close.assert_called_once()
+
+    def test_pool_settings_from_environment(self):
+        """TC-BE-150: Test pool size, overflow, recycle, timeout and pre-ping come from settings"""
+        import subprocess
+        import sys
+        import os
+
+        script = (
+            "import database; p = database.engine.pool; "
+            "print(type(p).__name__, p.size(), p._max_overflow, p._recycle, p._timeout, p._pre_ping)"
+        )
+        backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, DB_POOL_SIZE="7", DB_MAX_OVERFLOW="3", DB_POOL_RECYCLE="600",
+                   DB_POOL_TIMEOUT="2.5", DB_POOL_PRE_PING="false", DB_HOST="db.internal")
+        output = subprocess.run([sys.executable, "-c", script], cwd=backend_dir, env=env,
+                                capture_output=True, text=True, check=True).stdout.split()
+        assert output == ["InstrumentedQueuePool", "7", "3", "600", "2.5", "False"]
+
+        from database import engine, DB_POOL_PRE_PING, DB_POOL_SIZE
+        assert engine.pool.size() == DB_POOL_SIZE
+        assert DB_POOL_PRE_PING is True
+
+    def test_instrumented_pool_metrics(self):
+        """TC-BE-151: Test checkout wait, in-use, overflow and timeout metrics"""
+        import metrics
+        from sqlalchemy import exc
+        from database import InstrumentedQueuePool
+
+        metrics.REGISTRY.reset()
+        test_engine = create_engine("sqlite://", poolclass=InstrumentedQueuePool,
+                                    pool_size=1, max_overflow=1, pool_timeout=0.05)
+        first = test_engine.connect()
+        second = test_engine.connect()
+        assert metrics.REGISTRY.value("db_pool_overflow_total") == 1
+        assert test_engine.pool.checkedout() == 2
+
+        with pytest.raises(exc.TimeoutError):
+            test_engine.connect()
+        assert metrics.REGISTRY.value("db_pool_timeouts_total") == 1
+        assert metrics.REGISTRY.value("db_pool_checkout_wait_seconds") == 3
+
+        first.close()
+        second.close()
+        test_engine.dispose()
+
+    def test_warm_pool(self):
+        """TC-BE-152: Test startup warm-up opens connections and tolerates an unreachable database"""
+        import database
+        from database import InstrumentedQueuePool
+
+        test_engine = create_engine("sqlite://", poolclass=InstrumentedQueuePool, pool_size=3, max_overflow=0)
+        with patch.object(database, "engine", test_engine), patch.object(database, "DB_POOL_SIZE", 3):
+            assert database.warm_pool(5) == 3
+            assert test_engine.pool.checkedin() == 3
+            assert test_engine.pool.checkedout() == 0
+
+        broken = Mock()
+        broken.connect.side_effect = Exception("connection refused")
+        with patch.object(database, "engine", broken):
+            assert database.warm_pool(2) == 0
+        test_engine.dispose()
+
+    def test_warm_async_pool(self):
+        """TC-BE-188: Test startup warm-up also fills the async pool the routes use, and reports its metrics"""
+        import asyncio
+        import database
+        import metrics
+        from sqlalchemy.ext.asyncio import create_async_engine
+        from database import InstrumentedAsyncQueuePool
+
+        test_engine = create_async_engine("sqlite+aiosqlite://", poolclass=InstrumentedAsyncQueuePool,
+                                          pool_size=3, max_overflow=0)
+        pool = test_engine.sync_engine.pool
+
+        async def run():
+            with patch.object(database, "get_async_engine", return_value=test_engine), \
+                    patch.object(database, "DB_POOL_SIZE", 3):
+                assert await database.warm_async_pool(5) == 3
+            assert pool.checkedin() == 3
+            assert pool.checkedout() == 0
+
+            broken = Mock()
+            broken.connect.side_effect = Exception("connection refused")
+            with patch.object(database, "get_async_engine", return_value=broken):
+                assert await database.warm_async_pool(2) == 0
+            await test_engine.dispose()
+
+        asyncio.run(run())
+
+        # The async pool is reported beside the sync one
+        with patch.object(database, "_async_engine", None), patch.object(database, "_async_sessionmaker", None), \
+                patch.object(database, "ASYNC_DATABASE_URL", "sqlite+aiosqlite://"):
+            async_engine = database.get_async_engine()
+            try:
+                assert metrics.REGISTRY.value("db_pool_idle", engine="async") == 0
+                assert metrics.REGISTRY.value("db_pool_overflow", engine="async") == -database.DB_POOL_SIZE
+            finally:
+                asyncio.run(async_engine.dispose())
+
+    def test_async_database_url(self):
+        """TC-BE-156: Test the async engine addresses the same database through the async driver"""
+        from database import ASYNC_DATABASE_URL, SQLALCHEMY_DATABASE_URL, async_database_url
+
+        assert ASYNC_DATABASE_URL == SQLALCHEMY_DATABASE_URL.replace("mysql+pymysql://", "mysql+aiomysql://")
+        assert async_database_url("sqlite:////tmp/watersafe.db") == "sqlite+aiosqlite:////tmp/watersafe.db"
+        with pytest.raises(ValueError):
+            async_database_url("postgresql://localhost/watersafe")
+
+
+def _marker_database(path, name):
+    # SQLite stand-in whose marker table names the database it lives in
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE marker (name TEXT)"))
+        connection.execute(text("INSERT INTO marker VALUES (:name)"), {"name": name})
+    engine.dispose()
+    return f"sqlite:///{path}"
+
+
+@pytest.fixture
+def replica_databases(tmp_path):
+    """Primary plus two replica SQLite stand-ins, and a RoutingSession factory over them"""
+    from database import RoutingSession, _create_async_engine, _create_engine
+    import replicas
+
+    urls = {name: _marker_database(tmp_path / f"{name}.db", name) for name in ("primary", "replica1", "replica2")}
+    replica_set = replicas.ReplicaSet([
+        replicas.Replica(name, urls[name], _create_engine(urls[name]), _create_async_engine)
+        for name in ("replica1", "replica2")
+    ])
+    primary = _create_engine(urls["primary"])
+    factory = sessionmaker(class_=RoutingSession, bind=primary, replica_set=replica_set)
+    yield factory, replica_set, urls
+    primary.dispose()
+    for replica in replica_set.replicas:
+        replica.engine.dispose()
+
+
+def _read_marker(factory):
+    with factory() as db:
+        return db.execute(text("SELECT name FROM marker")).scalar()
+
+
+class TestReadReplicas:
+    """Test cases for read-replica routing"""
+
+    def test_reads_round_robin_over_healthy_replicas(self, replica_databases):
+        """TC-BE-157: Test read-only sessions rotate over checked replicas and everything else uses the primary"""
+        from replicas import read_from_replicas
+
+        factory, replica_set, _ = replica_databases
+        # Not yet checked: nothing is in rotation
+        with read_from_replicas():
+            assert _read_marker(factory) == "primary"
+
+        assert replica_set.check() == 2
+        assert _read_marker(factory) == "primary"
+        with read_from_replicas():
+            assert {_read_marker(factory) for _ in range(4)} == {"replica1", "replica2"}
+
+    def test_session_sticks_to_replica_until_it_writes(self, replica_databases):
+        """TC-BE-158: Test one replica per session and read-your-writes on the primary"""
+        from sqlalchemy import Column, MetaData, String, Table
+        from replicas import read_from_replicas
+
+        factory, replica_set, _ = replica_databases
+        replica_set.check()
+        marker = Table("marker", MetaData(), Column("name", String))
+        with read_from_replicas(), factory() as db:
+            first = db.execute(text("SELECT name FROM marker")).scalar()
+            assert first.startswith("replica")
+            assert db.execute(text("SELECT name FROM marker")).scalar() == first
+
+            db.execute(marker.insert().values(name="written"))
+            names = db.execute(text("SELECT name FROM marker ORDER BY name")).scalars().all()
+            assert names == ["primary", "written"]
+
+    def test_fall_back_when_replicas_fail_or_lag(self, replica_databases, tmp_path):
+        """TC-BE-159: Test failed or lagging replicas leave the rotation and reads fall back to the primary"""
+        from database import _create_engine
+        from replicas import Replica, read_from_replicas
+
+        factory, replica_set, _ = replica_databases
+        healthy_replicas = list(replica_set.replicas)
+
+        # Lag above the limit counts as unhealthy
+        replica_set.lag_probe = lambda connection: 120.0
+        assert replica_set.check() == 0
+        with read_from_replicas():
+            assert _read_marker(factory) == "primary"
+        replica_set.lag_probe = lambda connection: 1.0
+        assert replica_set.check() == 2
+
+        # A replica failing its check stays out of the rotation
+        unreachable = f"sqlite:///{tmp_path / 'missing' / 'replica3.db'}"
+        broken = Replica("replica3", unreachable, _create_engine(unreachable))
+        replica_set.replicas.append(broken)
+        assert replica_set.check() == 2
+        assert not broken.healthy
+
+        # A replica failing between checks is taken out at its first error
+        broken.healthy = True
+        replica_set.replicas = [broken]
+        with read_from_replicas():
+            with pytest.raises(Exception):
+                _read_marker(factory)
+            assert not broken.healthy
+            assert _read_marker(factory) == "primary"
+
+        replica_set.replicas = healthy_replicas
+
+    def test_async_sessions_and_middleware(self, replica_databases):
+        """TC-BE-160: Test AsyncSession routing and that only GET requests read from replicas"""
+        import asyncio
+        from fastapi import FastAPI
+        from fastapi.testclient import TestClient
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+        from database import RoutingSession, _create_async_engine
+        from replicas import ReadReplicaMiddleware, is_read_only, read_from_replicas
+
+        factory, replica_set, urls = replica_databases
+        replica_set.check()
+        primary = _create_async_engine(urls["primary"])
+        async_factory = async_sessionmaker(
+            primary, sync_session_class=RoutingSession, replica_set=replica_set, asynchronous=True
+        )
+
+        async def read():
+            async with async_factory() as db:
+                return (await db.execute(text("SELECT name FROM marker"))).scalar()
+
+        async def reads():
+            outside = await read()
+            with read_from_replicas():
+                inside = {await read() for _ in range(4)}
+            await primary.dispose()
+            for replica in replica_set.replicas:
+                await replica.dispose_async_engine()
+            return outside, inside
+
+        assert asyncio.run(reads()) == ("primary", {"replica1", "replica2"})
+
+        app = FastAPI()
+        app.add_middleware(ReadReplicaMiddleware)
+
+        @app.get("/read")
+        @app.post("/read")
+        async def route():
+            return {"read_only": is_read_only()}
+
+        client = TestClient(app)
+        assert client.get("/read").json() == {"read_only": True}
+        assert client.post("/read").json() == {"read_only": False}
+
+
+class TestQueryInstrumentation:
+    """Test cases for per-request query stats and the slow-query log"""
+
+    def test_statements_attributed_to_request_route(self):
+        """TC-BE-164: Test statement timings and counts are attributed to the request's route"""
+        import metrics
+        import query_stats
+
+        metrics.REGISTRY.reset()
+        test_engine = query_stats.instrument(create_engine("sqlite://"))
+        query_stats.instrument(test_engine)  # idempotent
+        route = Mock(path="/api/items/{item_id}")
+
+        with test_engine.connect() as connection:
+            connection.execute(text("CREATE TABLE item (id INTEGER)"))
+            with query_stats.track_request({"type": "http", "method": "GET", "route": route}) as request:
+                for _ in range(3):
+                    connection.execute(text("SELECT id FROM item"))
+                connection.execute(text("INSERT INTO item VALUES (1), (2)"))
+            assert query_stats.current() is None
+
+        assert request.count == 4
+        assert request.rows == 2  # sqlite3 reports rowcount for the INSERT only
+        assert request.statements.most_common(1) == [("SELECT id FROM item", 3)]
+        assert metrics.REGISTRY.value("db_query_duration_seconds", route="/api/items/{item_id}") == 4
+        assert metrics.REGISTRY.value("db_query_rows_total", route="/api/items/{item_id}") == 2
+        assert metrics.REGISTRY.value("db_queries_per_request", route="/api/items/{item_id}") == 1
+        # The CREATE ran outside any request
+        assert metrics.REGISTRY.value("db_query_duration_seconds", route="background") == 1
+
+    def test_slow_query_and_query_count_warnings(self, caplog):
+        """TC-BE-165: Test slow statements and requests over the query limit are logged"""
+        import logging
+        import metrics
+        import query_stats
+
+        metrics.REGISTRY.reset()
+        test_engine = query_stats.instrument(create_engine("sqlite://"))
+        scope = {"type": "http", "method": "GET", "route": Mock(path="/api/items")}
+
+        with caplog.at_level(logging.WARNING, logger="query_stats"), test_engine.connect() as connection:
+            with patch("query_stats.DB_SLOW_QUERY_SECONDS", 0.0), query_stats.track_request(scope):
+                connection.execute(text("SELECT 1"))
+            with patch("query_stats.DB_QUERIES_PER_REQUEST_WARN", 2), query_stats.track_request(scope):
+                for item_id in range(3):
+                    connection.execute(text("SELECT :item_id"), {"item_id": item_id})
+
+        slow, count = [record.getMessage() for record in caplog.records]
+        assert slow.startswith("Slow query (") and "in GET /api/items: SELECT 1" in slow
+        assert "GET /api/items ran 3 queries" in count and "3 x SELECT ?" in count
+        assert metrics.REGISTRY.value("db_slow_queries_total", route="/api/items") == 1
+        assert metrics.REGISTRY.value("db_query_count_warnings_total", route="/api/items") == 1
+
+    def test_route_query_stats_in_metrics(self, client, water_source_db):
+        """TC-BE-166: Test route queries on the AsyncSession and sync Session paths reach /metrics"""
+        import metrics
+
+        metrics.REGISTRY.reset()
+        with patch("snapshot.SNAPSHOT_ENABLED", False):
+            assert client.get("/api/water-sources/count").status_code == 200
+            assert client.get("/api/water-sources/export?format=csv").status_code == 200
+
+        assert metrics.REGISTRY.value("db_queries_per_request", route="/api/water-sources/count") == 1
+        assert metrics.REGISTRY.value("db_query_duration_seconds", route="/api/water-sources/count") >= 1
+        assert metrics.REGISTRY.value("db_query_duration_seconds", route="/api/water-sources/export") >= 1
+        body = client.get("/metrics").text
+        assert 'db_query_duration_seconds_count{route="/api/water-sources/count"}' in body
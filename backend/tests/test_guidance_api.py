@@ -5,6 +5,7 @@ import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import patch, Mock, MagicMock
 import json
+import os
 import time
 
 class TestGuidanceAPI:
@@ -156,31 +157,401 @@ class TestGuidanceAPI:
 
     def test_is_cache_valid(self):
         """TC-BE-058: Test cache validity checking"""
-        from api.guidance import _is_cache_valid
+        from ttl_cache import TTLCache
         
-        # Test valid cache (recent timestamp)
-        recent_timestamp = time.time() - 60  # 1 minute ago
-        assert _is_cache_valid(recent_timestamp) is True
+        now = [1000.0]
+        cache = TTLCache("test-validity", ttl=15 * 60, max_entries=10, max_bytes=100, clock=lambda: now[0])
+        cache.put("hash", "test_data")
         
-        # Test expired cache (old timestamp)
-        old_timestamp = time.time() - (20 * 60)  # 20 minutes ago
-        assert _is_cache_valid(old_timestamp) is False
+        # Test valid cache (1 minute later)
+        now[0] += 60
+        assert cache.get("hash") == "test_data"
+        
+        # Test expired cache (20 minutes later)
+        now[0] += 19 * 60
+        assert cache.get("hash") is None
 
     def test_clean_expired_cache(self):
         """TC-BE-059: Test expired cache cleaning"""
-        from api.guidance import _clean_expired_cache, _checklist_cache
+        from ttl_cache import TTLCache
         
         # Add some test cache entries
-        current_time = time.time()
-        _checklist_cache["valid_hash"] = {"data": "test_data", "ts": current_time - 60}
-        _checklist_cache["expired_hash"] = {"data": "test_data", "ts": current_time - (20 * 60)}
-        
-        # Clean expired cache
-        _clean_expired_cache()
-        
-        # Check that expired entry was removed
-        assert "valid_hash" in _checklist_cache
-        assert "expired_hash" not in _checklist_cache
+        now = [1000.0]
+        cache = TTLCache("test-expiry", ttl=15 * 60, max_entries=10, max_bytes=100, clock=lambda: now[0])
+        cache.put("expired_hash", "test_data")
+        now[0] += 14 * 60
+        cache.put("valid_hash", "test_data")
+        
+        # Expired entries are dropped on the next access
+        now[0] += 6 * 60
+        assert "valid_hash" in cache
+        assert "expired_hash" not in cache
+        assert cache.stats()["expirations"] == 1
+
+    def test_checklist_cache_bounds(self):
+        """TC-BE-177: Test the checklist cache evicts least recently used entries past its entry and byte bounds"""
+        from ttl_cache import TTLCache
+        
+        now = [0.0]
+        cache = TTLCache("test-bounds", ttl=60, max_entries=3, max_bytes=10, sizeof=len, clock=lambda: now[0])
+        for key in "abc":
+            cache.put(key, "xx")
+        cache.get("a")  # a becomes most recently used
+        cache.put("d", "xx")
+        assert [key for key in "abcd" if key in cache] == ["a", "c", "d"]
+        
+        # A large entry pushes out older ones until the byte bound holds
+        cache.put("e", "xxxxxxx")
+        assert [key for key in "acde" if key in cache] == ["d", "e"]
+        assert cache.stats()["bytes"] == 9
+        # Entries larger than the whole cache are not stored
+        cache.put("huge", "x" * 11)
+        assert "huge" not in cache
+        
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["evictions"] == 3
+        
+        # Overwritten keys leave stale heap items behind; they never expire the new value early
+        cache.clear()
+        cache.put("k", "v1")
+        now[0] += 50
+        cache.put("k", "v2")
+        now[0] += 20
+        assert cache.get("k") == "v2"
+        now[0] += 50
+        assert cache.get("k") is None
+
+    def test_checklist_route_uses_cache(self, client, sample_sanitation_request, mock_openai_response):
+        """TC-BE-178: Test repeated checklist requests are served from the cache and counted, and fallbacks are not cached"""
+        import metrics
+        from api.guidance import _checklist_cache
+        
+        _checklist_cache.clear()
+        llm = Mock()
+        content = mock_openai_response["choices"][0]["message"]["content"]
+        llm.chat.completions.create.return_value = Mock(choices=[Mock(message=Mock(content=content))], usage=None)
+        hits = metrics.REGISTRY.value("cache_hits_total", cache="checklist") or 0
+        
+        with patch('api.guidance.get_client', return_value=llm):
+            first = client.post("/api/guidance/checklist", json=sample_sanitation_request)
+            second = client.post("/api/guidance/checklist", json=sample_sanitation_request)
+            forced = client.post("/api/guidance/checklist?force=true", json=sample_sanitation_request)
+        
+        assert first.json() == second.json() == forced.json()
+        assert llm.chat.completions.create.call_count == 2
+        assert metrics.REGISTRY.value("cache_hits_total", cache="checklist") == hits + 1
+        assert len(_checklist_cache) == 1
+        assert _checklist_cache.stats()["bytes"] > 0
+        _checklist_cache.clear()
+        
+        # Fallbacks for an LLM error or a missing key are served but never cached
+        llm.chat.completions.create.side_effect = Exception("API Error")
+        with patch('api.guidance.get_client', return_value=llm):
+            client.post("/api/guidance/checklist", json=sample_sanitation_request)
+        with patch('api.guidance.get_client', return_value=None):
+            fallback = client.post("/api/guidance/checklist", json=sample_sanitation_request)
+        assert fallback.status_code == 200
+        assert len(_checklist_cache) == 0
+
+    def test_shared_response_store(self, tmp_path):
+        """TC-BE-179: Test responses cached by one worker are served to another from the compressed shared store"""
+        import hashlib
+        import sqlite3
+        from api.guidance import ExplainResponse
+        from response_cache import ResponseCache, SQLiteStore
+        
+        path = str(tmp_path / "llm-cache.sqlite3")
+        # Two caches on one file stand in for two uvicorn workers
+        worker_a = ResponseCache("test-explain", ExplainResponse, store=lambda: SQLiteStore(path))
+        worker_b = ResponseCache("test-explain", ExplainResponse, store=lambda: SQLiteStore(path))
+        response = ExplainResponse(explanation="Wash hands before preparing food. " * 20, source="WHO")
+        
+        assert worker_b.get("key") is None
+        worker_a.put("key", response)
+        assert worker_b.get("key") == response
+        # Served from L1 from now on
+        assert worker_b.stats()["hits"] == 0
+        assert worker_b.get("key") == response
+        assert worker_b.stats()["hits"] == 1
+        
+        # Owner-only file; keys are stored as digests
+        assert os.stat(path).st_mode & 0o777 == 0o600
+        with sqlite3.connect(path) as connection:
+            key, payload = connection.execute("SELECT key, payload FROM responses").fetchone()
+            assert key == hashlib.sha256(b"key").hexdigest()
+            assert len(payload) < len(response.model_dump_json()) / 3
+            # Unreadable entries are misses, not errors
+            connection.execute("UPDATE responses SET payload = x'00'")
+        worker_c = ResponseCache("test-explain", ExplainResponse, store=lambda: SQLiteStore(path))
+        assert worker_c.get("key") is None
+        
+        # Expired entries are not served from the store either
+        expired = ResponseCache("test-expired", ExplainResponse, ttl=0, store=lambda: SQLiteStore(path))
+        expired.put("key", response)
+        expired.memory.clear()
+        assert expired.get("key") is None
+        
+        worker_a.clear()
+        assert ResponseCache("test-explain", ExplainResponse, store=lambda: SQLiteStore(path)).get("key") is None
+
+    def test_default_store_is_private(self, tmp_path):
+        """TC-BE-190: Test the default store lives in the user's cache directory and counts puts from many threads"""
+        import threading
+        import response_cache
+        
+        with patch.dict('os.environ', {"XDG_CACHE_HOME": str(tmp_path)}):
+            path = response_cache._default_cache_path()
+        assert path == str(tmp_path / "watersafe" / "llm-cache.sqlite3")
+        
+        store = response_cache.SQLiteStore(path)
+        assert os.stat(os.path.dirname(path)).st_mode & 0o777 == 0o700
+        assert os.stat(path).st_mode & 0o777 == 0o600
+        
+        def write(worker):
+            for index in range(50):
+                store.put("test", f"{worker}-{index}", b"payload", time.time() + 60)
+        
+        threads = [threading.Thread(target=write, args=(worker,)) for worker in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert next(store._puts) == 8 * 50 + 1
+
+    def test_store_io_runs_off_event_loop(self, tmp_path):
+        """TC-BE-187: Test async cache lookups and writes reach the shared store from worker threads, not the event loop"""
+        import asyncio
+        import threading
+        from api.guidance import ExplainResponse
+        from response_cache import ResponseCache, SQLiteStore
+        
+        threads = []
+        
+        class RecordingStore(SQLiteStore):
+            def get(self, *args):
+                threads.append(threading.get_ident())
+                return super().get(*args)
+            
+            def put(self, *args):
+                threads.append(threading.get_ident())
+                return super().put(*args)
+        
+        path = str(tmp_path / "llm-cache.sqlite3")
+        cache = ResponseCache("test-async", ExplainResponse, store=lambda: RecordingStore(path))
+        response = ExplainResponse(explanation="Boil water for one minute.", source="WHO")
+        
+        async def run():
+            loop_thread = threading.get_ident()
+            assert await cache.aget("key") is None
+            await cache.aput("key", response)
+            cache.memory.clear()
+            assert await cache.aget("key") == response
+            # L1 hits never leave the loop
+            assert await cache.aget("key") == response
+            return loop_thread
+        
+        loop_thread = asyncio.run(run())
+        assert len(threads) == 3
+        assert loop_thread not in threads
+        
+        # Memory-only caches answer on the loop
+        memory_only = ResponseCache("test-memory", ExplainResponse, store=None)
+        assert asyncio.run(memory_only.aget("key")) is None
+        asyncio.run(memory_only.aput("key", response))
+        assert memory_only.get("key") == response
+
+    def test_explain_and_assess_cache_llm_answers(self, client):
+        """TC-BE-180: Test explain and symptom assessment reuse LLM answers for identical requests"""
+        from api import guidance, symptoms
+        
+        guidance._explain_cache.clear()
+        symptoms._assessment_cache.clear()
+        explain_request = {"item_id": "hand-wash", "context": {"mode": "general", "place": "home"}}
+        assessment = {
+            "classification": "self_care", "reason": "Mild symptoms", "steps": ["Rest", "Drink water", "Monitor"],
+            "watch_for": ["Fever"], "references": [{"label": "WHO", "url": "https://www.who.int/"}],
+            "disclaimer": "Not medical advice."
+        }
+        assess_request = {
+            "subject": "pregnant", "chips": ["nausea"], "freeText": "", "severityHints": "mild",
+            "context": {"mode": "general", "place": "home"}
+        }
+        
+        llm = Mock()
+        llm.chat.completions.create.return_value = Mock(choices=[Mock(message=Mock(content="Clean hands stop germs."))])
+        with patch('api.guidance.get_client', return_value=llm):
+            first = client.post("/api/guidance/explain", json=explain_request).json()
+            second = client.post("/api/guidance/explain", json=explain_request).json()
+        assert first == second == {"explanation": "Clean hands stop germs.", "source": None}
+        assert llm.chat.completions.create.call_count == 1
+        
+        llm = Mock()
+        llm.chat.completions.create.return_value = Mock(choices=[Mock(message=Mock(content=json.dumps(assessment)))])
+        with patch('api.symptoms.get_client', return_value=llm):
+            first = client.post("/api/symptoms/assess", json=assess_request).json()
+            second = client.post("/api/symptoms/assess", json=assess_request).json()
+            other = client.post("/api/symptoms/assess", json={**assess_request, "chips": ["fever"]}).json()
+        assert first == second == other == assessment
+        assert llm.chat.completions.create.call_count == 2
+        
+        guidance._explain_cache.clear()
+        symptoms._assessment_cache.clear()
+
+    def test_single_flight(self):
+        """TC-BE-181: Test concurrent callers of one key share a generation, its failure, and take over when the leader is cancelled"""
+        import asyncio
+        from single_flight import SingleFlight
+        
+        flights = SingleFlight("test")
+        calls = []
+        
+        async def generate(value, delay=0.05):
+            calls.append(value)
+            await asyncio.sleep(delay)
+            if isinstance(value, Exception):
+                raise value
+            return value
+        
+        async def shared():
+            return await asyncio.gather(*[flights.run("a", lambda: generate("a")) for _ in range(4)], flights.run("b", lambda: generate("b")))
+        
+        assert asyncio.run(shared()) == ["a", "a", "a", "a", "b"]
+        assert calls == ["a", "b"]
+        assert flights.saved == 3
+        
+        async def failed():
+            return await asyncio.gather(*[flights.run("c", lambda: generate(ValueError("down"))) for _ in range(3)], return_exceptions=True)
+        
+        errors = asyncio.run(failed())
+        assert [str(error) for error in errors] == ["down"] * 3
+        assert len(calls) == 3
+        assert flights.saved == 5
+        
+        async def cancelled():
+            leader = asyncio.ensure_future(flights.run("d", lambda: generate("d", delay=10)))
+            await asyncio.sleep(0)
+            waiters = [asyncio.ensure_future(flights.run("d", lambda: generate("d2"))) for _ in range(2)]
+            await asyncio.sleep(0)
+            leader.cancel()
+            return await asyncio.gather(*waiters)
+        
+        assert asyncio.run(cancelled()) == ["d2", "d2"]
+        assert calls[3:] == ["d", "d2"]
+        assert flights.saved == 6
+        assert not flights._inflight
+
+    def test_concurrent_identical_generations_share_llm_call(self, sample_sanitation_request):
+        """TC-BE-182: Test concurrent identical checklist and assessment requests make one LLM call"""
+        import asyncio
+        import httpx
+        import metrics
+        from main import app
+        from api import guidance, symptoms
+        
+        guidance._checklist_cache.clear()
+        symptoms._assessment_cache.clear()
+        checklist = guidance._fallback_checklist_response(guidance.SanitationRequest(**sample_sanitation_request))
+        assessment = {
+            "classification": "self_care", "reason": "Mild symptoms", "steps": ["Rest", "Drink water", "Monitor"],
+            "watch_for": ["Fever"], "references": [{"label": "WHO", "url": "https://www.who.int/"}],
+            "disclaimer": "Not medical advice."
+        }
+        assess_request = {
+            "subject": "infant", "chips": ["rash"], "freeText": "", "severityHints": "mild",
+            "context": {"mode": "general", "place": "home"}
+        }
+        
+        def slow(result):
+            # Sync like the OpenAI SDK; runs in the threadpool while the other requests arrive
+            def call(*args, **kwargs):
+                time.sleep(0.2)
+                return result
+            return call
+        
+        llm = Mock()
+        llm.chat.completions.create.side_effect = slow(Mock(choices=[Mock(message=Mock(content=json.dumps(assessment)))]))
+        shared = {
+            flight: metrics.REGISTRY.value("single_flight_calls_total", flight=flight, result="shared") or 0
+            for flight in ("checklist", "symptoms")
+        }
+        
+        async def run():
+            async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+                return await asyncio.gather(
+                    *[client.post("/api/guidance/checklist", json=sample_sanitation_request) for _ in range(5)],
+                    *[client.post("/api/symptoms/assess", json=assess_request) for _ in range(5)],
+                )
+        
+        with patch('api.guidance._generate_llm_checklist', side_effect=slow(checklist)) as mock_generate, \
+                patch('api.symptoms.get_client', return_value=llm):
+            responses = asyncio.run(run())
+        
+        assert [response.status_code for response in responses] == [200] * 10
+        assert all(response.json() == checklist.model_dump() for response in responses[:5])
+        assert all(response.json() == assessment for response in responses[5:])
+        assert mock_generate.call_count == 1
+        assert llm.chat.completions.create.call_count == 1
+        for flight in ("checklist", "symptoms"):
+            assert metrics.REGISTRY.value("single_flight_calls_total", flight=flight, result="shared") == shared[flight] + 4
+        
+        guidance._checklist_cache.clear()
+        symptoms._assessment_cache.clear()
+
+    def test_slow_llm_does_not_block_water_sources(self, water_source_db):
+        """TC-BE-184: Test water-source reads stay fast while slow LLM calls run, and LLM calls per route are bounded"""
+        import asyncio
+        import threading
+        import httpx
+        from main import app
+        
+        running = [0]
+        peak = [0]
+        lock = threading.Lock()
+        
+        def slow_completion(*args, **kwargs):
+            # A blocking SDK call taking 0.3 s
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.3)
+            with lock:
+                running[0] -= 1
+            return Mock(choices=[Mock(message=Mock(content="Wash hands with soap."))], usage=None)
+        
+        llm = Mock()
+        llm.chat.completions.create.side_effect = slow_completion
+        chat_request = {"context": {"mode": "general", "place": "home"}, "checklist": {}, "sources": []}
+        
+        async def run():
+            async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+                await client.get("/api/water-sources/?limit=5")  # loads the snapshot
+                chats = asyncio.gather(*[
+                    client.post("/api/guidance/chat", json={**chat_request, "messages": [{"role": "user", "content": f"Question {n}"}]})
+                    for n in range(6)
+                ])
+                await asyncio.sleep(0.05)
+                latencies = []
+                while not chats.done():
+                    started = time.perf_counter()
+                    response = await client.get("/api/water-sources/?limit=5")
+                    latencies.append(time.perf_counter() - started)
+                    assert response.status_code == 200
+                    await asyncio.sleep(0.02)
+                return await chats, latencies
+        
+        with patch('api.guidance.get_client', return_value=llm), patch('llm.LLM_ROUTE_CONCURRENCY', 2):
+            started = time.perf_counter()
+            chats, latencies = asyncio.run(run())
+            elapsed = time.perf_counter() - started
+        
+        assert [response.json()["message"] for response in chats] == ["Wash hands with soap."] * 6
+        # Six 0.3 s calls, two at a time
+        assert peak[0] == 2
+        assert elapsed >= 0.9
+        # Reads kept being answered throughout, none waiting on a completion
+        assert len(latencies) >= 10
+        assert max(latencies) < 0.15
 
     def test_rule_based_checklist_general_mode(self):
         """TC-BE-060: Test rule-based checklist for general mode"""
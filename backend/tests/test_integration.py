@@ -313,8 +313,8 @@ class TestIntegration:
     def test_error_propagation_integration(self, client):
         """TC-BE-108: Test error propagation across integrated systems"""
         # Test database error propagation
-        with patch('api.water_quality_prediction.pd.read_sql') as mock_read_sql:
-            mock_read_sql.side_effect = Exception("Database connection failed")
+        with patch('api.water_quality_prediction.fetch_columns') as mock_fetch_columns:
+            mock_fetch_columns.side_effect = Exception("Database connection failed")
             
             response = client.get("/api/prediction/sites")
             assert response.status_code == 500
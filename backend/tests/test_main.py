@@ -1,6 +1,8 @@
 """
 Test cases for main FastAPI application
 """
+import os
+
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import patch, Mock
@@ -129,3 +131,319 @@ class TestMainApplication:
         # Test that all methods are allowed
         response = client.options("/", headers={"Origin": "http://localhost:3000"})
         assert response.status_code == 200
+
+    def test_compression_negotiation(self):
+        """TC-BE-133: Test Accept-Encoding negotiation honours q-values and availability"""
+        import compression
+
+        assert compression.negotiate("gzip, deflate") == "gzip"
+        assert compression.negotiate("gzip;q=0, identity") is None
+        assert compression.negotiate("*") == compression.available_encodings()[0]
+        with patch.object(compression, "brotli", None):
+            assert compression.negotiate("br, gzip;q=0.5") == "gzip"
+
+    def test_compression_threshold_and_cache(self):
+        """TC-BE-134: Test large bodies are gzipped once and served from the compressed cache"""
+        import compression
+        from fastapi import FastAPI
+        from fastapi.responses import PlainTextResponse, Response
+
+        app = FastAPI()
+        payload = b'[' + b','.join(b'{"status":"Operational","type":"tank"}' for _ in range(200)) + b']'
+
+        @app.get("/large")
+        def large():
+            return Response(payload, media_type="application/json", headers={"ETag": 'W/"v1"'})
+
+        @app.get("/small")
+        def small():
+            return Response(b'{"ok":true}', media_type="application/json")
+
+        @app.get("/text")
+        def text():
+            return PlainTextResponse("x" * 500)
+
+        middleware = compression.CompressionMiddleware(app, minimum_size=100)
+        client = TestClient(middleware)
+
+        with patch("compression.compress", wraps=compression.compress) as mock_compress:
+            for _ in range(3):
+                response = client.get("/large", headers={"Accept-Encoding": "gzip"})
+                assert response.headers["content-encoding"] == "gzip"
+                assert "accept-encoding" in response.headers["vary"].lower()
+                assert int(response.headers["content-length"]) < len(payload) // 10
+                assert response.content == payload
+        assert mock_compress.call_count == 1
+        assert middleware.cache.hits == 2
+
+        response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in response.headers
+        response = client.get("/large", headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in response.headers
+        assert response.content == payload
+        response = client.get("/text", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+
+    def test_compression_streaming_response(self):
+        """TC-BE-135: Test streaming responses are compressed incrementally"""
+        from fastapi import FastAPI
+        from fastapi.responses import StreamingResponse
+        from compression import CompressionMiddleware
+
+        app = FastAPI()
+        lines = [f'{{"id":{i},"status":"Operational"}}\n'.encode() for i in range(500)]
+
+        @app.get("/stream")
+        def stream():
+            return StreamingResponse(iter(lines), media_type="application/x-ndjson")
+
+        client = TestClient(CompressionMiddleware(app))
+        response = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert "content-length" not in response.headers
+        assert response.content == b"".join(lines)
+
+    def test_compressed_body_cache_bounds(self):
+        """TC-BE-136: Test the compressed-body cache evicts by entries and bytes"""
+        from compression import CompressedBodyCache
+
+        cache = CompressedBodyCache(max_entries=2, max_bytes=10)
+        cache.put(("gzip", 1), b"aaaa")
+        cache.put(("gzip", 2), b"bbbb")
+        cache.get(("gzip", 1))
+        cache.put(("gzip", 3), b"cccc")
+        assert cache.get(("gzip", 2)) is None
+        assert cache.get(("gzip", 1)) == b"aaaa"
+
+        cache.put(("gzip", 4), b"dddddddd")
+        assert len(cache) == 1
+        cache.put(("gzip", 5), b"x" * 11)
+        assert cache.get(("gzip", 5)) is None
+
+    def _coalescing_app(self):
+        import asyncio
+        from fastapi import FastAPI
+        from fastapi.responses import StreamingResponse
+        from coalescing import CoalescingMiddleware
+
+        app = FastAPI()
+        calls = []
+        streams_started = asyncio.Event()
+
+        @app.get("/api/water-sources/slow")
+        async def slow(q: str = ""):
+            calls.append(q)
+            await asyncio.sleep(0.05)
+            return {"q": q, "call": len(calls)}
+
+        @app.get("/api/water-sources/stream")
+        async def stream():
+            calls.append("stream")
+            if calls.count("stream") == 3:
+                streams_started.set()
+            await asyncio.sleep(0.05)
+
+            async def chunks():
+                yield b"a"
+                # Each stream ends only once all three requests are streaming
+                await asyncio.wait_for(streams_started.wait(), 1)
+                yield b"b"
+
+            return StreamingResponse(chunks(), media_type="text/plain")
+
+        return CoalescingMiddleware(app), calls
+
+    def test_coalescing_shares_identical_requests(self):
+        """TC-BE-147: Test concurrent identical GETs run the route once"""
+        import asyncio
+        import httpx
+        import metrics
+
+        app, calls = self._coalescing_app()
+        metrics.REGISTRY.reset()
+
+        async def run():
+            async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+                same = [client.get("/api/water-sources/slow?q=a") for _ in range(5)]
+                other = [client.get("/api/water-sources/slow?q=b")]
+                return await asyncio.gather(*same, *other)
+
+        responses = asyncio.run(run())
+        assert [response.status_code for response in responses] == [200] * 6
+        assert {response.content for response in responses[:5]} == {responses[0].content}
+        assert responses[5].json()["q"] == "b"
+        assert sorted(calls) == ["a", "b"]
+        assert metrics.REGISTRY.value("coalesce_requests_total", result="coalesced") == 4
+        assert metrics.REGISTRY.value("coalesce_requests_total", result="leader") == 2
+        assert metrics.REGISTRY.value("coalesce_inflight") == 0
+
+        # Sequential requests are not coalesced
+        asyncio.run(run())
+        assert len(calls) == 4
+
+    def test_coalescing_skips_streaming_responses(self):
+        """TC-BE-148: Test streamed responses are not buffered for replay, and waiters run as soon as the leader streams"""
+        import asyncio
+        import httpx
+        import metrics
+
+        app, calls = self._coalescing_app()
+        metrics.REGISTRY.reset()
+
+        async def run():
+            async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+                return await asyncio.gather(*[client.get("/api/water-sources/stream") for _ in range(3)])
+
+        responses = asyncio.run(run())
+        assert [response.text for response in responses] == ["ab"] * 3
+        assert calls == ["stream"] * 3
+        assert metrics.REGISTRY.value("coalesce_requests_total", result="fallback") == 2
+
+    def test_metrics_endpoint(self, client):
+        """TC-BE-149: Test /metrics renders the registry in Prometheus text format"""
+        import metrics
+
+        metrics.counter("test_events_total", "Events seen in tests", kind='a"b').inc(3)
+        metrics.histogram("test_latency_seconds", "Test latency", buckets=(0.1, 1.0)).observe(0.5)
+
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        body = response.text
+        assert "# TYPE test_events_total counter" in body
+        assert 'test_events_total{kind="a\\"b"} 3' in body
+        assert 'test_latency_seconds_bucket{le="0.1"} 0' in body
+        assert 'test_latency_seconds_bucket{le="+Inf"} 1' in body
+        assert "test_latency_seconds_count 1" in body
+
+    def test_import_defers_heavy_modules(self):
+        """TC-BE-167: Test importing the app (under -X importtime) loads neither numpy, pandas nor the OpenAI SDK"""
+        report, loaded = self._import_main()
+        assert "| main" in report
+        assert [name for name in ("numpy", "pandas", "openai") if name in loaded] == []
+
+    def test_symptoms_health_does_not_build_client(self, client):
+        """TC-BE-195: Test the symptoms health probe reports the API key without creating the OpenAI client"""
+        with patch("llm.get_client") as get_client, patch("api.symptoms.get_client") as route_get_client:
+            with patch.dict("os.environ", {"OPENAI_API_KEY": "sk-real"}):
+                configured = client.get("/api/symptoms/health").json()
+            with patch.dict("os.environ", {"OPENAI_API_KEY": "your_openai_api_key_here"}):
+                development = client.get("/api/symptoms/health").json()
+        get_client.assert_not_called()
+        route_get_client.assert_not_called()
+        assert (configured["openai_client"], configured["api_key_configured"]) == ("available", True)
+        assert (development["openai_client"], development["api_key_configured"]) == ("development_mode", False)
+
+    def test_openai_client_created_on_first_use(self):
+        """TC-BE-168: Test one pooled OpenAI client is created lazily and shared by the LLM routes"""
+        import httpx
+        import llm
+        from api import guidance, symptoms
+
+        assert guidance.get_client is symptoms.get_client is llm.get_client
+        with patch.object(llm, "_client", None), patch.object(llm, "_client_key", None):
+            with patch.dict("os.environ", {"OPENAI_API_KEY": "your_openai_api_key_here"}):
+                assert llm.get_client() is None
+            with patch.dict("os.environ", {"OPENAI_API_KEY": "sk-real"}), patch("openai.OpenAI") as mock_openai, \
+                    patch("httpx.Limits", wraps=httpx.Limits) as limits:
+                first = llm.get_client()
+                assert llm.get_client() is first
+                mock_openai.assert_called_once()
+                kwargs = mock_openai.call_args.kwargs
+                assert kwargs["api_key"] == "sk-real"
+                assert kwargs["max_retries"] == 0
+                assert kwargs["http_client"].timeout.connect == llm.OPENAI_CONNECT_TIMEOUT_SECONDS
+                assert limits.call_args.kwargs["max_connections"] == llm.OPENAI_MAX_CONNECTIONS
+            # A rotated key gets a new client
+            with patch.dict("os.environ", {"OPENAI_API_KEY": "sk-rotated"}), patch("openai.OpenAI") as mock_openai:
+                rotated = llm.get_client()
+                assert rotated is not first
+                assert mock_openai.call_args.kwargs["api_key"] == "sk-rotated"
+            llm.close_client()
+            rotated.close.assert_called_once()
+            assert llm._client is None
+
+    def test_llm_completion_retries_and_metrics(self):
+        """TC-BE-183: Test LLM completions retry transient failures with jittered backoff, up to a bound, and record metrics"""
+        import httpx
+        import openai
+        import llm
+        import metrics
+
+        metrics.REGISTRY.reset()
+        transient = openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+        answer = Mock(choices=[Mock(message=Mock(content="  Boil water first.  "))],
+                      usage=Mock(prompt_tokens=12, completion_tokens=5))
+        client = Mock()
+        client.chat.completions.create.side_effect = [transient, transient, answer]
+        messages = [{"role": "user", "content": "hi"}]
+
+        with patch("llm.time.sleep") as sleep, patch("llm.random.uniform", side_effect=lambda low, high: high) as uniform:
+            assert llm.complete("chat", messages, client=client, max_retries=2, temperature=0.4) == "Boil water first."
+            # Backoff caps double: base, then 2 x base
+            assert [call.args for call in uniform.call_args_list] == [
+                (0, llm.OPENAI_RETRY_BASE_SECONDS), (0, 2 * llm.OPENAI_RETRY_BASE_SECONDS)
+            ]
+            assert sleep.call_count == 2
+            assert client.chat.completions.create.call_args.kwargs["temperature"] == 0.4
+
+            # Retries are bounded, and only transient failures are retried
+            client.chat.completions.create.side_effect = [transient, transient]
+            with pytest.raises(openai.APIConnectionError):
+                llm.complete("chat", messages, client=client, max_retries=1)
+            client.chat.completions.create.side_effect = ValueError("bad request")
+            with pytest.raises(ValueError):
+                llm.complete("chat", messages, client=client)
+            assert sleep.call_count == 3
+
+        assert metrics.REGISTRY.value("llm_retries_total", route="chat") == 3
+        assert metrics.REGISTRY.value("llm_requests_total", route="chat", result="ok") == 1
+        assert metrics.REGISTRY.value("llm_requests_total", route="chat", result="error") == 2
+        assert metrics.REGISTRY.value("llm_tokens_total", route="chat", kind="prompt") == 12
+        assert metrics.REGISTRY.value("llm_tokens_total", route="chat", kind="completion") == 5
+        assert metrics.histogram("llm_request_seconds", route="chat", buckets=llm.LATENCY_BUCKETS).count == 6
+
+    def test_lifespan_starts_and_stops_background_work(self):
+        """TC-BE-169: Test the lifespan hook starts background work on startup and stops it on shutdown"""
+        from main import app
+
+        with patch("main.warm_pool") as warm_pool, \
+                patch("main.warm_async_pool") as warm_async_pool, \
+                patch("main.start_background_refresh") as start_refresh, \
+                patch("main.stop_background_refresh") as stop_refresh, \
+                patch("main.replica_set") as replica_set, \
+                patch("main.dispose_async_engine") as dispose:
+            with TestClient(app):
+                start_refresh.assert_called_once()
+                replica_set.start_health_checks.assert_called_once()
+                stop_refresh.assert_not_called()
+            stop_refresh.assert_called_once()
+            replica_set.stop_health_checks.assert_called_once()
+            dispose.assert_awaited_once()
+        warm_pool.assert_called_once()
+        warm_async_pool.assert_awaited_once()
+
+    def _import_main(self):
+        # `import main` in a fresh interpreter: (-X importtime report, modules loaded)
+        import subprocess
+        import sys
+
+        backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import sys, main; print(' '.join(sys.modules))"],
+            cwd=backend_dir, capture_output=True, text=True, check=True,
+        )
+        return result.stderr, set(result.stdout.split())
+
+    @pytest.mark.skipif("STARTUP_BUDGET_MS" not in os.environ,
+                        reason="set STARTUP_BUDGET_MS to check import time against a budget")
+    def test_import_within_budget(self):
+        """TC-BE-193: Test `import main` stays within STARTUP_BUDGET_MS (opt-in: timings depend on the machine)"""
+        import statistics
+
+        totals = []
+        for _ in range(3):
+            report, _ = self._import_main()
+            line = next(line for line in report.splitlines() if line.rstrip().endswith("| main"))
+            totals.append(int(line.split("|")[1]) / 1000)
+        assert statistics.median(totals) <= float(os.environ["STARTUP_BUDGET_MS"])
@@ -7,6 +7,15 @@ from unittest.mock import patch, Mock, MagicMock
 import pandas as pd
 import json
 from datetime import datetime, timedelta
+from sqlalchemy import text
+
+from columnar import ColumnTable, fetch_columns
+
+
+def _column_table(frame):
+    # What fetch_columns returns for the same rows
+    return ColumnTable({name: frame[name].to_numpy(dtype=object) for name in frame.columns})
+
 
 class TestWaterQualityPrediction:
     """Test cases for water quality prediction functionality"""
@@ -83,25 +92,26 @@ class TestWaterQualityPrediction:
         assert exc_info.value.status_code == 500
         assert "Model parameters file not found" in str(exc_info.value.detail)
 
-    @patch('api.water_quality_prediction.pd.read_sql')
-    def test_load_site_data_success(self, mock_read_sql, mock_site_data):
+    @patch('api.water_quality_prediction.fetch_columns')
+    def test_load_site_data_success(self, mock_fetch_columns, mock_site_data):
         """TC-BE-021: Test successful site data loading"""
         from api.water_quality_prediction import load_site_data
         
-        mock_read_sql.return_value = mock_site_data
+        mock_fetch_columns.return_value = _column_table(mock_site_data)
         result = load_site_data()
         
         assert len(result) == 3
-        assert 'site_id' in result.columns
-        assert 'Chloride as Cl' in result.columns
+        assert 'site_id' in result
+        assert 'Chloride as Cl' in result
+        assert list(result['Site ID']) == [' "site_001'] * 3
 
-    @patch('api.water_quality_prediction.pd.read_sql')
-    def test_load_site_data_database_error(self, mock_read_sql):
+    @patch('api.water_quality_prediction.fetch_columns')
+    def test_load_site_data_database_error(self, mock_fetch_columns):
         """TC-BE-022: Test database error handling in site data loading"""
         from api.water_quality_prediction import load_site_data
         from fastapi import HTTPException
         
-        mock_read_sql.side_effect = Exception("Database connection failed")
+        mock_fetch_columns.side_effect = Exception("Database connection failed")
         
         with pytest.raises(HTTPException) as exc_info:
             load_site_data()
@@ -109,47 +119,46 @@ class TestWaterQualityPrediction:
         assert exc_info.value.status_code == 500
         assert "Database query failed" in str(exc_info.value.detail)
 
-    @patch('api.water_quality_prediction.pd.read_sql')
-    def test_get_site_data_success(self, mock_read_sql, mock_site_data):
+    @patch('api.water_quality_prediction.fetch_columns')
+    def test_get_site_data_success(self, mock_fetch_columns, mock_site_data):
         """TC-BE-023: Test successful site-specific data retrieval"""
         from api.water_quality_prediction import get_site_data
         
-        mock_read_sql.return_value = mock_site_data
+        mock_fetch_columns.return_value = _column_table(mock_site_data)
         result = get_site_data("site_001")
         
         assert result is not None
         assert len(result) == 3
         assert all(result['site_id'] == 'site_001')
 
-    @patch('api.water_quality_prediction.pd.read_sql')
-    def test_get_site_data_no_data(self, mock_read_sql):
+    @patch('api.water_quality_prediction.fetch_columns')
+    def test_get_site_data_no_data(self, mock_fetch_columns):
         """TC-BE-024: Test site data retrieval when no data exists"""
         from api.water_quality_prediction import get_site_data
         
-        mock_read_sql.return_value = pd.DataFrame()
+        mock_fetch_columns.return_value = ColumnTable({})
         result = get_site_data("nonexistent_site")
         
         assert result is None
 
-    @patch('api.water_quality_prediction.pd.read_sql')
-    def test_get_available_sites_success(self, mock_read_sql, mock_available_sites):
+    @patch('api.water_quality_prediction.fetch_columns')
+    def test_get_available_sites_success(self, mock_fetch_columns, mock_available_sites):
         """TC-BE-025: Test successful available sites retrieval"""
         from api.water_quality_prediction import get_available_sites
         
-        mock_df = pd.DataFrame({'site_id': mock_available_sites})
-        mock_read_sql.return_value = mock_df
+        mock_fetch_columns.return_value = _column_table(pd.DataFrame({'site_id': mock_available_sites}))
         
         result = get_available_sites()
         
         assert result == mock_available_sites
         assert len(result) == 3
 
-    @patch('api.water_quality_prediction.pd.read_sql')
-    def test_get_available_sites_error(self, mock_read_sql):
+    @patch('api.water_quality_prediction.fetch_columns')
+    def test_get_available_sites_error(self, mock_fetch_columns):
         """TC-BE-026: Test error handling in available sites retrieval"""
         from api.water_quality_prediction import get_available_sites
         
-        mock_read_sql.side_effect = Exception("Database error")
+        mock_fetch_columns.side_effect = Exception("Database error")
         result = get_available_sites()
         
         assert result == []
@@ -398,3 +407,61 @@ class TestWaterQualityPrediction:
             assert data["status"] == "unhealthy"
             assert data["model_loaded"] is False
             assert data["database_connected"] is False
+
+    def test_site_queries_through_async_session(self, client, site_data_db):
+        """TC-BE-155: Test prediction site queries run on the AsyncSession dependency"""
+        from sqlalchemy.engine import Connection
+
+        connections = []
+
+        def recording_fetch_columns(bind, *args, **kwargs):
+            # Record whatever connection the route handed to the fetch layer
+            connections.append(bind)
+            return fetch_columns(bind, *args, **kwargs)
+
+        with patch('api.water_quality_prediction.fetch_columns', side_effect=recording_fetch_columns):
+            response = client.get("/api/prediction/sites")
+
+        assert response.status_code == 200
+        assert [site["site_id"] for site in response.json()["sites"]] == ["A1", "B1", "C1", "D1", "E1"]
+        # The sync facade of the AsyncSession's connection, driven by aiosqlite
+        assert isinstance(connections[0], Connection)
+        assert connections[0].engine.dialect.driver == "aiosqlite"
+
+    def test_fetch_columns_types_and_chunks(self, site_data_db):
+        """TC-BE-175: Test fetch_columns returns typed arrays, identical across fetch chunk sizes"""
+        import numpy as np
+        from columnar import clean_site_ids, format_site_ids
+        from api.water_quality_prediction import SITE_DATA_DTYPES
+
+        with site_data_db() as db:
+            db.execute(text("INSERT INTO site_suburb_data (site_id, value_date, ph_value) VALUES ('F1', '2024-02-03', NULL)"))
+            query = "SELECT site_id, chloride_cl as 'Chloride as Cl', value_date as 'Date', ph_value as 'pH' FROM site_suburb_data ORDER BY site_id, value_date"
+            whole = fetch_columns(db, query, dtypes=SITE_DATA_DTYPES)
+            chunked = fetch_columns(db, query, dtypes=SITE_DATA_DTYPES, chunk_size=3)
+
+        assert len(whole) == len(chunked) == 11
+        assert whole['Chloride as Cl'].dtype == np.float64
+        assert np.isnan(whole['pH'][-1])
+        assert whole['Date'][-1] == np.datetime64('2024-02-03')
+        assert whole['site_id'].tolist() == chunked['site_id'].tolist()
+        assert np.array_equal(whole['Chloride as Cl'], chunked['Chloride as Cl'], equal_nan=True)
+        assert np.array_equal(whole['Date'], chunked['Date'])
+        assert whole.take(whole['site_id'] == 'F1').records()[0]['site_id'] == 'F1'
+
+        assert clean_site_ids(np.array([' "100017', '100017 '], dtype=object)).tolist() == ['100017', '100017']
+        assert format_site_ids(np.array(['100017', None], dtype=object)).tolist() == [' "100017', None]
+
+    def test_predict_water_quality_from_database(self, site_data_db):
+        """TC-BE-176: Test a single-site prediction runs on fetched columns and agrees with the batch path"""
+        import risk_linkage
+        from api.water_quality_prediction import predict_sites, predict_water_quality
+
+        params = risk_linkage.load_model_parameters()
+        with site_data_db() as db, patch('api.water_quality_prediction.load_model_parameters', return_value=params):
+            single = predict_water_quality(' "D1', db)
+            batch = predict_sites(risk_linkage.load_site_history(db), params, datetime.now() + timedelta(days=30))
+
+        assert single["site_id"] == ' "D1'
+        assert single["parameters"] == batch["D1"]["parameters"]
+        assert single["risk_level"] == batch["D1"]["risk_level"]
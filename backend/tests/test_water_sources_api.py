@@ -0,0 +1,603 @@
+"""
+Test cases for water sources API
+"""
+import json
+import pytest
+import time
+from datetime import date, datetime
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+
+from models import DEFAULT_FIELDS, HEAVY_FIELDS, WATER_SOURCE_FIELDS, WaterSource
+
+class TestWaterSourcesAPI:
+    """Test cases for water sources API functionality"""
+
+    def test_parse_fields_defaults(self):
+        """TC-BE-110: Test default fieldset defers heavy text columns"""
+        from crud import parse_fields
+
+        assert parse_fields(None) == DEFAULT_FIELDS
+        assert parse_fields("") == DEFAULT_FIELDS
+        assert parse_fields("*") == WATER_SOURCE_FIELDS
+        for field in HEAVY_FIELDS:
+            assert field not in DEFAULT_FIELDS
+
+    def test_parse_fields_validation(self):
+        """TC-BE-111: Test fieldset parsing keeps order and rejects unknown columns"""
+        from crud import parse_fields
+
+        assert parse_fields("id, lat,lon,status,lat") == ("id", "lat", "lon", "status")
+        with pytest.raises(ValueError):
+            parse_fields("id,password")
+        for separators in (",", " , ", ",,"):
+            with pytest.raises(ValueError):
+                parse_fields(separators)
+
+    @pytest.mark.parametrize("snapshot_enabled", [True, False])
+    def test_separator_only_fields_rejected(self, client, water_source_db, snapshot_enabled):
+        """TC-BE-189: Test a ?fields= value made only of separators is a 400 on the snapshot and the SQL path"""
+        with patch("snapshot.SNAPSHOT_ENABLED", snapshot_enabled):
+            for fields in (",", " , "):
+                response = client.get("/api/water-sources/", params={"fields": fields})
+                assert response.status_code == 400
+                assert "No fields given" in response.json()["detail"]
+                assert "SELECT" not in response.text
+
+    def test_list_default_fields(self, client, water_source_db):
+        """TC-BE-112: Test list endpoint omits heavy columns by default"""
+        response = client.get("/api/water-sources/")
+        assert response.status_code == 200
+
+        data = response.json()
+        assert len(data) == 5
+        assert set(data[0].keys()) == set(DEFAULT_FIELDS)
+        assert data[0]["date_ewsp_checked_dt"] == "2024-01-01"
+        assert data[0]["created_at"] == "2024-02-01T09:30:00"
+
+    def test_list_sparse_fields(self, client, water_source_db):
+        """TC-BE-113: Test sparse fieldset returns only requested columns"""
+        response = client.get("/api/water-sources/with-coordinates?fields=id,lat,lon,status")
+        assert response.status_code == 200
+
+        data = response.json()
+        assert len(data) == 4
+        assert data[0] == {"id": 1, "lat": -35.1, "lon": 142.9, "status": "Operational"}
+
+    def test_list_all_fields(self, client, water_source_db):
+        """TC-BE-114: Test '*' includes deferred text columns"""
+        response = client.get("/api/water-sources/status/Limited?fields=*")
+        assert response.status_code == 200
+
+        data = response.json()
+        assert len(data) == 1
+        assert list(data[0].keys()) == list(WATER_SOURCE_FIELDS)
+        assert data[0]["comments"].startswith("Community comments about Hill Standpipe")
+
+    def test_unknown_field_rejected(self, client, water_source_db):
+        """TC-BE-115: Test unknown fields return 400"""
+        response = client.get("/api/water-sources/filter?fields=id,secret")
+        assert response.status_code == 400
+        assert "secret" in response.json()["detail"]
+
+    def test_with_coordinates_pagination(self, client, water_source_db):
+        """TC-BE-116: Test coordinate endpoint paginates in SQL"""
+        response = client.get("/api/water-sources/with-coordinates?skip=1&limit=2&fields=id")
+        assert response.status_code == 200
+        assert response.json() == [{"id": 2}, {"id": 3}]
+
+    def test_list_response_is_raw_json(self, client, water_source_db):
+        """TC-BE-117: Test list endpoints return pre-encoded JSON"""
+        response = client.get("/api/water-sources/?fields=id,created_at")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/json"
+        assert response.json()[0] == {"id": 1, "created_at": "2024-02-01T09:30:00"}
+
+    def test_encode_rows_stdlib_fallback(self):
+        """TC-BE-118: Test stdlib encoder output matches the orjson fast path"""
+        import serializers
+
+        fields = ("id", "location", "date_installed_dt", "created_at")
+        rows = [
+            (1, b"\x01\x02", date(2010, 6, 1), datetime(2024, 2, 1, 9, 30)),
+            (2, None, None, None),
+        ]
+        expected = [
+            {"id": 1, "location": "b'\\x01\\x02'", "date_installed_dt": "2010-06-01", "created_at": "2024-02-01T09:30:00"},
+            {"id": 2, "location": None, "date_installed_dt": None, "created_at": None},
+        ]
+
+        assert json.loads(serializers.encode_rows(rows, fields)) == expected
+        with patch.object(serializers, "orjson", None):
+            assert json.loads(serializers.encode_rows(rows, fields)) == expected
+
+    @pytest.mark.parametrize("path", [
+        "/api/water-sources/?skip=1&limit=3",
+        "/api/water-sources/with-coordinates?skip=1&limit=2",
+        "/api/water-sources/filter?status=Operational&lga=Buloke",
+        "/api/water-sources/nearby?lat=-35.2&lon=143.0&radius_km=30",
+        "/api/water-sources/status/Operational?fields=*",
+        "/api/water-sources/type/tank",
+        "/api/water-sources/lga/Mildura",
+        "/api/water-sources/town/Nyarrin",
+        "/api/water-sources/count",
+    ])
+    def test_snapshot_matches_sql(self, client, water_source_db, path):
+        """TC-BE-119: Test snapshot-served responses match direct SQL queries"""
+        with patch("snapshot.SNAPSHOT_ENABLED", False):
+            expected = client.get(path)
+        actual = client.get(path)
+
+        assert expected.status_code == 200
+        assert actual.status_code == 200
+        assert actual.json() == expected.json()
+
+    def test_snapshot_serves_from_memory(self, client, water_source_db):
+        """TC-BE-120: Test snapshot reads do not query the database"""
+        client.get("/api/water-sources/")
+
+        with patch("crud._fetch") as mock_fetch:
+            response = client.get("/api/water-sources/filter?status=Operational")
+        assert response.status_code == 200
+        assert len(response.json()) == 3
+        mock_fetch.assert_not_called()
+
+    def test_snapshot_exact_match_follows_mysql_collation(self, client, water_source_db):
+        """TC-BE-186: Test snapshot exact matches ignore case and trailing spaces, like MySQL's = on a _ci PAD SPACE column"""
+        with water_source_db() as db:
+            db.execute(WaterSource.__table__.update().where(WaterSource.id == 2).values(status="OPERATIONAL  ", lga="buloke "))
+            db.execute(WaterSource.__table__.update().where(WaterSource.id == 4).values(near_town="MILDURA"))
+            db.commit()
+
+        def ids(path):
+            response = client.get(path + "?fields=id")
+            assert response.status_code == 200
+            return [row["id"] for row in response.json()]
+
+        assert ids("/api/water-sources/status/operational") == [1, 2, 5]
+        assert ids("/api/water-sources/status/Operational ") == [1, 2, 5]
+        assert ids("/api/water-sources/lga/BULOKE") == [1, 2, 3]
+        assert ids("/api/water-sources/town/mildura") == [4, 5]
+        assert ids("/api/water-sources/type/TANK") == [1, 4, 5]
+        assert ids("/api/water-sources/filter") == [1, 2, 3, 4, 5]
+        assert [row["id"] for row in client.get("/api/water-sources/filter?status=operational&fields=id").json()] == [1, 2, 5]
+
+    def test_snapshot_refreshes_on_change(self, water_source_db):
+        """TC-BE-121: Test snapshot reloads only when the table fingerprint changes"""
+        import snapshot
+
+        with water_source_db() as db:
+            first = snapshot.get_snapshot(db)
+            assert first.size == 5
+            assert snapshot.refresh_snapshot(db) is False
+
+            db.execute(WaterSource.__table__.update().where(WaterSource.id == 1).values(created_at=datetime(2025, 1, 1)))
+            db.commit()
+            assert snapshot.refresh_snapshot(db) is True
+
+            second = snapshot.current_snapshot()
+            assert second is not first
+            assert second.max_created_at == datetime(2025, 1, 1)
+
+    def test_facets_counts(self, client, water_source_db):
+        """TC-BE-122: Test facet counts cover every filter column"""
+        response = client.get("/api/water-sources/facets")
+        assert response.status_code == 200
+
+        data = response.json()
+        assert data["total"] == 5
+        assert data["facets"]["status"] == [
+            {"value": "Operational", "count": 3},
+            {"value": "Closed", "count": 1},
+            {"value": "Limited", "count": 1},
+        ]
+        assert data["facets"]["lga"] == [{"value": "Buloke", "count": 3}, {"value": "Mildura", "count": 2}]
+        assert set(data["facets"].keys()) == {"status", "type", "lga", "near_town", "suitable_use"}
+
+    def test_facets_narrowed_by_filters(self, client, water_source_db):
+        """TC-BE-123: Test facets narrowed by applied filters match the SQL fallback"""
+        path = "/api/water-sources/facets?lga=Buloke&suitable_use=drinking"
+        response = client.get(path)
+        with patch("snapshot.SNAPSHOT_ENABLED", False):
+            expected = client.get(path)
+
+        data = response.json()
+        assert data == expected.json()
+        assert data["total"] == 2
+        assert data["facets"]["type"] == [{"value": "standpipe", "count": 1}, {"value": "tank", "count": 1}]
+
+    def test_facets_cached_per_version(self, water_source_db):
+        """TC-BE-124: Test facets are computed once per snapshot version"""
+        import crud
+        import snapshot
+
+        with water_source_db() as db:
+            first = crud.get_water_source_facets(db)
+            assert crud.get_water_source_facets(db) is first
+
+            snapshot.refresh_snapshot(db, force=True)
+            assert crud.get_water_source_facets(db) is not first
+
+    def test_search_ranks_name_matches_first(self, client, water_source_db):
+        """TC-BE-125: Test full-text search ranks by BM25 with field weights"""
+        response = client.get("/api/water-sources/search?q=tank&fields=id,site_name")
+        assert response.status_code == 200
+
+        data = response.json()
+        assert [row["id"] for row in data] == [1, 5]
+        assert data[0]["score"] >= data[1]["score"] > 0
+
+    def test_search_prefix_autocomplete(self, client, water_source_db):
+        """TC-BE-126: Test trailing word matches as a prefix"""
+        data = client.get("/api/water-sources/search?q=mild&fields=id").json()
+        assert sorted(row["id"] for row in data) == [4, 5]
+
+        # A trailing space means the word is complete, so no prefix expansion
+        assert client.get("/api/water-sources/search?q=mild%20&fields=id").json() == []
+
+        suggestions = client.get("/api/water-sources/search/suggest?q=hi").json()
+        assert suggestions == [{"term": "hill", "count": 1}]
+
+    def test_search_index_incremental_sync(self, water_source_db):
+        """TC-BE-127: Test the index only re-tokenises changed rows"""
+        import snapshot
+        from search_index import SearchIndex
+
+        index = SearchIndex()
+        with water_source_db() as db:
+            assert index.sync(snapshot.get_snapshot(db)) == (5, 0, 0)
+
+            db.execute(WaterSource.__table__.update().where(WaterSource.id == 2).values(site_name="Granite Bore"))
+            db.execute(WaterSource.__table__.delete().where(WaterSource.id == 4))
+            db.commit()
+            snapshot.refresh_snapshot(db, force=True)
+            assert index.sync(snapshot.current_snapshot()) == (0, 1, 1)
+
+        assert [doc_id for doc_id, _ in index.search("granite")] == [2]
+        assert index.search("river", prefix=False) == []
+
+    def test_filter_multi_value_case_insensitive(self, client, water_source_db):
+        """TC-BE-128: Test list filters OR within a field and AND across fields, ignoring case"""
+        path = "/api/water-sources/filter?status=operational&status=LIMITED&lga=buloke&lga=Nowhere&fields=id"
+        response = client.get(path)
+        assert response.status_code == 200
+        assert response.json() == [{"id": 1}, {"id": 2}, {"id": 3}]
+
+        with patch("snapshot.SNAPSHOT_ENABLED", False):
+            assert client.get(path).json() == response.json()
+
+        response = client.get("/api/water-sources/filter?suitable_use=Drinking&source_type=tank&fields=id")
+        assert response.json() == [{"id": 1}, {"id": 5}]
+
+    def test_filter_bitmaps_built_once(self, water_source_db):
+        """TC-BE-129: Test per-value bitsets are cached per snapshot version"""
+        import snapshot
+
+        with water_source_db() as db:
+            snap = snapshot.get_snapshot(db)
+            bitmaps = snap.bitmaps("status")
+            assert snap.bitmaps("status") is bitmaps
+            assert set(bitmaps) == {"operational", "limited", "closed"}
+            assert snap.unpack(snap.match_any("status", ["Closed", "limited"])).tolist() == [False, False, True, True, False]
+
+    def test_conditional_get_etag(self, client, water_source_db):
+        """TC-BE-130: Test water-source GETs carry validators and honour If-None-Match"""
+        import snapshot
+        from email.utils import parsedate_to_datetime
+
+        response = client.get("/api/water-sources/?fields=id")
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+        # When the snapshot was loaded (this process saw the table at that version)
+        last_modified = parsedate_to_datetime(response.headers["last-modified"]).timestamp()
+        assert last_modified == int(snapshot.current_snapshot().changed_at)
+        assert response.headers["cache-control"].startswith("public, max-age=")
+
+        with patch("crud._fetch") as mock_fetch, patch("snapshot.fetch_version") as mock_version:
+            cached = client.get("/api/water-sources/?fields=id", headers={"If-None-Match": etag})
+        assert cached.status_code == 304
+        assert cached.content == b""
+        assert cached.headers["etag"] == etag
+        mock_fetch.assert_not_called()
+        mock_version.assert_not_called()
+
+        # Different query, different representation
+        other = client.get("/api/water-sources/?fields=id,lat", headers={"If-None-Match": etag})
+        assert other.status_code == 200
+        assert other.headers["etag"] != etag
+
+    def test_conditional_get_invalidated_by_table_change(self, client, water_source_db):
+        """TC-BE-131: Test validators change with the table version"""
+        import snapshot
+
+        etag = client.get("/api/water-sources/count").headers["etag"]
+        last_modified = client.get("/api/water-sources/count").headers["last-modified"]
+        assert client.get("/api/water-sources/count", headers={"If-Modified-Since": last_modified}).status_code == 304
+
+        # Deleting rows leaves MAX(created_at) alone; Last-Modified still moves to the change
+        with water_source_db() as db, patch("snapshot.time.time", return_value=time.time() + 5):
+            db.execute(WaterSource.__table__.delete().where(WaterSource.id == 2))
+            db.commit()
+            snapshot.refresh_snapshot(db)
+
+        response = client.get("/api/water-sources/count", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.json() == {"total_count": 4}
+        assert response.headers["etag"] != etag
+        assert response.headers["last-modified"] != last_modified
+        assert client.get("/api/water-sources/count", headers={"If-Modified-Since": last_modified}).status_code == 200
+        assert client.get(
+            "/api/water-sources/count", headers={"If-Modified-Since": response.headers["last-modified"]}
+        ).status_code == 304
+
+        # A forced reload of unchanged data keeps the time of the last change
+        changed_at = snapshot.current_snapshot().changed_at
+        with water_source_db() as db:
+            snapshot.refresh_snapshot(db, force=True)
+        assert snapshot.current_snapshot().changed_at == changed_at
+
+    def test_conditional_get_skips_errors_and_other_routes(self, client, water_source_db):
+        """TC-BE-132: Test only successful water-source responses are cacheable"""
+        client.get("/api/water-sources/count")
+        assert "etag" not in client.get("/api/water-sources/filter?fields=secret").headers
+        assert "etag" not in client.get("/health").headers
+
+    def test_conditional_get_only_for_snapshot_reads(self, client, water_source_db):
+        """TC-BE-185: Test responses read from live SQL carry no validators and are never answered with 304"""
+        etag = client.get("/api/water-sources/count").headers["etag"]
+        # /export streams from SQL even with the snapshot on
+        export = client.get("/api/water-sources/export?format=ndjson&fields=id")
+        assert export.status_code == 200
+        assert "etag" not in export.headers and "last-modified" not in export.headers
+
+        # Snapshot off: a snapshot loaded earlier (or by /search) must not validate SQL reads
+        with patch("snapshot.SNAPSHOT_ENABLED", False):
+            client.get("/api/water-sources/search?q=tank")
+            with water_source_db() as db:
+                db.execute(WaterSource.__table__.delete().where(WaterSource.id == 2))
+                db.commit()
+            response = client.get("/api/water-sources/count", headers={"If-None-Match": etag})
+            assert response.status_code == 200
+            assert response.json() == {"total_count": 4}
+            assert "etag" not in response.headers and "last-modified" not in response.headers
+
+    def test_export_ndjson_matches_filter(self, client, water_source_db):
+        """TC-BE-137: Test NDJSON export streams the same rows as /filter"""
+        response = client.get("/api/water-sources/export?format=ndjson&status=operational&fields=id,site_name,created_at")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        assert "water-sources.ndjson" in response.headers["content-disposition"]
+
+        records = [json.loads(line) for line in response.text.splitlines()]
+        expected = client.get("/api/water-sources/filter?status=operational&fields=id,site_name,created_at").json()
+        assert records == expected
+        assert records[0]["created_at"] == "2024-02-01T09:30:00"
+
+    def test_export_csv(self, client, water_source_db):
+        """TC-BE-138: Test CSV export has a header row and empty cells for nulls"""
+        response = client.get("/api/water-sources/export?format=csv&lga=Mildura&fields=id,lat,created_at")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        assert response.text.splitlines() == [
+            "id,lat,created_at",
+            "4,-34.2,2024-02-04T09:30:00",
+            "5,,2024-02-05T09:30:00",
+        ]
+
+    def test_export_geojson(self, client, water_source_db):
+        """TC-BE-139: Test GeoJSON export builds Point features from lat/lon"""
+        response = client.get("/api/water-sources/export?format=geojson&fields=id,status")
+        assert response.status_code == 200
+
+        data = response.json()
+        assert data["type"] == "FeatureCollection"
+        assert len(data["features"]) == 5
+        assert data["features"][0] == {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [142.9, -35.1]},
+            "properties": {"id": 1, "status": "Operational"},
+        }
+        assert data["features"][4]["geometry"] is None
+
+        empty = client.get("/api/water-sources/export?format=geojson&status=Unknown").json()
+        assert empty == {"type": "FeatureCollection", "features": []}
+        assert client.get("/api/water-sources/export?format=xml").status_code == 422
+
+    def test_export_streams_in_chunks(self, water_source_db):
+        """TC-BE-140: Test export reads through the cursor one chunk at a time"""
+        from crud import iter_water_sources
+
+        with water_source_db() as db:
+            chunks = list(iter_water_sources(db, fields=("id",), chunk_size=2))
+        assert chunks == [[(1,), (2,)], [(3,), (4,)], [(5,)]]
+
+    def test_with_risk_links_by_town_then_lga(self, client, site_data_db):
+        """TC-BE-141: Test sources carry the worst forecast risk of sites in their town, else their LGA"""
+        response = client.get("/api/water-sources/with-risk?fields=id,near_town")
+        assert response.status_code == 200
+
+        data = {row["id"]: row for row in response.json()}
+        nyarrin = data[1]["risk"]
+        assert nyarrin["match"] == "town"
+        assert nyarrin["risk_level"] == "Unsafe"
+        assert [site["site_id"] for site in nyarrin["sites"]] == ["A1", "B1"]
+        assert data[2]["risk"] == nyarrin
+
+        # Sea Lake's only site has no model, so Hill Standpipe falls back to its LGA (Buloke)
+        assert data[3]["risk"]["match"] == "lga"
+        assert data[3]["risk"]["risk_level"] == "Moderate"
+        assert [site["site_id"] for site in data[3]["risk"]["sites"]] == ["D1"]
+
+        # Forecasts use the latest reading, not the older opposite one
+        assert data[4]["risk"]["risk_level"] == "Safe"
+        assert data[4]["risk"]["sites"][0]["wqi_score"] > 70
+
+    def test_with_risk_matches_single_prediction(self, site_data_db):
+        """TC-BE-142: Test batch forecasts agree with the per-site prediction path"""
+        import risk_linkage
+        from api.water_quality_prediction import predict_from_history, predict_sites, PARAMETER_NAMES
+
+        with site_data_db() as db:
+            history = risk_linkage.load_site_history(db)
+        params = risk_linkage.load_model_parameters()
+        prediction_date = datetime(2025, 1, 1)
+
+        batch = predict_sites(history, params, prediction_date)
+        assert sorted(batch) == ["A1", "B1", "C1", "D1"]
+        site_rows = history.take(history["site_id"] == "D1")
+        single = predict_from_history("D1", params[' "D1'], len(site_rows), site_rows.row(-1), prediction_date)
+        assert batch["D1"] == single
+        assert set(single["parameters"]) == set(PARAMETER_NAMES)
+
+    def test_with_risk_filters_and_rebuild(self, client, site_data_db):
+        """TC-BE-143: Test filters apply and the linkage rebuilds when either table changes"""
+        import risk_linkage
+        import snapshot
+        from sqlalchemy import text
+
+        response = client.get("/api/water-sources/with-risk?lga=mildura&fields=id")
+        assert [row["id"] for row in response.json()] == [4, 5]
+        first = risk_linkage.current_linkage()
+        etag = response.headers["etag"]
+
+        # Unchanged tables: the linkage is reused
+        client.get("/api/water-sources/with-risk?fields=id")
+        assert risk_linkage.current_linkage() is first
+
+        with site_data_db() as db:
+            db.execute(text("UPDATE site_suburb_data SET ph_value = 3.0, salinity_ec = 9000 WHERE site_id = 'C1'"))
+            db.execute(text("INSERT INTO site_suburb_data (site_id, value_date, nearest_suburb) VALUES ('C1', '2024-01-01', 'Mildura')"))
+            db.commit()
+            assert risk_linkage.refresh_linkage(db, snapshot.current_snapshot()) is True
+
+        response = client.get("/api/water-sources/with-risk?lga=mildura&fields=id", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.json()[0]["risk"]["risk_level"] == "Unsafe"
+
+        with site_data_db() as db:
+            db.execute(WaterSource.__table__.update().where(WaterSource.id == 5).values(near_town="Nyarrin", created_at=datetime(2025, 1, 1)))
+            db.commit()
+            snapshot.refresh_snapshot(db)
+        data = client.get("/api/water-sources/with-risk?lga=mildura&fields=id").json()
+        assert data[1]["risk"]["sites"][0]["site_id"] == "A1"
+        assert risk_linkage.current_linkage() is not first
+
+    def test_risk_linkage_only_validates_with_risk(self, client, site_data_db):
+        """TC-BE-192: Test only /with-risk validators depend on the risk linkage, and equally in every worker"""
+        import risk_linkage
+
+        listing = client.get("/api/water-sources/?fields=id").headers["etag"]
+        first = client.get("/api/water-sources/with-risk?fields=id")
+        assert risk_linkage.current_linkage() is not None
+        # Building the linkage leaves other paths' validators alone
+        assert client.get("/api/water-sources/?fields=id").headers["etag"] == listing
+
+        # A second worker with the same data builds the same ETag
+        risk_linkage.reset_linkage()
+        second = client.get("/api/water-sources/with-risk?fields=id")
+        assert second.headers["etag"] == first.headers["etag"]
+        response = client.get("/api/water-sources/with-risk?fields=id", headers={"If-None-Match": first.headers["etag"]})
+        assert response.status_code == 304
+
+        # Without a current linkage the route runs and builds one rather than answering 304
+        risk_linkage.reset_linkage()
+        response = client.get("/api/water-sources/with-risk?fields=id", headers={"If-None-Match": first.headers["etag"]})
+        assert response.status_code == 200
+        assert response.headers["etag"] == first.headers["etag"]
+
+    def test_count_with_filters(self, client, water_source_db):
+        """TC-BE-144: Test filtered counts match /filter and the SQL fallback"""
+        path = "/api/water-sources/count?status=operational&lga=Buloke&lga=Mildura"
+        response = client.get(path)
+        assert response.status_code == 200
+        assert response.json() == {"total_count": 3}
+
+        with patch("snapshot.SNAPSHOT_ENABLED", False):
+            assert client.get(path).json() == {"total_count": 3}
+
+        rows = client.get("/api/water-sources/filter?status=operational&lga=Buloke&lga=Mildura&fields=id").json()
+        assert len(rows) == 3
+
+    def test_count_cached_per_version(self, water_source_db):
+        """TC-BE-145: Test filtered counts are computed once per snapshot version without querying"""
+        import crud
+        import snapshot
+
+        with water_source_db() as db:
+            assert crud.get_water_sources_count(db, source_type="tank") == 3
+            snap = snapshot.current_snapshot()
+            with patch("crud._filter_mask") as mock_mask, patch("snapshot.fetch_version") as mock_version:
+                assert crud.get_water_sources_count(db, source_type=["TANK"]) == 3
+            mock_mask.assert_not_called()
+            mock_version.assert_not_called()
+            assert ("count", (("type", ("tank",)),)) in snap._derived
+
+    def test_count_approximate(self, client, water_source_db):
+        """TC-BE-146: Test approximate counts use table statistics when available"""
+        from unittest.mock import MagicMock
+        import crud
+
+        # SQLite keeps no row statistics: the exact count is returned and flagged as such
+        assert client.get("/api/water-sources/count?approximate=true").json() == {"total_count": 5, "approximate": False}
+
+        db = MagicMock()
+        db.get_bind.return_value.dialect.name = "mysql"
+        db.execute.return_value.scalar.return_value = 12345
+        assert crud.estimate_water_sources_count(db) == 12345
+        assert "information_schema.TABLES" in str(db.execute.call_args[0][0])
+
+        with patch("api.water_sources.estimate_water_sources_count", return_value=12000):
+            assert client.get("/api/water-sources/count?approximate=true").json() == {"total_count": 12000, "approximate": True}
+            # Filters need an exact count
+            assert client.get("/api/water-sources/count?approximate=true&status=Closed").json() == {"total_count": 1, "approximate": False}
+
+    def test_run_async_matches_sync_session(self, water_source_db):
+        """TC-BE-153: Test crud reads through an AsyncSession return what the sync session returns"""
+        import asyncio
+        from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+        import crud
+        from database import async_database_url
+
+        async_engine = create_async_engine(async_database_url(str(water_source_db.kw["bind"].url)))
+
+        async def read(function, *args, **kwargs):
+            async with AsyncSession(async_engine) as db:
+                return await crud.run_async(db, function, *args, **kwargs)
+
+        try:
+            for snapshot_enabled in (True, False):
+                with patch("snapshot.SNAPSHOT_ENABLED", snapshot_enabled), water_source_db() as db:
+                    assert asyncio.run(read(crud.search_water_sources, lga=["buloke", "Mildura"], fields=("id", "lga"))) == \
+                        crud.search_water_sources(db, lga=["buloke", "Mildura"], fields=("id", "lga"))
+                    assert asyncio.run(read(crud.get_water_sources_count, status="Closed")) == 1
+        finally:
+            asyncio.run(async_engine.dispose())
+
+    def test_run_async_concurrent_cold_reads(self, site_data_db):
+        """TC-BE-154: Test concurrent reads that load the snapshot and risk linkage complete on one event loop"""
+        import asyncio
+        from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+        import crud
+        from database import async_database_url
+
+        async_engine = create_async_engine(async_database_url(str(site_data_db.kw["bind"].url)))
+
+        async def read(function, *args):
+            async with AsyncSession(async_engine) as db:
+                return await crud.run_async(db, function, *args)
+
+        async def cold_reads():
+            # Without turn-taking, a read blocking on the snapshot's thread lock would stall the loop for good
+            return await asyncio.wait_for(asyncio.gather(
+                read(crud.get_water_sources_with_risk),
+                read(crud.get_all_water_sources),
+                read(crud.search_water_sources_text, "nyarrin"),
+                read(crud.get_water_sources_count),
+            ), timeout=10)
+
+        try:
+            with_risk, all_rows, matches, count = asyncio.run(cold_reads())
+        finally:
+            asyncio.run(async_engine.dispose())
+        assert len(with_risk) == len(all_rows) == count == 5
+        assert matches
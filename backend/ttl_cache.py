@@ -0,0 +1,141 @@
+"""
+Bounded LRU cache with per-entry TTL
+
+Entries are kept in recency order (OrderedDict) and evicted least recently
+used first once the entry count or the total size passes its bound. Expiry
+times sit in a min-heap: each get/put pops only the entries whose time has
+come, so expiring never scans the whole cache. Heap items left behind by
+overwritten or evicted keys are skipped when popped, and the heap is rebuilt
+once they outnumber the live entries.
+"""
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+import metrics
+
+
+class _Entry:
+    __slots__ = ("value", "size", "expires_at")
+
+    def __init__(self, value: Any, size: int, expires_at: float):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+
+
+class TTLCache:
+    """LRU cache bounded by entry count and total size, with expiry after `ttl` seconds"""
+
+    def __init__(
+        self,
+        name: str,
+        ttl: float,
+        max_entries: int,
+        max_bytes: int,
+        sizeof: Callable[[Any], int] = lambda value: 1,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._expiry = []  # (expires_at, sequence, key)
+        self._sequence = itertools.count()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self._hits_counter = metrics.counter("cache_hits_total", "Cache lookups answered from the cache", cache=name)
+        self._misses_counter = metrics.counter("cache_misses_total", "Cache lookups that found nothing fresh", cache=name)
+        self._lru_counter = metrics.counter("cache_evictions_total", "Entries dropped from a cache", cache=name, reason="lru")
+        self._expired_counter = metrics.counter("cache_evictions_total", "Entries dropped from a cache", cache=name, reason="expired")
+        metrics.gauge("cache_entries", "Entries held by a cache", cache=name).set_function(lambda: len(self._entries))
+        metrics.gauge("cache_bytes", "Approximate size of a cache's entries", cache=name).set_function(lambda: self._bytes)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            self._expire(self.clock())
+            return key in self._entries
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """The cached value, or None when missing or expired"""
+        with self._lock:
+            self._expire(self.clock())
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                self._misses_counter.inc()
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self._hits_counter.inc()
+            return entry.value
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            self._remove(key)
+            entry = _Entry(value, size, now + (self.ttl if ttl is None else ttl))
+            self._entries[key] = entry
+            self._bytes += size
+            heapq.heappush(self._expiry, (entry.expires_at, next(self._sequence), key))
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                evicted_key = next(iter(self._entries))
+                self._remove(evicted_key)
+                self.evictions += 1
+                self._lru_counter.inc()
+            # Stale heap items (overwritten or evicted keys) wait for their time; compact when they dominate
+            if len(self._expiry) > 2 * len(self._entries) + 64:
+                self._expiry = [(live.expires_at, next(self._sequence), live_key) for live_key, live in self._entries.items()]
+                heapq.heapify(self._expiry)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._expiry.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _remove(self, key: Hashable) -> Optional[_Entry]:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+        return entry
+
+    def _expire(self, now: float):
+        # Only heap items that are due are touched
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, _, key = heapq.heappop(self._expiry)
+            entry = self._entries.get(key)
+            # Skip items for keys since overwritten (new expiry) or evicted
+            if entry is not None and entry.expires_at == expires_at:
+                self._remove(key)
+                self.expirations += 1
+                self._expired_counter.inc()